@@ -1,12 +1,79 @@
 #include <WiFi.h>
-#include <HTTPClient.h>
+#include <WiFiUdp.h>
+#include <Preferences.h>
+#include "mbedtls/md.h"
 
 const char* ssid = "ssid";
 const char* password = "password";
 
-const char* triggerEndpoint = "http://<ip>:<port>/trigger/<triggerId>";
+// Host running control.py, its UdpTriggerListener port and the shared key (TRIGGER_KEY)
+const char* controlHost = "<ip>";
+const int controlPort = 7001;
+const char* triggerKey = "<key>";
+const char* triggerId = "<triggerId>";
 
 const int triggerPin = 15;
+// The pin has to be stable this long before an edge counts
+const unsigned long debounceMs = 50;
+// UDP can drop packets, every event is sent a few times with the same sequence number
+const int repeats = 3;
+const unsigned long repeatIntervalMs = 10;
+
+const uint8_t protocolVersion = 1;
+const size_t signatureSize = 16;
+
+WiFiUDP udp;
+uint32_t bootId;
+uint32_t sequence = 0;
+
+int stableState = LOW;
+int lastReading = LOW;
+unsigned long lastChange = 0;
+
+void putUint32(uint8_t* buffer, uint32_t value) {
+  buffer[0] = value >> 24;
+  buffer[1] = value >> 16;
+  buffer[2] = value >> 8;
+  buffer[3] = value;
+}
+
+void sendTrigger() {
+  uint8_t packet[12 + 255 + 32];
+  size_t idLength = strlen(triggerId);
+
+  // magic, version, trigger id length, boot id, sequence number, trigger id
+  packet[0] = 'H';
+  packet[1] = 'T';
+  packet[2] = protocolVersion;
+  packet[3] = idLength;
+  putUint32(packet + 4, bootId);
+  putUint32(packet + 8, ++sequence);
+  memcpy(packet + 12, triggerId, idLength);
+  size_t bodyLength = 12 + idLength;
+
+  // Truncated HMAC-SHA256 over everything before it
+  uint8_t digest[32];
+  mbedtls_md_context_t ctx;
+  mbedtls_md_init(&ctx);
+  mbedtls_md_setup(&ctx, mbedtls_md_info_from_type(MBEDTLS_MD_SHA256), 1);
+  mbedtls_md_hmac_starts(&ctx, (const unsigned char*)triggerKey, strlen(triggerKey));
+  mbedtls_md_hmac_update(&ctx, packet, bodyLength);
+  mbedtls_md_hmac_finish(&ctx, digest);
+  mbedtls_md_free(&ctx);
+  memcpy(packet + bodyLength, digest, signatureSize);
+
+  for (int i = 0; i < repeats; i++) {
+    udp.beginPacket(controlHost, controlPort);
+    udp.write(packet, bodyLength + signatureSize);
+    udp.endPacket();
+    delay(repeatIntervalMs);
+  }
+
+  Serial.print("Sent trigger ");
+  Serial.print(triggerId);
+  Serial.print(" sequence ");
+  Serial.println(sequence);
+}
 
 void setup() {
 
@@ -15,43 +82,42 @@ void setup() {
   WiFi.begin(ssid, password);
   while (WiFi.status() != WL_CONNECTED) {
     Serial.println("Connecting to WiFi...");
+    delay(500);
   }
   Serial.println("Connected to WiFi");
 
+  // A new boot id lets the sequence start over after a reset, it has to grow so the
+  // control host can drop replays of earlier boots
+  Preferences preferences;
+  preferences.begin("trigger", false);
+  bootId = preferences.getUInt("bootId", 0) + 1;
+  preferences.putUInt("bootId", bootId);
+  preferences.end();
+
   pinMode(triggerPin, INPUT_PULLDOWN);
 
 }
 
 void loop() {
 
-  if (digitalRead(triggerPin) == HIGH) {
-
-    if (WiFi.status() == WL_CONNECTED) {
+  int reading = digitalRead(triggerPin);
+  if (reading != lastReading) {
+    lastReading = reading;
+    lastChange = millis();
+  }
 
-      HTTPClient http;
-      
-      Serial.print("Sending HTTP GET request to: ");
-      Serial.println(triggerEndpoint);
-      
-      http.begin(triggerEndpoint);
-      int httpResponseCode = http.GET();
+  if (reading != stableState && millis() - lastChange >= debounceMs) {
+    stableState = reading;
 
-      if (httpResponseCode > 0) {
-        String response = http.getString();
-        Serial.print("HTTP Response code: ");
-        Serial.println(httpResponseCode);
-        Serial.println("Response: " + response);
+    // Only the rising edge is an event, holding the pin HIGH sends nothing more
+    if (stableState == HIGH) {
+      if (WiFi.status() == WL_CONNECTED) {
+        sendTrigger();
       } else {
-        Serial.print("Error on sending request: ");
-        Serial.println(httpResponseCode);
+        Serial.println("WiFi Disconnected");
       }
-
-      http.end();
-
-    } else {
-
-      Serial.println("WiFi Disconnected");
-
     }
   }
+
+  delay(1);
 }
@@ -1,5 +1,9 @@
-import requests
 import logging
+import time
+from common.fanout import fan_out
+from common.session import session_pool
+
+CUE_LEAD_TIME = 0.2
 
 logging.basicConfig(level=logging.INFO)
 
@@ -9,60 +13,77 @@ class AudioPlayer:
         self.ip = ip
         self.port = port
 
-    def play(self, file: str, volume: float=1, loops=0):
+    def play(self, file: str, volume: float=1, loops=0, at: float=None):
+        params = {'file': file, 'volume': volume, 'loops': loops}
+        if at is not None:
+            params['at'] = at
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/audioplayer/play', params={'file': file, 'volume': volume, 'loops': loops})
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/audioplayer/play', params=params)
             if not res.ok:
                 logging.error(f"Error playing file '{file}'")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
     def stop(self, file: str):
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/audioplayer/stop', params={'file': file})
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/audioplayer/stop', params={'file': file})
             if not res.ok:
                 logging.error(f"Error stopping file '{file}'")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
-    def check_connection(self):
+    def check_connection(self, timeout: float = None):
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/audioplayer/ping')
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/audioplayer/ping', timeout=timeout)
             return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
+
+    def get_cues(self):
+        try:
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/audioplayer/cues')
+            if not res.ok:
+                logging.error(f"Error getting cues")
+                return None
+            return res.json()
+        except Exception as e:
+            logging.error(f"Connection error: {e}")
+            return None
 
     def update(self):
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/audioplayer/update')
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/audioplayer/update')
             if not res.ok:
                 logging.error(f"Error updating files")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
 class AudioPlayerGroup:
 
     def __init__(self, servers: list[AudioPlayer]):
         self.servers = servers
 
-    def play(self, file: str, volume: float=1, loops=0):
-        for server in self.servers:
-            server.play(file, volume, loops=loops)
-
+    def play(self, file: str, volume: float=1, loops=0, lead: float=CUE_LEAD_TIME, at: float=None):
+        """Play a file on all servers at a common start time lead seconds from now, or right away if lead is None."""
+        if at is None and lead is not None:
+            at = time.time() + lead
+        return fan_out(self.servers, lambda server: server.play(file, volume, loops=loops, at=at))
 
     def stop(self, file: str):
-        for server in self.servers:
-            server.stop(file)
+        return fan_out(self.servers, lambda server: server.stop(file))
 
     def check_connection(self):
-        results = []
-        for server in self.servers:
-            results.append(server.check_connection())
-        return results
+        return fan_out(self.servers, lambda server: server.check_connection()).values()
 
     def update(self):
-        for server in self.servers:
-            server.update()
+        return fan_out(self.servers, lambda server: server.update())
 
 
 if __name__ == '__main__':
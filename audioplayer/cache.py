@@ -0,0 +1,159 @@
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable
+
+CACHE_BUDGET_BYTES = 64 * 1024 * 1024
+
+logging.basicConfig(level=logging.INFO)
+
+class SampleCache:
+    def __init__(self, assets_dir: Path, loader: Callable, budget: int = CACHE_BUDGET_BYTES, pinned: Iterable[str] = ()):
+        """
+        Lazily decoded audio samples with an LRU byte budget.
+
+        :param assets_dir: Directory containing the wav files.
+        :param loader: Creates a sample from a file path, the sample must provide size() and is_playing().
+        :param budget: Maximum number of bytes of decoded audio kept in memory, pinned samples included.
+        :param pinned: Keys of samples that are loaded up front and never evicted.
+        """
+        self.assets_dir = assets_dir
+        self.loader = loader
+        self.budget = budget
+        self.pinned = set(pinned)
+        self.index = {}
+        self.samples = OrderedDict()
+        # Samples of changed or removed files that were still playing, kept until they finish
+        self.retired = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def keys(self) -> list:
+        return list(self.index)
+
+    def rescan(self) -> dict:
+        """
+        Update the file index and drop samples whose file changed or disappeared.
+
+        Files are compared by modification time and size, unchanged samples stay loaded.
+        """
+        if not self.assets_dir.exists():
+            raise FileNotFoundError(f"The directory '{self.assets_dir}' does not exist.")
+
+        found = {}
+        for wav_file in self.assets_dir.glob('*.wav'):
+            stat = wav_file.stat()
+            found[wav_file.stem] = (str(wav_file), stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            added = [key for key in found if key not in self.index]
+            removed = [key for key in self.index if key not in found]
+            changed = [key for key in found if key in self.index and found[key] != self.index[key]]
+            for key in removed + changed:
+                self._retire(key)
+            self._prune_retired()
+            self.index = found
+
+        for key in self.pinned:
+            if key in found:
+                self.get(key)
+            else:
+                logging.warning(f"Pinned sample '{key}' not found in {self.assets_dir}")
+
+        changes = {'added': added, 'changed': changed, 'removed': removed}
+        logging.info(f"Rescanned audio files: {changes}")
+        return changes
+
+    def get(self, key: str):
+        """Return the sample for key, decoding it on first use."""
+        with self.lock:
+            if key in self.samples:
+                self.samples.move_to_end(key)
+                self.hits += 1
+                return self.samples[key]
+            if key not in self.index:
+                raise KeyError(f"Audio file '{key}' not found")
+            self.misses += 1
+            path = self.index[key][0]
+
+        # Decode outside the lock so plays of cached samples are not held up
+        sample = self.loader(path)
+
+        with self.lock:
+            if key in self.samples:
+                return self.samples[key]
+            self.samples[key] = sample
+            self.bytes += sample.size()
+            logging.info(f"Loaded audio file '{key}' ({sample.size()} bytes, {self.bytes}/{self.budget} bytes cached)")
+            self._evict()
+            return sample
+
+    def peek(self, key: str):
+        """Return the sample for key if it is loaded, without loading it."""
+        with self.lock:
+            return self.samples.get(key)
+
+    def playing(self, key: str) -> list:
+        """Samples of key that are playing, including those of an older version of the file."""
+        with self.lock:
+            self._prune_retired()
+            samples = self.retired.get(key, [])[:]
+            if key in self.samples and self.samples[key].is_playing():
+                samples.append(self.samples[key])
+            return samples
+
+    def _retire(self, key: str):
+        """Unload a sample whose file changed, one that is playing stays around until it finished."""
+        sample = self.samples.pop(key, None)
+        if sample is None:
+            return
+        if sample.is_playing():
+            self.retired.setdefault(key, []).append(sample)
+        else:
+            self.bytes -= sample.size()
+
+    def _prune_retired(self):
+        for key in list(self.retired):
+            for sample in [sample for sample in self.retired[key] if not sample.is_playing()]:
+                self.retired[key].remove(sample)
+                self.bytes -= sample.size()
+            if not self.retired[key]:
+                del self.retired[key]
+
+    def _drop(self, key: str):
+        sample = self.samples.pop(key, None)
+        if sample is not None:
+            self.bytes -= sample.size()
+
+    def _evict(self):
+        self._prune_retired()
+        for key in list(self.samples):
+            if self.bytes <= self.budget:
+                return
+            sample = self.samples[key]
+            if key in self.pinned or sample.is_playing():
+                continue
+            self._drop(key)
+            self.evictions += 1
+            logging.info(f"Evicted audio file '{key}'")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bytes': self.bytes,
+                'budget': self.budget,
+                'loaded': list(self.samples),
+                'retired': sorted(self.retired),
+                'pinned': sorted(self.pinned),
+                'files': len(self.index),
+            }
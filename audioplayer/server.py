@@ -3,10 +3,21 @@ import os
 from flask import Flask, request, jsonify
 from pathlib import Path
 import logging
+import threading
+import time
+from collections import deque
+from audioplayer.cache import SampleCache, CACHE_BUDGET_BYTES
+from common.clock import Clock
+
+STREAMING_THRESHOLD_BYTES = 4 * 1024 * 1024
+MAX_CUE_DELAY = 60
+CUE_SPIN_TIME = 0.002
+CUE_LOG_SIZE = 100
 
 logging.basicConfig(level=logging.INFO)
 
 class AudioFile:
+    mode = 'preloaded'
 
     def __init__(self, file_path: str):
         if not os.path.isfile(file_path):
@@ -16,44 +27,136 @@ class AudioFile:
     
     def _is_playing(self) -> bool:
         return self.sound.get_num_channels() > 0
+
+    def is_playing(self) -> bool:
+        return self._is_playing()
+
+    def size(self) -> int:
+        """Approximate number of bytes of decoded audio held by the sound."""
+        frequency, format, channels = pygame.mixer.get_init()
+        return int(self.sound.get_length() * frequency * channels * abs(format) // 8)
         
     def play(self, volume: float = 1.0, loops=0):
+        self.prepare(volume, loops)()
+
+    def prepare(self, volume: float = 1.0, loops=0):
+        """Stop the sound and reserve a mixer channel, returns a callable that starts playback."""
         if self._is_playing():
             self.stop()
         
         self.sound.set_volume(volume)
-        self.sound.play(loops)
+        channel = pygame.mixer.find_channel(True)
+        return lambda: channel.play(self.sound, loops)
 
     def stop(self):
         if self._is_playing():
             self.sound.stop()
 
 
+class StreamedAudioFile:
+    """
+    Long audio file that is decoded from disk in chunks while it plays.
+
+    pygame has a single music stream, so starting another streamed file stops the current one.
+    Short effects keep playing on the mixer channels alongside it.
+    """
+    mode = 'streamed'
+    _current = None
+    _lock = threading.Lock()
+
+    def __init__(self, file_path: str):
+        if not os.path.isfile(file_path):
+            raise ValueError(f"File '{file_path}' not found")
+
+        self.file_path = file_path
+
+    def is_playing(self) -> bool:
+        return StreamedAudioFile._current is self and pygame.mixer.music.get_busy()
+
+    def size(self) -> int:
+        """Streamed files keep no decoded audio in memory."""
+        return 0
+
+    def play(self, volume: float = 1.0, loops=0):
+        self.prepare(volume, loops)()
+
+    def prepare(self, volume: float = 1.0, loops=0):
+        """
+        Returns a callable that opens the file on the music stream and starts playback.
+
+        Loading replaces whatever the music stream is playing, so it waits for the start.
+        """
+        def start():
+            with StreamedAudioFile._lock:
+                if StreamedAudioFile._current is not self:
+                    pygame.mixer.music.load(self.file_path)
+                    StreamedAudioFile._current = self
+                pygame.mixer.music.set_volume(volume)
+                pygame.mixer.music.play(loops)
+        return start
+
+    def stop(self):
+        with StreamedAudioFile._lock:
+            if StreamedAudioFile._current is self:
+                pygame.mixer.music.stop()
+
+
 class AudioPlayer:
 
-    def __init__(self):
-        self.audio_files = {}
+    def __init__(self, budget: int = CACHE_BUDGET_BYTES, pinned: list = (), streaming_threshold: int = STREAMING_THRESHOLD_BYTES, clock: Clock = None):
+        """
+        :param budget: Maximum bytes of decoded audio kept in memory.
+        :param pinned: Files that are loaded at startup and never evicted.
+        :param streaming_threshold: Files larger than this many bytes on disk are streamed instead of preloaded.
+        :param clock: Clock that scheduled start times refer to, the local clock if omitted.
+        """
         pygame.mixer.init()
+        self.streaming_threshold = streaming_threshold
+        self.clock = clock or Clock()
+        module_dir = Path(__file__).parent
+        self.audio_files = SampleCache(module_dir / 'assets', self._load_audio_file, budget, pinned)
+        self.cues = deque(maxlen=CUE_LOG_SIZE)
         self.load_audio_files()
 
+    def _load_audio_file(self, file_path: str):
+        if os.path.getsize(file_path) > self.streaming_threshold:
+            return StreamedAudioFile(file_path)
+        return AudioFile(file_path)
+
+    def schedule(self, file: str, volume: float, loops: int, at: float):
+        """
+        Play a file at an absolute time on the reference clock.
+
+        The sample is loaded and its channel reserved right away, a cue thread sleeps until
+        shortly before the start time and spins for the rest so playback starts within a
+        few milliseconds of it. Streamed files are only opened at the start time, opening one
+        stops the music that is playing.
+        """
+        start = self.audio_files.get(file).prepare(volume, loops)
+        cue = {'file': file, 'scheduled': at, 'started': None}
+        self.cues.append(cue)
+        threading.Thread(target=self._run_cue, args=(cue, start), daemon=True).start()
+
+    def _run_cue(self, cue: dict, start):
+        local_start = self.clock.to_local(cue['scheduled'])
+        remaining = local_start - time.time()
+        if remaining > CUE_SPIN_TIME:
+            time.sleep(remaining - CUE_SPIN_TIME)
+        while time.time() < local_start:
+            pass
+        start()
+        cue['started'] = self.clock.to_reference(time.time())
+        logging.info(f"Cue '{cue['file']}' started {(cue['started'] - cue['scheduled']) * 1000:.2f} ms after its start time")
+
     def load_audio_files(self):
-        module_dir = Path(__file__).parent
-        assets_dir = module_dir / 'assets'
-        
-        if not assets_dir.exists():
-            raise FileNotFoundError(f"The directory '{assets_dir}' does not exist.")
-        
-        for wav_file in assets_dir.glob('*.wav'):
-            file_key = wav_file.stem
-            self.audio_files[file_key] = AudioFile(str(wav_file))
-        
-        logging.info(f"Loaded audio files: {self.audio_files}")
+        """Index the asset directory, only changed files are reloaded."""
+        return self.audio_files.rescan()
 
 
 class AudioPlayerServer:
-    def __init__(self, app: Flask):
+    def __init__(self, app: Flask, budget: int = CACHE_BUDGET_BYTES, pinned: list = (), streaming_threshold: int = STREAMING_THRESHOLD_BYTES, clock: Clock = None):
         self.app = app
-        self.audio_manager = AudioPlayer()
+        self.audio_manager = AudioPlayer(budget, pinned, streaming_threshold, clock)
         self._setup_routes()
 
     def _validate_file(self, file: str):
@@ -71,10 +174,17 @@ class AudioPlayerServer:
         @self.app.route('/api/audioplayer/update', methods=['GET'])
         def update():
             try:
-                self.audio_manager.load_audio_files()
+                changes = self.audio_manager.load_audio_files()
             except Exception as e:
                 return jsonify(error=str(e)), 500
-            return "", 200
+            return jsonify(changes), 200
+
+        @self.app.route('/api/audioplayer/cache', methods=['GET'])
+        def cache_stats():
+            stats = self.audio_manager.audio_files.stats()
+            samples = [self.audio_manager.audio_files.peek(key) for key in stats['loaded']]
+            stats['streamed'] = [key for key, sample in zip(stats['loaded'], samples) if sample and sample.mode == 'streamed']
+            return jsonify(stats), 200
         
         @self.app.route('/api/audioplayer/play', methods=['GET'])
         def play():
@@ -82,28 +192,47 @@ class AudioPlayerServer:
             volume = request.args.get('volume', '1')
             loops = request.args.get('loops', '0')
 
-            if not self._validate_file:
+            if not self._validate_file(file):
                 return jsonify(error="File not found"), 404
 
             if not self._validate_volume(volume):
                 return jsonify(error="Invalid volume"), 400
+
+            at = request.args.get('at', type=float)
+            if at is not None and not self.audio_manager.clock.status()['synchronised']:
+                # Without a synchronised clock the start time says nothing, the sender's lead is small so play now
+                logging.warning(f"Clock not synchronised, playing sound '{file}' right away instead of at {at}")
+                at = None
+            if at is not None and at - self.audio_manager.clock.now() > MAX_CUE_DELAY:
+                return jsonify(error="Start time too far in the future"), 400
             
             try:
-                self.audio_manager.audio_files[file].play(volume=float(volume), loops=int(loops))
+                if at is not None:
+                    self.audio_manager.schedule(file, float(volume), int(loops), at)
+                    logging.info(f"Scheduled sound '{file}' with volume {volume} at {at}")
+                    return "", 200
+                self.audio_manager.audio_files.get(file).play(volume=float(volume), loops=int(loops))
                 logging.info(f"Playing sound '{file}' with volume {volume}")
                 return "", 200
             except Exception as e:
                 return jsonify(error=str(e)), 500
 
+        @self.app.route('/api/audioplayer/cues', methods=['GET'])
+        def cues():
+            return jsonify(list(self.audio_manager.cues)), 200
+
         @self.app.route('/api/audioplayer/stop', methods=['GET'])
         def stop_audio_player():
             file = request.args.get('file')
+            # A file that changed or was removed while playing can still be stopped
+            playing = self.audio_manager.audio_files.playing(file) if file else []
 
-            if not self._validate_file(file):
+            if not playing and not self._validate_file(file):
                 return jsonify(error="File not found"), 404
             
             try:
-                self.audio_manager.audio_files[file].stop()
+                for audio_file in playing:
+                    audio_file.stop()
                 logging.info(f"Stopping sound '{file}'")
                 return "", 200
             except Exception as e:
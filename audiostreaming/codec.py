@@ -0,0 +1,198 @@
+import numpy as np
+from audiostreaming.protocol import CODEC_PCM16, CODEC_ADPCM, CODEC_OPUS
+
+try:
+    import opuslib
+except Exception:
+    # opuslib raises a plain Exception when the shared Opus library is missing
+    opuslib = None
+
+SAMPLE_WIDTH = 2
+
+# IMA ADPCM tables
+ADPCM_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8] * 2
+ADPCM_STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+]
+# Per channel block header: initial predictor (int16) and step index (uint8), padded to 4 bytes
+ADPCM_BLOCK_HEADER = np.dtype([('predictor', '<i2'), ('index', 'u1'), ('reserved', 'u1')])
+
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_FRAME_DURATIONS_MS = (2.5, 5, 10, 20, 40, 60)
+OPUS_MAX_PACKET_SIZE = 4000
+
+
+class PcmCodec:
+    id = CODEC_PCM16
+    name = 'pcm'
+
+    def __init__(self, channels: int, rate: int, chunk: int):
+        """Uncompressed 16 bit PCM, frames are passed through without copying."""
+        self.channels = channels
+        self.rate = rate
+        self.chunk = chunk
+
+    def max_payload_size(self) -> int:
+        return self.chunk * self.channels * SAMPLE_WIDTH
+
+    def encode(self, pcm):
+        return pcm
+
+    def decode(self, payload):
+        return payload
+
+
+class AdpcmCodec(PcmCodec):
+    id = CODEC_ADPCM
+    name = 'adpcm'
+
+    def __init__(self, channels: int, rate: int, chunk: int):
+        """
+        IMA ADPCM, 4 bits per sample.
+
+        Every frame starts with the predictor state of each channel, so a lost frame
+        does not corrupt the frames after it.
+        """
+        super().__init__(channels, rate, chunk)
+        self.predictors = [0] * channels
+        self.indices = [0] * channels
+
+    def _channel_size(self, samples: int) -> int:
+        return ADPCM_BLOCK_HEADER.itemsize + (samples + 1) // 2
+
+    def max_payload_size(self) -> int:
+        return self.channels * self._channel_size(self.chunk)
+
+    def encode(self, pcm) -> bytes:
+        samples = np.frombuffer(pcm, dtype='<i2').reshape(-1, self.channels)
+        blocks = []
+        for channel in range(self.channels):
+            header = np.array([(self.predictors[channel], self.indices[channel], 0)], dtype=ADPCM_BLOCK_HEADER)
+            codes, self.predictors[channel], self.indices[channel] = self._encode_channel(
+                samples[:, channel].tolist(), self.predictors[channel], self.indices[channel])
+            blocks.append(header.tobytes())
+            blocks.append(self._pack(codes))
+        return b"".join(blocks)
+
+    def decode(self, payload) -> bytes:
+        channel_size = len(payload) // self.channels
+        samples_per_channel = (channel_size - ADPCM_BLOCK_HEADER.itemsize) * 2
+        out = np.empty((samples_per_channel, self.channels), dtype='<i2')
+        for channel in range(self.channels):
+            block = payload[channel * channel_size:(channel + 1) * channel_size]
+            header = np.frombuffer(block[:ADPCM_BLOCK_HEADER.itemsize], dtype=ADPCM_BLOCK_HEADER)[0]
+            codes = self._unpack(block[ADPCM_BLOCK_HEADER.itemsize:])
+            out[:, channel] = self._decode_channel(codes.tolist(), int(header['predictor']), int(header['index']))
+        return out.tobytes()
+
+    @staticmethod
+    def _pack(codes: list) -> bytes:
+        nibbles = np.array(codes, dtype=np.uint8)
+        if len(nibbles) % 2:
+            nibbles = np.append(nibbles, np.uint8(0))
+        return (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+    @staticmethod
+    def _unpack(data) -> np.ndarray:
+        packed = np.frombuffer(data, dtype=np.uint8)
+        codes = np.empty(len(packed) * 2, dtype=np.uint8)
+        codes[0::2] = packed & 0x0F
+        codes[1::2] = packed >> 4
+        return codes
+
+    @staticmethod
+    def _encode_channel(samples: list, predictor: int, index: int):
+        # The predictor recurrence is sequential, plain ints are faster here than NumPy scalars
+        codes = []
+        append = codes.append
+        for sample in samples:
+            step = ADPCM_STEP_TABLE[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                delta += step >> 2
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += ADPCM_INDEX_TABLE[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            append(code)
+        return codes, predictor, index
+
+    @staticmethod
+    def _decode_channel(codes: list, predictor: int, index: int) -> list:
+        samples = []
+        append = samples.append
+        for code in codes:
+            step = ADPCM_STEP_TABLE[index]
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += ADPCM_INDEX_TABLE[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            append(predictor)
+        return samples
+
+
+class OpusCodec(PcmCodec):
+    id = CODEC_OPUS
+    name = 'opus'
+
+    def __init__(self, channels: int, rate: int, chunk: int):
+        """Opus through opuslib, needs one of the Opus sample rates and frame durations."""
+        if opuslib is None:
+            raise ValueError("Opus codec requires the opuslib package")
+        if rate not in OPUS_RATES:
+            raise ValueError(f"Opus does not support a sample rate of {rate} Hz")
+        if chunk * 1000 / rate not in OPUS_FRAME_DURATIONS_MS:
+            raise ValueError(f"Opus does not support frames of {chunk} samples at {rate} Hz")
+        super().__init__(channels, rate, chunk)
+        self.encoder = opuslib.Encoder(rate, channels, opuslib.APPLICATION_AUDIO)
+        self.decoder = opuslib.Decoder(rate, channels)
+
+    def max_payload_size(self) -> int:
+        return OPUS_MAX_PACKET_SIZE
+
+    def encode(self, pcm) -> bytes:
+        return self.encoder.encode(bytes(pcm), self.chunk)
+
+    def decode(self, payload) -> bytes:
+        return self.decoder.decode(bytes(payload), self.chunk)
+
+
+CODECS = {codec.name: codec for codec in (PcmCodec, AdpcmCodec, OpusCodec)}
+
+
+def available_codecs() -> list:
+    """Names of the codecs that can be used on this host."""
+    return [name for name, codec in CODECS.items() if codec is not OpusCodec or opuslib is not None]
+
+
+def get_codec(name: str, channels: int, rate: int, chunk: int) -> PcmCodec:
+    """Create a codec by name, raises ValueError for unknown or unavailable codecs."""
+    if name not in available_codecs():
+        raise ValueError(f"Codec '{name}' is not available, choose one of {available_codecs()}")
+    return CODECS[name](channels, rate, chunk)
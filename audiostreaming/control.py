@@ -1,10 +1,14 @@
-import requests
 import logging
 from flask import Flask, request, jsonify
 import time
 import threading
+from common.fanout import fan_out
+from common.session import session_pool
 
 INPUT_TIMEOUT = 5
+MULTICAST_GROUP_PREFIX = "239.255.42."
+MULTICAST_BASE_PORT = 50100
+MULTICAST_MAX_GROUPS = 254
 
 logging.basicConfig(level=logging.INFO)
 
@@ -12,54 +16,63 @@ class StreamingOutput:
     def __init__(self, ip, port):
         self.ip = ip
         self.port = port
-    def check_connection(self):
+    def check_connection(self, timeout: float = None):
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/streamingoutput/ping')
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/streamingoutput/ping', timeout=timeout)
             return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
             
-    def start(self, server):
+    def start(self, server, codec='pcm', group=None):
+        url = f'http://{self.ip}:{self.port}/api/streamingoutput/start?ip={server[0]}&port={server[1]}&codec={codec}'
+        if group:
+            url += f'&group={group[0]}:{group[1]}'
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/streamingoutput/start?ip={server[0]}&port={server[1]}')
+            res = session_pool.get(url)
             if not res.ok:
                 logging.error(f"Error starting stream client")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
     def stop(self, server):
         try:
-            res = requests.get(f'http://{self.ip}:{self.port}/api/streamingoutput/stop?ip={server[0]}&port={server[1]}', timeout=1)
+            res = session_pool.get(f'http://{self.ip}:{self.port}/api/streamingoutput/stop?ip={server[0]}&port={server[1]}', timeout=1)
             if not res.ok:
                 logging.error(f"Error stopping stream client")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
 class StreamingOutputGroup:
 
     def __init__(self, outputs: list[StreamingOutput]):
         self.outputs = outputs
 
-    def start(self, server):
-        for client in self.outputs:
-            client.start(server)
+    def start(self, server, codec='pcm', group=None):
+        return fan_out(self.outputs, lambda client: client.start(server, codec, group))
 
     def stop(self, server):
-        for client in self.outputs:
-            client.stop(server)
+        return fan_out(self.outputs, lambda client: client.stop(server))
 
     def check_connection(self):
-        results = []
-        for client in self.outputs:
-            result = client.check_connection()
-            results.append(result)
-        return results
+        return fan_out(self.outputs, lambda client: client.check_connection()).values()
     
 class StreamingControlServerRoutes:
-    def __init__(self, app: Flask, outputs: dict[StreamingOutput | StreamingOutputGroup]): 
+    def __init__(self, app: Flask, outputs: dict[StreamingOutput | StreamingOutputGroup], multicast: bool = False): 
+        """
+        :param multicast: Hand out multicast groups to inputs that ask for one. Leave disabled
+                          on networks that drop multicast, inputs then stream unicast.
+        """
         self.app = app
         self.outputs = outputs
+        self.multicast = multicast
         self.inputs = []
+        self.groups = {}
+        self.inputs_changed = threading.Condition()
         self._setup_routes()
         thread = threading.Thread(target=self.clean_input_list, daemon=True)
         thread.start()
@@ -78,22 +91,66 @@ class StreamingControlServerRoutes:
         def register():
             current_time = time.time()
             newInputs = request.get_json()  
-            for newInput in newInputs:
-                existing_input = next((item for item in self.inputs if item[0] == newInput), None)
-                input = (newInput, current_time, False)
-
-                if existing_input:
-                    self.inputs.remove(existing_input)
-                else:
-                    print(f'Input {input} connected') 
-
-                self.inputs.append(input)
-
-            return "", 200
+            assignments = {}
+            with self.inputs_changed:
+                for newInput in newInputs:
+                    existing_input = next((item for item in self.inputs if item[0] == newInput), None)
+                    input = (newInput, current_time, False)
+
+                    if existing_input:
+                        self.inputs.remove(existing_input)
+                    else:
+                        print(f'Input {input} connected') 
+
+                    self.inputs.append(input)
+
+                    if self.multicast and newInput.get("multicast"):
+                        group = self._assign_group((newInput["ip"], newInput["port"]))
+                        if group:
+                            assignments[f'{newInput["ip"]}:{newInput["port"]}'] = group
+                self.inputs_changed.notify()
+
+            return jsonify(assignments), 200
+
+    def _assign_group(self, server):
+        """Multicast group and port of an input, allocating a free one on first use."""
+        if server in self.groups:
+            return self.groups[server]
+        used = set(self.groups.values())
+        for index in range(1, MULTICAST_MAX_GROUPS + 1):
+            group = (f"{MULTICAST_GROUP_PREFIX}{index}", MULTICAST_BASE_PORT + index)
+            if group not in used:
+                self.groups[server] = group
+                print(f'Assigned multicast group {group} to input {server}')
+                return group
+        print(f'No multicast group left for input {server}, falling back to unicast')
+        return None
+
+    def _release_group(self, server):
+        if not any((i[0]["ip"], i[0]["port"]) == server for i in self.inputs):
+            self.groups.pop(server, None)
+
+    def _next_wakeup(self):
+        """Seconds until the next input times out, 0 if an input is waiting to be started, None if idle."""
+        if any(not i[2] for i in self.inputs):
+            return 0
+        if not self.inputs:
+            return None
+        return max(0, min(i[1] for i in self.inputs) + INPUT_TIMEOUT - time.time())
         
     def clean_input_list(self):
         while True:
-            timedOutInputs = [i for i in self.inputs if time.time() - i[1] > INPUT_TIMEOUT]
+            with self.inputs_changed:
+                timeout = self._next_wakeup()
+                if timeout != 0:
+                    self.inputs_changed.wait(timeout)
+
+                timedOutInputs = [i for i in self.inputs if time.time() - i[1] > INPUT_TIMEOUT]
+                for input in timedOutInputs:
+                    self.inputs.remove(input)
+                for input in timedOutInputs:
+                    self._release_group((input[0]["ip"], input[0]["port"]))
+                newInputs = [(i, self.groups.get((i[0]["ip"], i[0]["port"]))) for i in self.inputs if not i[2]]
             
             for input in timedOutInputs:
                 for output in input[0]["outputs"]:
@@ -101,20 +158,18 @@ class StreamingControlServerRoutes:
                         self.outputs[output].stop((input[0]["ip"], input[0]["port"]))
                     except Exception as e:
                         print(e)
-                self.inputs.remove(input)
                 print(f'Client {input} disconnected')
 
-            for i, input in enumerate(self.inputs):
-                if not input[2]:
-                    try:
-                        for output in input[0]["outputs"]:
-                            self.outputs[output].start((input[0]["ip"], input[0]["port"]))
-                        self.inputs[i] = (input[0], input[1], True)
-                    except Exception as e:
-                        print(e)
-                    
-
-
+            for input, group in newInputs:
+                try:
+                    for output in input[0]["outputs"]:
+                        self.outputs[output].start((input[0]["ip"], input[0]["port"]), input[0].get("codec", "pcm"), group)
+                except Exception as e:
+                    print(e)
+                with self.inputs_changed:
+                    # The input may have re-registered while its outputs were started
+                    if input in self.inputs:
+                        self.inputs[self.inputs.index(input)] = (input[0], input[1], True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from typing import Callable
+import numpy as np
+from audiostreaming.ringbuffer import FrameRing
+
+BAND_COUNT = 8
+BAND_LOW_HZ = 40
+BAND_HIGH_HZ = 16000
+# Per chunk decay of the automatic gain, about 5 seconds to halve at 43 chunks per second
+GAIN_DECAY = 0.997
+ONSET_HISTORY = 43
+ONSET_SENSITIVITY = 1.5
+ONSET_REFRACTORY = 0.1
+TAP_CAPACITY = 8
+
+logging.basicConfig(level=logging.INFO)
+
+
+class AudioFeatures:
+    def __init__(self, rate: int, chunk: int, channels: int = 1, bands: int = BAND_COUNT,
+                 low: float = BAND_LOW_HZ, high: float = BAND_HIGH_HZ):
+        """
+        Per chunk loudness, band energies and onsets of 16 bit PCM audio.
+
+        Everything that only depends on the chunk size is precomputed, processing a chunk is
+        a handful of vectorised NumPy calls. Levels are normalised against a slowly decaying
+        peak so they use the full 0 to 1 range regardless of the input gain.
+
+        :param rate: Sample rate in Hz.
+        :param chunk: Samples per channel in a chunk.
+        :param channels: Interleaved channels, mixed down to mono.
+        :param bands: Number of logarithmically spaced frequency bands.
+        """
+        self.rate = rate
+        self.chunk = chunk
+        self.channels = channels
+        self.chunk_duration = chunk / rate
+        self.window = np.hanning(chunk).astype(np.float32)
+
+        freqs = np.fft.rfftfreq(chunk, 1 / rate)
+        edges = np.searchsorted(freqs, np.geomspace(low, min(high, rate / 2), bands + 1))
+        # Low bands can be narrower than one bin, give every band at least one
+        for i in range(1, len(edges)):
+            edges[i] = max(edges[i], edges[i - 1] + 1)
+        if edges[-1] > len(freqs):
+            raise ValueError(f"Chunk of {chunk} samples too short for {bands} bands")
+        self.first_bin = edges[0]
+        self.last_bin = edges[-1]
+        self.band_starts = edges[:-1] - edges[0]
+
+        self.band_peak = np.full(bands, 1e-6, dtype=np.float32)
+        self.rms_peak = 1e-6
+        self.previous_magnitude = np.zeros(self.last_bin - self.first_bin, dtype=np.float32)
+        self.flux_history = np.zeros(ONSET_HISTORY, dtype=np.float32)
+        self.flux_index = 0
+        self.last_onset = -ONSET_REFRACTORY
+        self.time = 0.0
+
+    def process(self, data) -> dict:
+        """
+        Features of one chunk of interleaved 16 bit samples.
+
+        :return: rms and level (0 to 1), bands (0 to 1 per band), flux and onset.
+        """
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        samples *= 1 / 32768
+        if len(samples) != self.chunk:
+            samples = np.resize(samples, self.chunk) if len(samples) else np.zeros(self.chunk, dtype=np.float32)
+
+        rms = float(np.sqrt(np.dot(samples, samples) / self.chunk))
+        self.rms_peak = max(rms, self.rms_peak * GAIN_DECAY)
+
+        magnitude = np.abs(np.fft.rfft(samples * self.window))[self.first_bin:self.last_bin].astype(np.float32)
+        energy = np.add.reduceat(magnitude * magnitude, self.band_starts)
+        np.maximum(energy, self.band_peak * GAIN_DECAY, out=self.band_peak)
+
+        # Spectral flux, only rising energy counts towards an onset
+        flux = float(np.maximum(magnitude - self.previous_magnitude, 0).sum())
+        self.previous_magnitude = magnitude
+        threshold = self.flux_history.mean() + ONSET_SENSITIVITY * self.flux_history.std()
+        self.flux_history[self.flux_index] = flux
+        self.flux_index = (self.flux_index + 1) % ONSET_HISTORY
+        onset = flux > threshold and self.time - self.last_onset >= ONSET_REFRACTORY and rms > 0.01 * self.rms_peak
+        if onset:
+            self.last_onset = self.time
+        self.time += self.chunk_duration
+
+        return {
+            'rms': rms,
+            'level': rms / self.rms_peak,
+            'bands': np.sqrt(energy / self.band_peak),
+            'flux': flux,
+            'onset': onset,
+        }
+
+
+class FeatureTap:
+    def __init__(self, rate: int, chunk: int, channels: int, consumer: Callable[[dict], None],
+                 bands: int = BAND_COUNT, capacity: int = TAP_CAPACITY):
+        """
+        Audio tap for StreamingInput.add_tap that extracts features on its own thread.
+
+        Calling the tap only copies the chunk into a ring, so the sender is never held up.
+        If feature extraction or the consumer falls behind, chunks are dropped.
+
+        :param consumer: Called with the features of every chunk, e.g. AudioReactive.update.
+        """
+        self.features = AudioFeatures(rate, chunk, channels, bands)
+        self.consumer = consumer
+        self.ring = FrameRing(chunk * channels * 2, capacity)
+        self.processed = 0
+        self.computeTotal = 0.0
+        self.computeMax = 0.0
+        self.stopFlag = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="feature-tap")
+        self.thread.start()
+
+    def __call__(self, data, captured: float):
+        self.ring.put(data, captured)
+
+    def _run(self):
+        while not self.stopFlag.is_set():
+            frame = self.ring.peek(timeout=0.1)
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            features = self.features.process(frame[0])
+            self.ring.release()
+            try:
+                self.consumer(features)
+            except Exception as e:
+                logging.error(f"Error in audio feature consumer: {e}")
+            elapsed = time.perf_counter() - start
+            self.processed += 1
+            self.computeTotal += elapsed
+            self.computeMax = max(self.computeMax, elapsed)
+
+    def stats(self) -> dict:
+        """Processed and dropped chunks and compute time per chunk against the chunk duration."""
+        return {
+            'processed': self.processed,
+            'dropped': self.ring.overflows,
+            'compute_avg_ms': self.computeTotal / self.processed * 1000 if self.processed else 0,
+            'compute_max_ms': self.computeMax * 1000,
+            'budget_ms': self.features.chunk_duration * 1000,
+        }
+
+    def stop(self):
+        self.stopFlag.set()
+        self.thread.join()
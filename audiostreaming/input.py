@@ -7,16 +7,22 @@ import sys
 import socket
 import threading
 import pyaudio
-import pickle
-import struct
 import atexit
 import time
 import requests
 from audiostreaming.utils import get_local_ip, get_input_devices
+from audiostreaming.protocol import FrameWriter
+from audiostreaming.codec import get_codec
+from audiostreaming.ringbuffer import FrameRing
+from common.session import session_pool
 
 DEFAULT_IP = "127.0.0.1"
 DEFAULT_PORT = 5000
 CONECTION_STATUS_UPDATE_INTERVAL = 1000
+MULTICAST_TTL = 1
+RING_CAPACITY = 32
+CLIENT_TIMEOUT = 3
+CLIENT_CLEANUP_INTERVAL = 0.5
 INPUT_DEVICE_WIDGET_WIDTH = 250
 INPUT_DEVICE_WIDGET_HEIGHT = 100
 
@@ -25,7 +31,7 @@ assets_dir = os.path.join(module_dir, 'assets')
 
 class StreamingInput:
 
-    def __init__(self, inputId, inputName, outputs=[], port=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100):
+    def __init__(self, inputId, inputName, outputs=[], port=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100, codec='pcm', multicast=False):
         self.inputId = inputId
         self.inputName = inputName
         self.outputs = outputs
@@ -35,73 +41,156 @@ class StreamingInput:
         self.format = format
         self.channels = channels
         self.rate = rate
+        if codec != 'pcm' and format != pyaudio.paInt16:
+            raise ValueError(f"Codec '{codec}' requires 16 bit samples")
+        self.codec = get_codec(codec, channels, rate, chunk)
+        self.multicast = multicast
+        self.group = None
         self.stopThreadFlag = threading.Event()
         self.serverThread = None
-        self.clients = set()
+        self.registryThread = None
+        self.clients = ()
+        self.clientLastSeen = {}
+        self.taps = ()
+        self.ring = FrameRing(chunk * channels * pyaudio.get_sample_size(format), RING_CAPACITY)
+        self.inputOverflows = 0
+        self.framesSent = 0
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
         atexit.register(self.on_exit)
         self._start()
 
+    def _capture(self, in_data, frame_count, time_info, status):
+        """PyAudio callback, only hands the chunk over to the sender."""
+        if status & pyaudio.paInputOverflow:
+            self.inputOverflows += 1
+        self.ring.put(in_data, time.monotonic())
+        return (None, pyaudio.paContinue)
+
     def _audio_stream(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_socket.bind((self.ip, self.port))
-        self.port = server_socket.getsockname()[1]
-        server_socket.setblocking(False)
-
-        audio = pyaudio.PyAudio()
-        print('Server listening at', (self.ip, self.port))
-
-        stream = audio.open(format=self.format,
-                            channels=self.channels,
-                            rate=self.rate,
-                            input=True,
-                            frames_per_buffer=self.chunk)
-        
-        client_addr = None
+        frame_writer = FrameWriter(self.codec.id, self.codec.max_payload_size())
+        self.stream.start_stream()
 
         while not self.stopThreadFlag.is_set():
+            frame = self.ring.peek(timeout=0.1)
+            if frame is None:
+                continue
+            data, captured = frame
+            message = frame_writer.write(self.codec.encode(data), self.chunk)
+            for tap in self.taps:
+                try:
+                    tap(data, captured)
+                except Exception as e:
+                    print(f"Error in audio tap: {e}")
+            self.ring.release()
 
-            #Check For New Clients and update existing ones
+            group = self.group
             try:
-                data, client_addr = server_socket.recvfrom(1024)
+                if group:
+                    self.serverSocket.sendto(message, group)
+                # Outputs that do not receive the multicast group register for unicast
+                for client in self.clients:
+                    self.serverSocket.sendto(message, client)
+            except OSError as e:
+                print(f"Error sending audio: {e}")
+
+            latency = time.monotonic() - captured
+            self.framesSent += 1
+            self.latencyTotal += latency
+            self.latencyMax = max(self.latencyMax, latency)
+
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+        self.registryThread.join()
+        self.serverSocket.close()
+
+    def _client_registry(self):
+        next_cleanup = time.monotonic() + CLIENT_CLEANUP_INTERVAL
 
-                existing_client = next((item for item in self.clients if item[0] == client_addr), None)
-                current_time = time.time()
-                client = (client_addr, current_time)
+        while not self.stopThreadFlag.is_set():
 
-                if existing_client:
-                    self.clients.remove(existing_client)
+            #Check For New Clients and update existing ones
+            try:
+                data, client_addr = self.serverSocket.recvfrom(1024)
+                if client_addr not in self.clientLastSeen:
+                    print(f'Client {client_addr} connected')
+                    self.clientLastSeen[client_addr] = time.monotonic()
+                    self.clients = tuple(self.clientLastSeen)
                 else:
-                    print(f'Client {client} connected') 
-
-                self.clients.add(client)
-                    
-            except BlockingIOError:
+                    self.clientLastSeen[client_addr] = time.monotonic()
+            except socket.timeout:
                 pass
-            
-            #Remove Timed Out Clients
-            timedOutClients = {i for i in self.clients if time.time() - i[1] > 3}
-            for client in timedOutClients:
-                self.clients.remove(client)
-                print(f'Client {client} disconnected')
-
-            data = stream.read(self.chunk)
+            except OSError as e:
+                # Windows reports ICMP port unreachable of a vanished client here
+                print(f"Error receiving from client: {e}")
 
-            a = pickle.dumps(data)
-            message = struct.pack("Q", len(a)) + a
-            for i in self.clients:  
-                server_socket.sendto(message, i[0])
+            #Remove Timed Out Clients
+            current_time = time.monotonic()
+            if current_time >= next_cleanup:
+                timedOutClients = [c for c, lastSeen in self.clientLastSeen.items() if current_time - lastSeen > CLIENT_TIMEOUT]
+                for client in timedOutClients:
+                    del self.clientLastSeen[client]
+                    print(f'Client {client} disconnected')
+                if timedOutClients:
+                    self.clients = tuple(self.clientLastSeen)
+                next_cleanup = current_time + CLIENT_CLEANUP_INTERVAL
 
     def _start(self):
         if self.serverThread and self.serverThread.is_alive():
             print(f"Stream with inputId {self.inputId} already exists")
         try:
+            self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.serverSocket.bind((self.ip, self.port))
+            self.port = self.serverSocket.getsockname()[1]
+            self.serverSocket.settimeout(CLIENT_CLEANUP_INTERVAL)
+            if self.multicast:
+                self.serverSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+                self.serverSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.ip))
+            print('Server listening at', (self.ip, self.port))
+
+            self.audio = pyaudio.PyAudio()
+            self.stream = self.audio.open(format=self.format,
+                                          channels=self.channels,
+                                          rate=self.rate,
+                                          input=True,
+                                          frames_per_buffer=self.chunk,
+                                          stream_callback=self._capture,
+                                          start=False)
+
             self.stopThreadFlag.clear()
+            self.registryThread = threading.Thread(target=self._client_registry, args=())
+            self.registryThread.start()
             self.serverThread = threading.Thread(target=self._audio_stream, args=())
             self.serverThread.start()
             print(f"Server {self.inputId} : {self.inputName} started")
         except:
             print ("Error: unable to create thread")     
 
+    def add_tap(self, tap):
+        """
+        Hand every captured chunk to tap(data, captured) as well.
+
+        The tap is called on the sender thread with a view that is only valid during the
+        call, it has to copy the data and return right away, see FeatureTap.
+        """
+        self.taps = self.taps + (tap,)
+
+    def remove_tap(self, tap):
+        self.taps = tuple(t for t in self.taps if t is not tap)
+
+    def stats(self):
+        """Capture overflows, ring depth and capture-to-send latency of this input."""
+        return {
+            'ring_overflows': self.ring.overflows,
+            'input_overflows': self.inputOverflows,
+            'queue_depth': len(self.ring),
+            'frames_sent': self.framesSent,
+            'latency_avg_ms': self.latencyTotal / self.framesSent * 1000 if self.framesSent else 0,
+            'latency_max_ms': self.latencyMax * 1000,
+            'clients': len(self.clients),
+        }
+
     def stop(self):
         if not self.stopThreadFlag.is_set():
             self.stopThreadFlag.set()
@@ -127,6 +216,7 @@ class StreamingInputHandler:
         self.lastRegistration = 0
         self.registrationInterval = 3
         self.registrationThreadStopFlag = threading.Event()
+        self.registrationWakeup = threading.Event()
         self.registrationThread = threading.Thread(target=self.register_inputs, daemon=True)
         self.registrationThread.start()
         self.pyaudio = pyaudio.PyAudio()
@@ -135,7 +225,7 @@ class StreamingInputHandler:
 
     def _update_outputs(self):
         try:
-            response = requests.get(f'http://{self.mainServer[0]}:{self.mainServer[1]}/api/streamingcontrol/info/outputs')
+            response = session_pool.get(f'http://{self.mainServer[0]}:{self.mainServer[1]}/api/streamingcontrol/info/outputs')
             if not response.ok:
                 print(f"Error while updating outputs: {response.text}")
                 new_outputs = []
@@ -150,18 +240,20 @@ class StreamingInputHandler:
                 self.output_update_callback()
                 print("callback initiated")
 
-    def start(self, inputId, inputName, outputs=[],port=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100):
+    def start(self, inputId, inputName, outputs=[],port=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100, codec='pcm', multicast=False):
         if inputId is None:
             raise ValueError("inputId cannot be None")
         elif self.input_in_use(inputId):
             raise ValueError("input already in use")
         else:
-            self.servers[inputId] = StreamingInput(inputId, inputName, outputs, port, chunk, format, channels, rate)
+            self.servers[inputId] = StreamingInput(inputId, inputName, outputs, port, chunk, format, channels, rate, codec, multicast)
+            self.registrationWakeup.set()
         
     def stop(self, inputId):
         if self.input_in_use(inputId):
             self.servers[inputId].stop()
             del self.servers[inputId]
+            self.registrationWakeup.set()
         else:
             raise ValueError("inputId not found")
         
@@ -171,35 +263,60 @@ class StreamingInputHandler:
         else:
             raise ValueError("inputId not found")
         
+    def get_stats(self, inputId):
+        if self.input_in_use(inputId):
+            return self.servers[inputId].stats()
+        else:
+            raise ValueError("inputId not found")
+
+    def add_tap(self, inputId, tap):
+        if self.input_in_use(inputId):
+            self.servers[inputId].add_tap(tap)
+        else:
+            raise ValueError("inputId not found")
+
     def input_in_use(self, inputId):
         return inputId in self.servers
     
     def register_inputs(self):
         while not self.registrationThreadStopFlag.is_set():
+            self.registrationWakeup.clear()
             current_time = time.time()
-            if current_time - self.lastRegistration > self.registrationInterval:
-                serversCopy = self.servers.copy()
-                serverList = [{'ip': server.ip, 'port': server.port, 'outputs': server.outputs} for server in serversCopy.values()]
+            serversCopy = self.servers.copy()
+            serverList = [{'ip': server.ip, 'port': server.port, 'outputs': server.outputs, 'codec': server.codec.name, 'multicast': server.multicast} for server in serversCopy.values()]
 
-                url = f'http://{self.mainServer[0]}:{self.mainServer[1]}/api/streamingcontrol/input'
-                try:
-                    response = requests.post(url, json=serverList, timeout=2)  # Added timeout
-                    if response.status_code == 200:
-                        self.mainServerConnected = True
-                    else:
-                        self.mainServerConnected = False
-                except requests.RequestException as e:
-                    print(f"Request Exception with main server")
-                    self.mainServerConnected = False
-                except Exception as e:
-                    print(f"Unexpected error: {e}")
+            url = f'http://{self.mainServer[0]}:{self.mainServer[1]}/api/streamingcontrol/input'
+            try:
+                response = session_pool.post(url, json=serverList, timeout=2)  # Added timeout
+                if response.status_code == 200:
+                    self.mainServerConnected = True
+                    self._apply_group_assignments(serversCopy, response.json() if response.content else {})
+                else:
                     self.mainServerConnected = False
-
-                self.lastRegistration = current_time
+            except requests.RequestException as e:
+                print(f"Request Exception with main server")
+                self.mainServerConnected = False
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+                self.mainServerConnected = False
+
+            self.lastRegistration = current_time
+
+            # Sleep until the next registration is due or an input was started, stopped or the handler terminated
+            self.registrationWakeup.wait(max(0, self.lastRegistration + self.registrationInterval - time.time()))
+
+    def _apply_group_assignments(self, servers, assignments):
+        for server in servers.values():
+            group = assignments.get(f'{server.ip}:{server.port}')
+            group = tuple(group) if group else None
+            if group != server.group:
+                print(f"Input {server.inputId} streaming to multicast group {group}" if group else f"Input {server.inputId} streaming unicast")
+                server.group = group
 
     def update_main_server(self, mainServer):
         self.mainServer = mainServer
         self._update_outputs()
+        self.registrationWakeup.set()
         print(f"Main server updated to {self.mainServer}")
 
     def terminate(self):
@@ -208,6 +325,7 @@ class StreamingInputHandler:
             self.stop(i)
         if not self.registrationThreadStopFlag.is_set():
             self.registrationThreadStopFlag.set()
+            self.registrationWakeup.set()
             self.registrationThread.join(timeout=5)  # Added timeout
             if self.registrationThread.is_alive():
                 print("Thread did not terminate in time, forcefully terminating.")
@@ -0,0 +1,168 @@
+import math
+import threading
+import time
+from audiostreaming.protocol import SEQUENCE_MODULO
+
+MIN_DEPTH = 2
+MAX_DEPTH = 16
+BUFFER_CAPACITY = 64
+JITTER_MULTIPLIER = 4
+
+
+def _distance(a: int, b: int) -> int:
+    """Signed distance from sequence number b to a, taking wrap-around into account."""
+    return (a - b + SEQUENCE_MODULO // 2) % SEQUENCE_MODULO - SEQUENCE_MODULO // 2
+
+
+class JitterBuffer:
+    def __init__(self, frame_size: int, frame_duration: float, min_depth: int = MIN_DEPTH,
+                 max_depth: int = MAX_DEPTH, capacity: int = BUFFER_CAPACITY):
+        """
+        Sequence ordered buffer between the socket reader and the audio writer.
+
+        Playout starts once the target depth is buffered. The target depth follows the
+        measured inter-arrival jitter, lost frames are concealed by repeating the previous
+        frame once and with silence afterwards.
+
+        :param frame_size: Size of one decoded frame in bytes.
+        :param frame_duration: Playback duration of one frame in seconds.
+        :param min_depth: Lower bound for the target depth in frames.
+        :param max_depth: Upper bound for the target depth in frames.
+        :param capacity: Number of preallocated frame slots, must be well above max_depth.
+        """
+        if capacity < 2 * max_depth:
+            raise ValueError("capacity must be at least twice max_depth")
+        self.frame_size = frame_size
+        self.frame_duration = frame_duration
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.capacity = capacity
+
+        self.slots = [bytearray(frame_size) for _ in range(capacity)]
+        self.views = [memoryview(slot) for slot in self.slots]
+        self.lengths = [0] * capacity
+        self.sequences = [None] * capacity
+        self.silence = memoryview(bytes(frame_size))
+        self.last_played = None
+        self.concealing = False
+
+        self.condition = threading.Condition()
+        self.next_sequence = None
+        self.highest_sequence = None
+        self.playing = False
+        self.target_depth = min_depth
+
+        self.last_arrival = None
+        self.last_arrival_sequence = None
+        self.jitter = 0.0
+
+        self.underruns = 0
+        self.late = 0
+        self.concealed = 0
+        self.dropped = 0
+
+    def _depth(self) -> int:
+        if self.next_sequence is None:
+            return 0
+        return max(0, _distance(self.highest_sequence, self.next_sequence) + 1)
+
+    def _update_jitter(self, sequence: int, arrival: float):
+        if self.last_arrival is not None:
+            spacing = _distance(sequence, self.last_arrival_sequence)
+            if spacing > 0:
+                deviation = (arrival - self.last_arrival) - spacing * self.frame_duration
+                # Same smoothing as the RTP interarrival jitter estimate
+                self.jitter += (abs(deviation) - self.jitter) / 16
+                target = math.ceil(JITTER_MULTIPLIER * self.jitter / self.frame_duration) + 1
+                self.target_depth = min(self.max_depth, max(self.min_depth, target))
+        if self.last_arrival_sequence is None or _distance(sequence, self.last_arrival_sequence) > 0:
+            self.last_arrival = arrival
+            self.last_arrival_sequence = sequence
+
+    def _reset(self, sequence: int):
+        self.next_sequence = sequence
+        self.highest_sequence = sequence
+        self.playing = False
+        self.sequences = [None] * self.capacity
+
+    def push(self, sequence: int, payload):
+        """Store a received frame, called from the socket reader."""
+        arrival = time.monotonic()
+        with self.condition:
+            self._update_jitter(sequence, arrival)
+
+            if self.next_sequence is None:
+                self._reset(sequence)
+            elif _distance(sequence, self.next_sequence) < 0:
+                self.late += 1
+                return
+            elif _distance(sequence, self.next_sequence) >= self.capacity:
+                # Sender restarted or we fell far behind, start over from this frame
+                self._reset(sequence)
+
+            slot = sequence % self.capacity
+            length = min(len(payload), self.frame_size)
+            self.views[slot][:length] = payload[:length]
+            self.lengths[slot] = length
+            self.sequences[slot] = sequence
+            if _distance(sequence, self.highest_sequence) > 0:
+                self.highest_sequence = sequence
+
+            if not self.playing and self._depth() >= self.target_depth:
+                self.playing = True
+                self.condition.notify()
+
+    def pop(self, timeout: float = None) -> memoryview:
+        """
+        Return the next frame to play, called from the audio writer.
+
+        The returned view stays valid until the buffer wraps around. Returns None while
+        the buffer is (re)filling and nothing arrived within timeout.
+        """
+        with self.condition:
+            if not self.playing:
+                self.condition.wait(timeout)
+                if not self.playing:
+                    return None
+
+            depth = self._depth()
+            if depth == 0:
+                self.underruns += 1
+                self.playing = False
+                return None
+
+            excess = depth - max(2 * self.target_depth, self.target_depth + 4)
+            if excess > 0:
+                # Latency crept up, skip ahead to the target depth
+                self.dropped += excess
+                self.next_sequence = (self.next_sequence + excess) % SEQUENCE_MODULO
+
+            slot = self.next_sequence % self.capacity
+            if self.sequences[slot] == self.next_sequence:
+                frame = self.views[slot][:self.lengths[slot]]
+                self.last_played = frame
+                self.concealing = False
+            else:
+                self.concealed += 1
+                frame = self.silence if self.concealing or self.last_played is None else self.last_played
+                self.concealing = True
+            self.sequences[slot] = None
+            self.next_sequence = (self.next_sequence + 1) % SEQUENCE_MODULO
+            return frame
+
+    def wake(self):
+        """Wake up a writer blocked in pop, used when stopping."""
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'depth': self._depth(),
+                'target_depth': self.target_depth,
+                'jitter_ms': self.jitter * 1000,
+                'underruns': self.underruns,
+                'late': self.late,
+                'concealed': self.concealed,
+                'dropped': self.dropped,
+            }
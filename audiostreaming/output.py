@@ -1,15 +1,22 @@
 import socket
 import threading
 import pyaudio
-import pickle
-import struct
 import atexit
 from flask import Flask, request, jsonify
 import re
+import struct
+import time
+from audiostreaming.protocol import read_frame, SequenceTracker, ProtocolError, MAX_DATAGRAM_SIZE
+from audiostreaming.codec import get_codec, available_codecs
+from audiostreaming.jitter import JitterBuffer
+from common.clock import Clock
+
+MULTICAST_FALLBACK_TIMEOUT = 2
 
 class StreamingOutput:
-    def __init__(self, server: tuple, outputDevice=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100):
+    def __init__(self, server: tuple, outputDevice=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100, codec='pcm', group: tuple = None):
         self.server = server
+        self.group = group
         self.outputDevice = outputDevice
         self.chunk = chunk
         self.format = format
@@ -17,6 +24,12 @@ class StreamingOutput:
         self.rate = rate
         self.stopThreadFlag = threading.Event()
         self.clientThread = None
+        self.codec = get_codec(codec, channels, rate, chunk)
+        self.sequence = SequenceTracker()
+        self.jitterBuffer = JitterBuffer(chunk * channels * pyaudio.get_sample_size(format), chunk / rate)
+        self.playoutThread = None
+        # Multicast when a group is given, switches to unicast if the group stays silent
+        self.unicast = group is None
 
         self.stopThreadFlag.clear()
         self.clientThread = threading.Thread(target=self._audio_stream, args=())
@@ -34,39 +47,68 @@ class StreamingOutput:
         self.clientSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.clientSocket.settimeout(1)
         self.socketAddress = self.server
-        print('Connecting to server at', self.socketAddress)
-        self.clientSocket.sendto(b"Client connected", self.socketAddress)
+        if self.group:
+            # Unicast fallback packets arrive on the same port, so bind to all addresses
+            self.clientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.clientSocket.bind(('', self.group[1]))
+            self._multicast_membership(socket.IP_ADD_MEMBERSHIP)
+            print('Joined multicast group', self.group, 'of server', self.socketAddress)
+        else:
+            print('Connecting to server at', self.socketAddress)
+            self.clientSocket.sendto(b"Client connected", self.socketAddress)
+        last_received = time.monotonic()
+
+        buffer = bytearray(MAX_DATAGRAM_SIZE)
+        view = memoryview(buffer)
 
-        data = b""
-        payload_size = struct.calcsize("Q")
+        self.playoutThread = threading.Thread(target=self._playout, args=())
+        self.playoutThread.start()
 
         while not self.stopThreadFlag.is_set():
 
-            self.clientSocket.sendto(b"Client connected", self.socketAddress) # Possible optimization
+            if self.unicast:
+                self.clientSocket.sendto(b"Client connected", self.socketAddress) # Possible optimization
+            elif time.monotonic() - last_received > MULTICAST_FALLBACK_TIMEOUT:
+                print(f'No data from multicast group {self.group}, falling back to unicast from {self.socketAddress}')
+                self._multicast_membership(socket.IP_DROP_MEMBERSHIP)
+                self.unicast = True
+                continue
 
             try:
-                while len(data) < payload_size:
-                    packet, _ = self.clientSocket.recvfrom(4 * 1024)
-                    if not packet: break
-                    data += packet
+                size = self.clientSocket.recv_into(buffer)
+                last_received = time.monotonic()
+                codec, sequence, timestamp, payload = read_frame(view, size)
+                if codec != self.codec.id:
+                    raise ProtocolError(f"Expected codec {self.codec.id} but received {codec}")
 
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("Q", packed_msg_size)[0]
-
-                while len(data) < msg_size:
-                    packet, _ = self.clientSocket.recvfrom(4 * 1024)
-                    if not packet: break
-                    data += packet
-
-                frame_data = data[:msg_size]    
-                data = data[msg_size:]
-                frame = pickle.loads(frame_data)
-                self.stream.write(frame)
+                self.sequence.update(sequence)
+                self.jitterBuffer.push(sequence, self.codec.decode(payload))
 
+            except socket.timeout:
+                pass
             except Exception as e:
                 print(f"Error: {e}")
 
+        self.jitterBuffer.wake()
+        self.playoutThread.join()
+
+    def _multicast_membership(self, option):
+        membership = struct.pack("4s4s", socket.inet_aton(self.group[0]), socket.inet_aton("0.0.0.0"))
+        self.clientSocket.setsockopt(socket.IPPROTO_IP, option, membership)
+
+    def _playout(self):
+        while not self.stopThreadFlag.is_set():
+            frame = self.jitterBuffer.pop(timeout=0.1)
+            if frame is not None:
+                self.stream.write(frame.toreadonly())
+
+    def stats(self):
+        return {
+            'transport': 'unicast' if self.unicast else 'multicast',
+            **self.sequence.stats(),
+            **self.jitterBuffer.stats(),
+        }
+
     def stop(self):
             self.stopThreadFlag.set()
             self.clientThread.join()
@@ -79,9 +121,9 @@ class StreamingOutputHandler:
     def __init__(self):
         self.streams = {}
 
-    def start(self, server, outputDevice=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100):
+    def start(self, server, outputDevice=0, chunk=1024, format=pyaudio.paInt16, channels=1, rate=44100, codec='pcm', group=None):
         if not self._stream_exists(server):
-            self.streams[server] = StreamingOutput(server, outputDevice, chunk, format, channels, rate)
+            self.streams[server] = StreamingOutput(server, outputDevice, chunk, format, channels, rate, codec, group)
         else:
             print(f"Stream with server {server} already running")   
 
@@ -104,12 +146,16 @@ class StreamingOutputHandler:
 
     def get_all(self):
         return self.streams
+
+    def get_stats(self):
+        return {f"{server[0]}:{server[1]}": stream.stats() for server, stream in self.streams.items()}
     def _stream_exists(self, server):
         return server in self.streams
 
 class AudioStreamingOutputServer:
-    def __init__(self, app: Flask):
+    def __init__(self, app: Flask, clock: Clock = None):
         self.app = app
+        self.clock = clock or Clock()
         self.stream_client_handler = StreamingOutputHandler()
         self._setup_routes()
 
@@ -127,6 +173,9 @@ class AudioStreamingOutputServer:
         
         return True
     
+    def _validate_multicast_ip(self, ip: str):
+        return self._validate_ip(ip) and 224 <= int(ip.split('.')[0]) <= 239
+
     def _validate_port(self, port: int):
         return 0 <= port <= 65535  
       
@@ -136,6 +185,18 @@ class AudioStreamingOutputServer:
         def ping_streaming_output():
             return "", 200
         
+        @self.app.route('/api/streamingoutput/codecs', methods=['GET'])
+        def streaming_output_codecs():
+            return jsonify(available_codecs()), 200
+
+        @self.app.route('/api/streamingoutput/stats', methods=['GET'])
+        def streaming_output_stats():
+            return jsonify(self.stream_client_handler.get_stats()), 200
+
+        @self.app.route('/api/streamingoutput/clock', methods=['GET'])
+        def streaming_output_clock():
+            return jsonify(self.clock.status()), 200
+
         @self.app.route('/api/streamingoutput/start', methods=['GET'])
         def start():
             ip = request.args.get('ip')
@@ -148,9 +209,20 @@ class AudioStreamingOutputServer:
             if not ( self._validate_ip(ip) and self._validate_port(int(port)) ):
                 return jsonify(error="Invalid IP or port"), 400
 
+            codec = request.args.get('codec', 'pcm')
+            if codec not in available_codecs():
+                return jsonify(error=f"Unsupported codec '{codec}'"), 400
+
+            group = request.args.get('group')
+            if group:
+                group_ip, _, group_port = group.partition(':')
+                if not ( self._validate_multicast_ip(group_ip) and group_port.isdigit() and self._validate_port(int(group_port)) ):
+                    return jsonify(error="Invalid multicast group"), 400
+                group = (group_ip, int(group_port))
+
             server = (ip, int(port))
 
-            self.stream_client_handler.start(server)
+            self.stream_client_handler.start(server, codec=codec, group=group)
 
             return "", 200
         
@@ -0,0 +1,108 @@
+import struct
+
+# version, codec id, sequence number, timestamp (in samples), payload length
+HEADER = struct.Struct("!BBHIH")
+PROTOCOL_VERSION = 1
+MAX_DATAGRAM_SIZE = 65507
+MAX_PAYLOAD_SIZE = MAX_DATAGRAM_SIZE - HEADER.size
+
+CODEC_PCM16 = 0
+CODEC_ADPCM = 1
+CODEC_OPUS = 2
+
+SEQUENCE_MODULO = 1 << 16
+TIMESTAMP_MODULO = 1 << 32
+
+
+class ProtocolError(Exception):
+    """Exception raised when a datagram is not a valid audio frame."""
+    pass
+
+
+class FrameWriter:
+    def __init__(self, codec: int = CODEC_PCM16, max_payload: int = MAX_PAYLOAD_SIZE):
+        """
+        Builds outgoing audio datagrams in a single preallocated buffer.
+
+        :param codec: Codec id written into every header.
+        :param max_payload: Largest payload that will be written.
+        """
+        if max_payload > MAX_PAYLOAD_SIZE:
+            raise ValueError(f"Payload size {max_payload} exceeds the maximum of {MAX_PAYLOAD_SIZE} bytes")
+        self.codec = codec
+        self.sequence = 0
+        self.timestamp = 0
+        self.buffer = bytearray(HEADER.size + max_payload)
+        self.view = memoryview(self.buffer)
+
+    def write(self, payload, samples: int) -> memoryview:
+        """
+        Frame a payload and return a view of the datagram, valid until the next call.
+
+        :param payload: The encoded audio of one chunk.
+        :param samples: Number of samples per channel in the chunk, advances the timestamp.
+        """
+        length = len(payload)
+        HEADER.pack_into(self.buffer, 0, PROTOCOL_VERSION, self.codec, self.sequence, self.timestamp, length)
+        self.view[HEADER.size:HEADER.size + length] = payload
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        self.timestamp = (self.timestamp + samples) % TIMESTAMP_MODULO
+        return self.view[:HEADER.size + length]
+
+
+def read_frame(view: memoryview, size: int):
+    """
+    Parse a received datagram without copying the payload.
+
+    :param view: Memoryview of the receive buffer.
+    :param size: Number of bytes received into the buffer.
+    :return: (codec, sequence, timestamp, payload view)
+    """
+    if size < HEADER.size:
+        raise ProtocolError(f"Datagram of {size} bytes is shorter than the header")
+    version, codec, sequence, timestamp, length = HEADER.unpack_from(view)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if HEADER.size + length != size:
+        raise ProtocolError(f"Payload length {length} does not match datagram size {size}")
+    return codec, sequence, timestamp, view[HEADER.size:size]
+
+
+class SequenceTracker:
+    def __init__(self):
+        """Detects lost, reordered and duplicated frames from their sequence numbers."""
+        self.expected = None
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+
+    def update(self, sequence: int) -> int:
+        """
+        Register a received sequence number.
+
+        :return: Number of frames missing before this one, or -1 if the frame is late or duplicated
+                 and should be dropped.
+        """
+        if self.expected is None:
+            self.expected = (sequence + 1) % SEQUENCE_MODULO
+            self.received += 1
+            return 0
+
+        gap = (sequence - self.expected) % SEQUENCE_MODULO
+        if gap >= SEQUENCE_MODULO // 2:
+            # Behind the expected sequence number: reordered or duplicated
+            self.late += 1
+            return -1
+
+        self.expected = (sequence + 1) % SEQUENCE_MODULO
+        self.received += 1
+        self.lost += gap
+        return gap
+
+    def stats(self) -> dict:
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            # Reordered or duplicated, the jitter buffer counts frames that missed playout as late
+            'out_of_order': self.late,
+        }
@@ -0,0 +1,64 @@
+import threading
+
+
+class FrameRing:
+    def __init__(self, frame_size: int, capacity: int):
+        """
+        Preallocated single producer, single consumer ring of audio frames.
+
+        The producer (the PyAudio callback) and the consumer (the sender) each only move
+        their own index, so no lock is taken on the data path. When the ring is full the
+        newest frame is dropped and counted as an overflow.
+
+        :param frame_size: Maximum size of one frame in bytes.
+        :param capacity: Number of frames the ring can hold.
+        """
+        self.frame_size = frame_size
+        self.capacity = capacity
+        self.buffer = bytearray(frame_size * capacity)
+        self.view = memoryview(self.buffer)
+        self.lengths = [0] * capacity
+        self.timestamps = [0.0] * capacity
+        self.write_index = 0
+        self.read_index = 0
+        self.overflows = 0
+        self.available = threading.Event()
+
+    def __len__(self):
+        return self.write_index - self.read_index
+
+    def put(self, data, timestamp: float) -> bool:
+        """Copy a frame into the ring, returns False if it had to be dropped."""
+        if self.write_index - self.read_index >= self.capacity:
+            self.overflows += 1
+            return False
+        slot = self.write_index % self.capacity
+        offset = slot * self.frame_size
+        length = min(len(data), self.frame_size)
+        self.view[offset:offset + length] = data[:length]
+        self.lengths[slot] = length
+        self.timestamps[slot] = timestamp
+        self.write_index += 1
+        self.available.set()
+        return True
+
+    def peek(self, timeout: float = None):
+        """
+        Wait for the oldest frame and return (view, timestamp) without consuming it.
+
+        The view stays valid until release() is called. Returns None on timeout.
+        """
+        if self.read_index == self.write_index:
+            self.available.clear()
+            # The producer may have written between the check and the clear
+            if self.read_index == self.write_index and not self.available.wait(timeout):
+                return None
+            if self.read_index == self.write_index:
+                return None
+        slot = self.read_index % self.capacity
+        offset = slot * self.frame_size
+        return self.view[offset:offset + self.lengths[slot]], self.timestamps[slot]
+
+    def release(self):
+        """Consume the frame returned by peek, freeing its slot for the producer."""
+        self.read_index += 1
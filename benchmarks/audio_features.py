@@ -0,0 +1,53 @@
+"""
+Per chunk compute cost of the audio-reactive lighting pipeline.
+
+Feeds synthetic 16 bit audio (a chord with a kick drum twice a second) through
+AudioFeatures and AudioReactive in chunks as StreamingInput captures them, and
+compares the time per chunk with the chunk's playback duration. A Raspberry Pi is
+roughly 5 to 10 times slower than a desktop, the budget column shows the headroom.
+
+Run from the repository root: python -m benchmarks.audio_features
+"""
+import time
+import numpy as np
+from audiostreaming.features import AudioFeatures
+from wled.realtime import RealtimeOutput
+from wled.reactive import AudioReactive
+
+RATE = 44100
+CHUNK = 1024
+SECONDS = 20
+LED_COUNT = 300
+KICKS_PER_SECOND = 2
+
+
+def synthetic_audio() -> np.ndarray:
+    t = np.arange(RATE * SECONDS) / RATE
+    audio = 0.1 * (np.sin(2 * np.pi * 220 * t) + np.sin(2 * np.pi * 277 * t) + np.sin(2 * np.pi * 3300 * t))
+    beat = (t * KICKS_PER_SECOND) % 1
+    audio += 0.8 * np.sin(2 * np.pi * 60 * t) * np.exp(-beat * 25)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+if __name__ == '__main__':
+    audio = synthetic_audio()
+    chunks = [audio[i:i + CHUNK].tobytes() for i in range(0, len(audio) - CHUNK + 1, CHUNK)]
+    features = AudioFeatures(RATE, CHUNK)
+    # Nothing listens on the loopback address, sending is part of the measured cost
+    reactive = AudioReactive(RealtimeOutput(["127.0.0.1"], LED_COUNT))
+
+    times = []
+    onsets = 0
+    for chunk in chunks:
+        start = time.perf_counter()
+        result = features.process(chunk)
+        reactive.update(result)
+        times.append(time.perf_counter() - start)
+        onsets += result['onset']
+
+    budget = CHUNK / RATE * 1000
+    ms = sorted(value * 1000 for value in times)
+    print(f"{len(chunks)} chunks of {CHUNK} samples at {RATE} Hz, budget {budget:.1f} ms per chunk")
+    print(f"features + frame: mean {sum(ms) / len(ms):.3f} ms, p99 {ms[int(0.99 * (len(ms) - 1))]:.3f} ms, "
+          f"max {ms[-1]:.3f} ms ({sum(ms) / len(ms) / budget * 100:.1f}% of the budget)")
+    print(f"onsets detected: {onsets}, kicks in the signal: {SECONDS * KICKS_PER_SECOND}")
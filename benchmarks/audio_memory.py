@@ -0,0 +1,62 @@
+"""
+Resident memory of a preloaded versus a streamed audio asset.
+
+Writes a long synthetic wav file and measures how much the process grows when it is
+played through AudioFile (fully decoded pygame Sound) and StreamedAudioFile
+(pygame.mixer.music, decoded from disk while playing). Linux only, reads /proc.
+
+Run from the repository root: python -m benchmarks.audio_memory
+"""
+import gc
+import os
+import tempfile
+import time
+import wave
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+from audioplayer.server import AudioFile, StreamedAudioFile
+
+DURATION = 180
+RATE = 44100
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def write_wav(path: str):
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        for _ in range(DURATION):
+            t = np.arange(RATE) / RATE
+            second = (np.sin(2 * np.pi * 110 * t) * 8000).astype("<i2")
+            wav.writeframes(np.repeat(second[:, None], 2, axis=1).tobytes())
+
+
+def measure(cls, path: str) -> int:
+    gc.collect()
+    before = rss_bytes()
+    audio_file = cls(path)
+    audio_file.play(volume=0.2, loops=-1)
+    time.sleep(1)
+    after = rss_bytes()
+    audio_file.stop()
+    del audio_file
+    gc.collect()
+    return after - before
+
+
+if __name__ == '__main__':
+    pygame.mixer.init(frequency=RATE, channels=2)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "theme.wav")
+        write_wav(path)
+        print(f"asset:     {os.path.getsize(path) / 1e6:6.1f} MB on disk, {DURATION} s")
+        print(f"streamed:  {measure(StreamedAudioFile, path) / 1e6:6.1f} MB resident")
+        print(f"preloaded: {measure(AudioFile, path) / 1e6:6.1f} MB resident")
@@ -0,0 +1,57 @@
+"""
+Bandwidth and CPU cost of the streaming codecs.
+
+Encodes and decodes a few seconds of synthetic audio with every available codec
+and reports the bitrate on the wire and the CPU time per chunk.
+
+Run from the repository root: python -m benchmarks.codec
+"""
+import time
+import numpy as np
+from audiostreaming.codec import available_codecs, get_codec
+from audiostreaming.protocol import HEADER
+
+DURATION = 5
+CHANNELS = 1
+# Opus only supports 48 kHz style rates and 2.5 - 60 ms frames, so it gets its own settings
+SETTINGS = {'opus': (48000, 960)}
+DEFAULT_SETTINGS = (44100, 1024)
+
+
+def test_signal(rate: int, channels: int, duration: float) -> np.ndarray:
+    t = np.arange(int(rate * duration)) / rate
+    signal = 0.4 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 1760 * t) + 0.05 * np.random.randn(len(t))
+    return (np.repeat(signal[:, None], channels, axis=1) * 32767 * 0.7).astype('<i2')
+
+
+def run(name: str):
+    rate, chunk = SETTINGS.get(name, DEFAULT_SETTINGS)
+    encoder = get_codec(name, CHANNELS, rate, chunk)
+    decoder = get_codec(name, CHANNELS, rate, chunk)
+    samples = test_signal(rate, CHANNELS, DURATION)
+    chunks = [samples[i:i + chunk].tobytes() for i in range(0, len(samples) - chunk + 1, chunk)]
+
+    sent = 0
+    encode_time = 0.0
+    decode_time = 0.0
+    for pcm in chunks:
+        start = time.process_time()
+        payload = encoder.encode(pcm)
+        encode_time += time.process_time() - start
+        sent += HEADER.size + len(payload)
+
+        start = time.process_time()
+        decoder.decode(payload)
+        decode_time += time.process_time() - start
+
+    seconds = len(chunks) * chunk / rate
+    chunk_ms = chunk / rate * 1000
+    print(f"{name:6} {sent / seconds / 1000:8.1f} KB/s  "
+          f"encode {encode_time / len(chunks) * 1000:6.3f} ms/chunk  "
+          f"decode {decode_time / len(chunks) * 1000:6.3f} ms/chunk  "
+          f"(chunk is {chunk_ms:.1f} ms of audio)")
+
+
+if __name__ == '__main__':
+    for name in available_codecs():
+        run(name)
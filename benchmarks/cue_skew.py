@@ -0,0 +1,42 @@
+"""
+Start skew of scheduled cues across audio players.
+
+Plays a file on all given players through AudioPlayerGroup, which schedules it at a
+common start time, then collects the actual start times every player recorded.
+Start times are reported on the control host's clock, so players running a ClockSync
+against control.py are directly comparable. Players without one report their local clock.
+
+Run from the repository root:
+    python -m benchmarks.cue_skew scare 192.168.1.93:5000 192.168.1.90:5000 [...]
+"""
+import sys
+import time
+from audioplayer.api import AudioPlayer, AudioPlayerGroup, CUE_LEAD_TIME
+
+ROUNDS = 10
+PAUSE = 2
+
+
+def collect(players, scheduled: float) -> dict:
+    """Lateness in ms of the cue with the given start time, per player."""
+    lateness = {}
+    for player in players:
+        cue = next((c for c in player.get_cues() or [] if c['scheduled'] == scheduled), None)
+        if cue and cue['started']:
+            lateness[f"{player.ip}:{player.port}"] = (cue['started'] - cue['scheduled']) * 1000
+    return lateness
+
+
+if __name__ == '__main__':
+    file = sys.argv[1]
+    players = [AudioPlayer(host, int(port)) for host, port in (arg.split(':') for arg in sys.argv[2:])]
+    group = AudioPlayerGroup(players)
+
+    for i in range(ROUNDS):
+        scheduled = time.time() + CUE_LEAD_TIME
+        result = group.play(file, volume=0.1, at=scheduled)
+        time.sleep(PAUSE)
+        lateness = collect(players, scheduled)
+        spread = max(lateness.values()) - min(lateness.values()) if lateness else float('nan')
+        nodes = "  ".join(f"{node}: {ms:+6.2f} ms" for node, ms in lateness.items())
+        print(f"round {i + 1:2}  request skew {result.skew * 1000:6.2f} ms  start spread {spread:6.2f} ms  {nodes}")
@@ -0,0 +1,86 @@
+"""
+Pulse timing accuracy and CPU use of GPIO pulses.
+
+Compares the old per-pulse thread that polled every millisecond with the shared
+PinScheduler. The GPIO write is replaced by recording the time the pin went off, so
+this runs without a Raspberry Pi.
+
+Run from the repository root: python -m benchmarks.gpio_pulses
+"""
+import threading
+import time
+from raspigpio.scheduler import PinScheduler
+
+PINS = 4
+PULSES = 10
+DURATION = 0.2
+
+
+class LegacyPin:
+    """The pulse logic as it was before, with the GPIO write replaced by a callback."""
+
+    def __init__(self, output):
+        self.output = output
+        self.stop_event = threading.Event()
+
+    def turn_on_for(self, duration):
+        self.stop_thread()
+        threading.Thread(target=self._turn_on_for_thread, args=(duration,)).start()
+
+    def _turn_on_for_thread(self, duration):
+        self.stop_thread()
+        start_time = time.time()
+        while time.time() - start_time < duration:
+            if self.stop_event.is_set():
+                break
+            time.sleep(0.001)
+        self.output(False)
+
+    def stop_thread(self):
+        self.stop_event.set()
+        time.sleep(0.002)
+        self.stop_event.clear()
+
+
+class ScheduledPin:
+    def __init__(self, output, scheduler):
+        self.output = output
+        self.scheduler = scheduler
+
+    def turn_on_for(self, duration):
+        self.scheduler.schedule(duration, self.output, (False,))
+
+
+def run(make_pin) -> tuple:
+    lateness = []
+    lock = threading.Lock()
+    pins = []
+    for _ in range(PINS):
+        state = {}
+
+        def output(value, state=state):
+            with lock:
+                lateness.append(time.monotonic() - state['due'])
+        pins.append((make_pin(output), state))
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    for _ in range(PULSES):
+        for pin, state in pins:
+            state['due'] = time.monotonic() + DURATION
+            pin.turn_on_for(DURATION)
+        time.sleep(DURATION + 0.05)
+    cpu = (time.process_time() - cpu_start) / (time.monotonic() - wall_start)
+    return sorted(lateness), cpu
+
+
+def report(name: str, lateness: list, cpu: float):
+    ms = [value * 1000 for value in lateness]
+    print(f"{name}: {len(ms)} pulses, mean {sum(ms) / len(ms):5.2f} ms late, "
+          f"max {ms[-1]:5.2f} ms, cpu {cpu * 100:5.1f}% of a core")
+
+
+if __name__ == '__main__':
+    report("polling threads", *run(LegacyPin))
+    scheduler = PinScheduler()
+    report("pin scheduler  ", *run(lambda output: ScheduledPin(output, scheduler)))
@@ -0,0 +1,59 @@
+"""
+Idle CPU usage of the streaming control plane.
+
+Compares the old busy-spinning input cleanup loop with the event driven
+StreamingControlServerRoutes while one input is registered and nothing else happens.
+
+Run from the repository root: python -m benchmarks.idle_cpu
+"""
+import threading
+import time
+from flask import Flask
+from audiostreaming.control import StreamingControlServerRoutes, INPUT_TIMEOUT
+
+DURATION = 3
+
+
+def legacy_clean_input_list(inputs, stop):
+    """The cleanup loop as it was before, without any sleep or wait."""
+    while not stop.is_set():
+        timedOutInputs = [i for i in inputs if time.time() - i[1] > INPUT_TIMEOUT]
+        for input in timedOutInputs:
+            inputs.remove(input)
+        for i, input in enumerate(inputs):
+            if not input[2]:
+                inputs[i] = (input[0], input[1], True)
+
+
+def measure(duration: float = DURATION) -> float:
+    """CPU seconds used by the process per wall clock second."""
+    cpu_start = time.process_time()
+    time.sleep(duration)
+    return (time.process_time() - cpu_start) / duration
+
+
+def keep_registered(client, stop):
+    """Re-register an input every 3 seconds like StreamingInputHandler does."""
+    while not stop.is_set():
+        client.post('/api/streamingcontrol/input', json=[{'ip': '127.0.0.1', 'port': 50000, 'outputs': []}])
+        stop.wait(3)
+
+
+if __name__ == '__main__':
+    stop = threading.Event()
+    inputs = [({'ip': '127.0.0.1', 'port': 50000, 'outputs': []}, time.time() + 3600, True)]
+    thread = threading.Thread(target=legacy_clean_input_list, args=(inputs, stop), daemon=True)
+    thread.start()
+    before = measure()
+    stop.set()
+    thread.join()
+
+    app = Flask(__name__)
+    StreamingControlServerRoutes(app, {})
+    stop = threading.Event()
+    threading.Thread(target=keep_registered, args=(app.test_client(), stop), daemon=True).start()
+    after = measure()
+    stop.set()
+
+    print(f"busy loop:    {before * 100:6.1f}% of a core")
+    print(f"event driven: {after * 100:6.1f}% of a core")
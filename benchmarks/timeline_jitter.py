@@ -0,0 +1,113 @@
+"""
+Cue timing accuracy of the timeline scheduler, idle and under load.
+
+Launches overlapping timelines whose cues record when they actually ran and reports
+how late they fired relative to their offsets. The baseline runs the same cues the way
+it had to be done before, one thread per timeline with blocking sleeps in between, so
+the numbers can be compared on the same host.
+
+Idle and under I/O load, which is what the control server does while a show runs
+(requests to the nodes, JSON, short sleeps), the scheduler has to stay within
+MAX_MEAN_LATENESS and MAX_P99_LATENESS, the run exits non-zero otherwise. Threads
+doing pure Python work are only reported: each cue needs the GIL twice, once on the
+timer thread and once on the worker running it, and a busy thread gives it up only
+every switch interval (5 ms by default) without any fairness between the waiters.
+Sleeping threads suffer from the same, so neither approach can bound lateness there;
+keep CPU heavy work out of the control process.
+
+Run from the repository root: python -m benchmarks.timeline_jitter
+"""
+import json
+import socket
+import sys
+import threading
+import time
+from trigger.timeline import Timeline, TimelineScheduler
+
+TIMELINES = 20
+CUES = 10
+CUE_SPACING = 0.05
+LOAD_THREADS = 4
+# Generous enough for timer wakeup noise on a shared single core host
+MAX_MEAN_LATENESS = 0.005
+MAX_P99_LATENESS = 0.030
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def io_busy(stop):
+    a, b = socket.socketpair()
+    payload = json.dumps({'seg': [{'col': [list(range(3))] * 3}] * 10}).encode()
+    while not stop.is_set():
+        a.sendall(payload)
+        json.loads(b.recv(4096))
+        time.sleep(0.001)
+    a.close()
+    b.close()
+
+
+def sleeping_timeline(cues):
+    start = time.monotonic()
+    for offset, callback, args in cues:
+        time.sleep(max(0, start + offset - time.monotonic()))
+        callback(*args)
+
+
+def run(use_scheduler: bool, load=None) -> list:
+    stop = threading.Event()
+    if load:
+        for _ in range(LOAD_THREADS):
+            threading.Thread(target=load, args=(stop,), daemon=True).start()
+
+    scheduler = TimelineScheduler() if use_scheduler else None
+    lateness = []
+    lock = threading.Lock()
+
+    def record(start, offset):
+        with lock:
+            lateness.append(time.monotonic() - start - offset)
+
+    for n in range(TIMELINES):
+        start = time.monotonic()
+        cues = [(i * CUE_SPACING, record, (start, i * CUE_SPACING)) for i in range(CUES)]
+        timeline = Timeline(f'timeline_{n}', cues, preempt=False)
+        if scheduler:
+            scheduler.launch(timeline)
+        else:
+            threading.Thread(target=sleeping_timeline, args=(timeline.cues,), daemon=True).start()
+        time.sleep(CUE_SPACING * CUES / 4)
+
+    time.sleep(CUE_SPACING * CUES + 0.2)
+    stop.set()
+    if scheduler:
+        scheduler.shutdown()
+    return sorted(lateness)
+
+
+def report(name: str, lateness: list):
+    ms = [value * 1000 for value in lateness]
+    print(f"{name}: {len(ms)} cues, mean {sum(ms) / len(ms):6.2f} ms, "
+          f"p99 {ms[int(0.99 * (len(ms) - 1))]:6.2f} ms, max {ms[-1]:6.2f} ms")
+
+
+def within_bounds(lateness: list) -> bool:
+    mean = sum(lateness) / len(lateness)
+    p99 = lateness[int(0.99 * (len(lateness) - 1))]
+    return len(lateness) == TIMELINES * CUES and mean <= MAX_MEAN_LATENESS and p99 <= MAX_P99_LATENESS
+
+
+if __name__ == '__main__':
+    failed = []
+    for state, load, bounded in (('idle  ', None, True), ('io    ', io_busy, True), ('cpu   ', busy, False)):
+        report(f"sleeping threads, {state}", run(False, load))
+        lateness = run(True, load)
+        report(f"scheduler,        {state}", lateness)
+        if bounded and not within_bounds(lateness):
+            failed.append(state.strip())
+    if failed:
+        print(f"scheduler lateness above mean {MAX_MEAN_LATENESS * 1000:.0f} ms / "
+              f"p99 {MAX_P99_LATENESS * 1000:.0f} ms: {', '.join(failed)}")
+        sys.exit(1)
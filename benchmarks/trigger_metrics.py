@@ -0,0 +1,49 @@
+"""
+Cost of the trigger metrics on the firing path.
+
+Fires a trigger with a few no-op callbacks inline, once with the handler's metrics and
+once with them detached, and reports the time per firing. The callbacks do nothing so
+the difference is the instrumentation itself, in the show it sits next to HTTP requests
+and audio cues taking milliseconds.
+
+Run from the repository root: python -m benchmarks.trigger_metrics
+"""
+import time
+from flask import Flask
+from trigger import TriggerHandler
+
+CALLBACKS = 4
+FIRINGS = 50000
+
+
+def noop():
+    pass
+
+
+def per_firing(trigger) -> float:
+    start = time.perf_counter()
+    for _ in range(FIRINGS):
+        trigger.trigger()
+    return (time.perf_counter() - start) / FIRINGS
+
+
+if __name__ == '__main__':
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    handler = TriggerHandler(Flask(__name__))
+    handler.add("sensor", deactivate_cooldown=True)
+    for n in range(CALLBACKS):
+        handler.add_callback("sensor", f"callback_{n}", (noop, ()))
+    trigger = handler.get_trigger("sensor")
+
+    with_metrics = per_firing(trigger)
+    trigger.metrics = None
+    without_metrics = per_firing(trigger)
+    trigger.metrics = handler.metrics
+
+    print(f"{CALLBACKS} callbacks, {FIRINGS} firings")
+    print(f"  without metrics: {without_metrics * 1e6:.1f} us per firing")
+    print(f"  with metrics:    {with_metrics * 1e6:.1f} us per firing "
+          f"(+{(with_metrics - without_metrics) * 1e6:.1f} us)")
+    print(f"  end to end p99:  {handler.metrics.to_dict()['sensor']['end_to_end']['p99_ms']} ms")
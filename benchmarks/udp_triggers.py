@@ -0,0 +1,91 @@
+"""
+Triggers per second handled by the UDP listener compared with HTTP.
+
+Several sender threads fire triggers as fast as they can, every event is sent three
+times like the sensor sketch does. The HTTP baseline sends one GET per event to the
+same TriggerHandler running on werkzeug's threaded server, the way the old sketch did.
+Rate limiting is disabled so the numbers show the ingestion path itself.
+
+Run from the repository root: python -m benchmarks.udp_triggers
+"""
+import socket
+import threading
+import time
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+from trigger import TriggerHandler, UdpTriggerListener
+from trigger.udp import encode_trigger
+
+KEY = b"benchmark"
+SENDERS = 4
+DURATION = 3
+REPEATS = 3
+HTTP_PORT = 7190
+
+
+def udp_sender(port: int, triggerId: str, boot: int, stop: threading.Event, sent: list):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sequence = 0
+    while not stop.is_set():
+        sequence += 1
+        packet = encode_trigger(KEY, triggerId, boot, sequence)
+        for _ in range(REPEATS):
+            sock.sendto(packet, ("127.0.0.1", port))
+        # Leave the listener some room, a full socket buffer only measures the kernel
+        if sequence % 50 == 0:
+            time.sleep(0.001)
+    sent.append(sequence)
+    sock.close()
+
+
+def http_sender(triggerId: str, stop: threading.Event, sent: list):
+    count = 0
+    while not stop.is_set():
+        # A new connection per event like HTTPClient on the ESP32
+        requests.get(f"http://127.0.0.1:{HTTP_PORT}/trigger/{triggerId}")
+        count += 1
+    sent.append(count)
+
+
+def run(senders) -> tuple:
+    stop = threading.Event()
+    sent = []
+    threads = [threading.Thread(target=target, args=(*args, stop, sent)) for target, args in senders]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(sent)
+
+
+def make_handler() -> TriggerHandler:
+    app = Flask(__name__)
+    handler = TriggerHandler(app, async_callbacks=True)
+    for n in range(SENDERS):
+        handler.add(f"sensor_{n}", deactivate_cooldown=True)
+    return handler
+
+
+if __name__ == '__main__':
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    handler = make_handler()
+    listener = UdpTriggerListener(handler, KEY, port=0, rate=1e9, burst=10 ** 9)
+    events = run([(udp_sender, (listener.port, f"sensor_{n}", n, )) for n in range(SENDERS)])
+    time.sleep(0.5)
+    stats = listener.stats()
+    listener.stop()
+    print(f"udp:  {stats['accepted'] / DURATION:8.0f} triggers/s, {stats['received'] / DURATION:.0f} datagrams/s processed "
+          f"({stats['duplicate']} repeats dropped, {events / DURATION:.0f} events/s offered)")
+
+    handler = make_handler()
+    server = make_server("127.0.0.1", HTTP_PORT, handler.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    events = run([(http_sender, (f"sensor_{n}",)) for n in range(SENDERS)])
+    server.shutdown()
+    print(f"http: {events / DURATION:8.0f} triggers/s")
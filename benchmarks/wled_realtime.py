@@ -0,0 +1,71 @@
+"""
+Cost of streaming realtime frames to a group of WLED devices.
+
+Three UDP sinks on loopback addresses stand in for the devices. Measures the time to
+build and send one frame to all of them and whether an Animation holds its frame rate.
+
+Run from the repository root: python -m benchmarks.wled_realtime
+"""
+import socket
+import threading
+import time
+import numpy as np
+from wled.realtime import RealtimeOutput, Animation, DDP_PORT
+
+DEVICES = ["127.0.0.1", "127.0.0.2", "127.0.0.3"]
+LED_COUNT = 600
+FRAMES = 2000
+FPS = 60
+DURATION = 3
+
+
+def sink(ip: str, counts: dict, stop: threading.Event):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, DDP_PORT))
+    sock.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            sock.recv(2048)
+            counts[ip] += 1
+        except socket.timeout:
+            pass
+    sock.close()
+
+
+def rainbow(t: float) -> np.ndarray:
+    hue = (np.arange(LED_COUNT) / LED_COUNT + t / 4) % 1
+    frame = np.empty((LED_COUNT, 3), dtype=np.uint8)
+    frame[:, 0] = 127 + 127 * np.sin(2 * np.pi * hue)
+    frame[:, 1] = 127 + 127 * np.sin(2 * np.pi * (hue + 1 / 3))
+    frame[:, 2] = 127 + 127 * np.sin(2 * np.pi * (hue + 2 / 3))
+    return frame
+
+
+if __name__ == '__main__':
+    stop = threading.Event()
+    counts = {ip: 0 for ip in DEVICES}
+    for ip in DEVICES:
+        threading.Thread(target=sink, args=(ip, counts, stop), daemon=True).start()
+    time.sleep(0.1)
+
+    output = RealtimeOutput(DEVICES, LED_COUNT)
+    frame = rainbow(0)
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        output.send(frame)
+    per_frame = (time.perf_counter() - start) / FRAMES
+    print(f"send: {per_frame * 1e6:.0f} us per frame of {LED_COUNT} LEDs to {len(DEVICES)} devices "
+          f"({len(output.packets)} packets each)")
+
+    animation = Animation(output, rainbow, fps=FPS, duration=DURATION)
+    frames_before = output.frames
+    cpu_start = time.process_time()
+    animation.start()
+    animation.thread.join()
+    sent = output.frames - frames_before
+    print(f"animation: {sent / DURATION:.1f} fps of {FPS} requested, {animation.skipped} skipped, "
+          f"cpu {(time.process_time() - cpu_start) / DURATION * 100:.1f}% of a core")
+
+    time.sleep(0.3)
+    stop.set()
+    print(f"packets received: {counts}")
@@ -0,0 +1,165 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from flask import Flask, request, jsonify
+from common.session import session_pool
+
+CLOCK_SYNC_INTERVAL = 10
+CLOCK_SYNC_SAMPLES = 5
+CLOCK_HISTORY = 30
+# Drift is only estimated once this many samples were collected
+CLOCK_DRIFT_MIN_SAMPLES = 4
+
+logging.basicConfig(level=logging.INFO)
+
+
+class Clock:
+    """Local clock, used where no reference clock is configured."""
+
+    def offset_at(self, local_time: float) -> float:
+        """Seconds the reference clock is ahead of the local clock at local_time."""
+        return 0.0
+
+    def now(self) -> float:
+        """Current time on the reference clock."""
+        local_time = time.time()
+        return local_time + self.offset_at(local_time)
+
+    def to_local(self, reference_time: float) -> float:
+        """Convert a reference clock timestamp to the local clock."""
+        return reference_time - self.offset_at(reference_time)
+
+    def to_reference(self, local_time: float) -> float:
+        """Convert a local clock timestamp to the reference clock."""
+        return local_time + self.offset_at(local_time)
+
+    def status(self) -> dict:
+        return {'synchronised': False}
+
+
+class ClockSync(Clock):
+    def __init__(self, server: tuple, node: str, interval: float = CLOCK_SYNC_INTERVAL, samples: int = CLOCK_SYNC_SAMPLES):
+        """
+        NTP style offset and drift estimate against the control host's clock.
+
+        Every interval a burst of requests is sent to the ClockServer, the sample with the
+        lowest round trip time is kept and a line is fitted through the recent offsets to
+        estimate drift. The node's current estimate is reported back with every request.
+
+        :param server: (ip, port) of the control host.
+        :param node: Name the node is shown with on the dashboard.
+        """
+        self.url = f'http://{server[0]}:{server[1]}/api/clock'
+        self.node = node
+        self.interval = interval
+        self.samples = samples
+        self.history = deque(maxlen=CLOCK_HISTORY)
+        self.lock = threading.Lock()
+        self.reference_time = 0.0
+        self.offset = 0.0
+        self.drift = 0.0
+        self.jitter = 0.0
+        self.rtt = None
+        self.last_sync = None
+        self.stopFlag = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def offset_at(self, local_time: float) -> float:
+        with self.lock:
+            return self.offset + self.drift * (local_time - self.reference_time)
+
+    def _measure(self):
+        """Return (local time, offset, round trip time) of the best sample of a burst."""
+        best = None
+        for _ in range(self.samples):
+            t0 = time.time()
+            res = session_pool.get(self.url, params=self._report())
+            t3 = time.time()
+            res.raise_for_status()
+            data = res.json()
+            t1, t2 = data['receive'], data['transmit']
+            rtt = (t3 - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - t3)) / 2
+            if best is None or rtt < best[2]:
+                best = ((t0 + t3) / 2, offset, rtt)
+        return best
+
+    def _update(self, local_time: float, offset: float, rtt: float):
+        self.history.append((local_time, offset))
+        n = len(self.history)
+        mean_time = sum(t for t, _ in self.history) / n
+        mean_offset = sum(o for _, o in self.history) / n
+        variance = sum((t - mean_time) ** 2 for t, _ in self.history)
+        drift = 0.0
+        if n >= CLOCK_DRIFT_MIN_SAMPLES and variance:
+            drift = sum((t - mean_time) * (o - mean_offset) for t, o in self.history) / variance
+        residuals = [o - (mean_offset + drift * (t - mean_time)) for t, o in self.history]
+        with self.lock:
+            self.reference_time = mean_time
+            self.offset = mean_offset
+            self.drift = drift
+            self.jitter = math.sqrt(sum(r * r for r in residuals) / n)
+            self.rtt = rtt
+            self.last_sync = time.time()
+
+    def _run(self):
+        while not self.stopFlag.is_set():
+            try:
+                self._update(*self._measure())
+                logging.debug(f"Clock offset {self.offset * 1000:.2f} ms, jitter {self.jitter * 1000:.2f} ms, drift {self.drift * 1e6:.1f} ppm")
+            except Exception as e:
+                logging.error(f"Clock sync error: {e}")
+            self.stopFlag.wait(self.interval)
+
+    def _report(self) -> dict:
+        status = self.status()
+        return {key: value for key, value in status.items() if value is not None and key != 'synchronised'}
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'node': self.node,
+                'synchronised': self.last_sync is not None,
+                'offset': self.offset + self.drift * (time.time() - self.reference_time) if self.last_sync else None,
+                'jitter': self.jitter if self.last_sync else None,
+                'drift': self.drift if self.last_sync else None,
+                'rtt': self.rtt,
+            }
+
+    def stop(self):
+        self.stopFlag.set()
+
+
+class ClockServer:
+    def __init__(self, app: Flask):
+        """Reference clock endpoint on the control host, also collects the estimates reported by the nodes."""
+        self.app = app
+        self.nodes = {}
+        self._setup_routes()
+
+    def _setup_routes(self):
+
+        @self.app.route('/api/clock', methods=['GET'])
+        def clock():
+            receive = time.time()
+            node = request.args.get('node')
+            if node:
+                self.nodes[node] = {
+                    'offset': request.args.get('offset', type=float),
+                    'jitter': request.args.get('jitter', type=float),
+                    'drift': request.args.get('drift', type=float),
+                    'rtt': request.args.get('rtt', type=float),
+                    'last_seen': receive,
+                }
+            return jsonify(receive=receive, transmit=time.time())
+
+        @self.app.route('/api/clock/nodes', methods=['GET'])
+        def clock_nodes():
+            return jsonify(self.get_nodes())
+
+    def get_nodes(self) -> dict:
+        """Last reported clock estimate of every node."""
+        return dict(self.nodes)
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, List
+from common.health import health_monitor, NodeDownError
+
+FANOUT_MAX_WORKERS = 32
+FANOUT_TIMEOUT = 3
+
+logging.basicConfig(level=logging.INFO)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the process wide executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+        return _executor
+
+
+class MemberResult:
+    def __init__(self, member: Any):
+        """
+        Outcome of a single call made by fan_out.
+
+        :param member: The group member the call was made on.
+        """
+        self.member = member
+        self.value = None
+        self.error = None
+        self.timed_out = False
+        self.started = None
+        self.finished = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the call finished in time, raised nothing and did not return False."""
+        return self.error is None and not self.timed_out and self.value is not False
+
+    @property
+    def duration(self) -> float:
+        """Seconds the call took, or None if it did not finish."""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return f"MemberResult(member={self.member!r}, ok={self.ok}, value={self.value!r}, error={self.error!r}, timed_out={self.timed_out})"
+
+
+class FanOutResult:
+    def __init__(self, results: List[MemberResult]):
+        """Aggregated results of a fan_out call, in member order."""
+        self.results = results
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def ok(self) -> bool:
+        """True if every member call succeeded."""
+        return all(r.ok for r in self.results)
+
+    @property
+    def failed(self) -> List[MemberResult]:
+        """Results of the members whose call failed or timed out."""
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def skew(self) -> float:
+        """Seconds between the first and the last member call being sent."""
+        started = [r.started for r in self.results if r.started is not None]
+        if len(started) < 2:
+            return 0.0
+        return max(started) - min(started)
+
+    def values(self) -> list:
+        """Return value of every member call, None for failed or timed out calls."""
+        return [r.value if r.error is None and not r.timed_out else None for r in self.results]
+
+    def __repr__(self):
+        return f"FanOutResult(ok={self.ok}, failed={len(self.failed)}/{len(self.results)}, skew={self.skew * 1000:.1f}ms)"
+
+
+def _call(result: MemberResult, call: Callable):
+    result.started = time.perf_counter()
+    try:
+        result.value = call(result.member)
+    except Exception as e:
+        result.error = e
+        logging.error(f"Error calling {result.member}: {e}")
+    finally:
+        result.finished = time.perf_counter()
+
+
+def fan_out(members: Iterable, call: Callable[[Any], Any], timeout: float = FANOUT_TIMEOUT) -> FanOutResult:
+    """
+    Call `call(member)` for every member in parallel and wait for all of them.
+
+    :param members: The group members to call.
+    :param call: Callable that performs the operation on a single member.
+    :param timeout: Deadline in seconds for the whole fan-out. Calls still running
+                    afterwards are reported as timed out and left to finish in the background.
+
+    Members that are known to be down are not called, their result carries a NodeDownError.
+    """
+    results = [MemberResult(member) for member in members]
+    if not results:
+        return FanOutResult(results)
+
+    # Members the health monitor knows to be down fail right away instead of running into timeouts
+    calls = []
+    for result in results:
+        if health_monitor.is_down(result.member):
+            result.error = NodeDownError(f"{result.member} is down")
+        else:
+            calls.append(result)
+
+    executor = _get_executor()
+    futures = [executor.submit(_call, result, call) for result in calls]
+    _, not_done = wait(futures, timeout=timeout)
+
+    for future, result in zip(futures, calls):
+        if future in not_done:
+            result.timed_out = True
+            logging.error(f"Call to {result.member} did not finish within {timeout} seconds")
+
+    report = FanOutResult(results)
+    logging.debug(f"Fan-out to {len(results)} members finished: {report}")
+    return report
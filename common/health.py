@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+PROBE_INTERVAL = 5
+PROBE_TIMEOUT = 1
+MAX_BACKOFF = 60
+PROBE_WORKERS = 16
+
+logging.basicConfig(level=logging.INFO)
+
+
+class NodeDownError(Exception):
+    """Exception raised instead of calling a node the health monitor knows to be down."""
+    pass
+
+
+class _Node:
+    def __init__(self, name: str, device: Any, probe: Callable[[], bool]):
+        self.name = name
+        self.device = device
+        self.probe = probe
+        self.up = None
+        self.rtt = None
+        self.failures = 0
+        self.probes = 0
+        self.last_checked = None
+        self.last_change = None
+        self.probing = False
+
+    def status(self, current_time: float) -> dict:
+        return {
+            'up': self.up,
+            'rtt': self.rtt,
+            'failures': self.failures,
+            'probes': self.probes,
+            'age': current_time - self.last_checked if self.last_checked else None,
+            'last_change': self.last_change,
+        }
+
+
+class HealthMonitor:
+    def __init__(self, interval: float = PROBE_INTERVAL, timeout: float = PROBE_TIMEOUT,
+                 max_backoff: float = MAX_BACKOFF, workers: int = PROBE_WORKERS):
+        """
+        Probes every registered node in the background and caches whether it is reachable.
+
+        Due probes run concurrently on a small pool, so one unreachable node does not hold up
+        the others. A node that is down is probed less often, doubling the interval per failed
+        probe up to max_backoff, and every interval again once it answers. Callers ask
+        is_down, which only looks at the cache and never waits on the network.
+
+        :param interval: Seconds between probes of a reachable node.
+        :param timeout: Request timeout of a probe in seconds.
+        :param max_backoff: Longest time in seconds between probes of an unreachable node.
+        :param workers: Number of probes that can run at the same time.
+        """
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.workers = workers
+        self.nodes: Dict[str, _Node] = {}
+        self.by_device: Dict[int, _Node] = {}
+        self.schedule = []
+        self._sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.executor = None
+        self.thread = None
+
+    def configure(self, interval: float = None, timeout: float = None, max_backoff: float = None):
+        with self.condition:
+            if interval is not None:
+                self.interval = interval
+            if timeout is not None:
+                self.timeout = timeout
+            if max_backoff is not None:
+                self.max_backoff = max_backoff
+
+    def register(self, name: str, device: Any, probe: Callable[[], bool] = None):
+        """
+        Watch a node, probed right away and then on the schedule.
+
+        :param device: The device client, is_down accepts it in place of the name.
+        :param probe: Returns True if the node is reachable, defaults to device.check_connection.
+        """
+        if probe is None:
+            probe = lambda: device.check_connection(timeout=self.timeout)
+        with self.condition:
+            previous = self.nodes.get(name)
+            if previous is not None:
+                if previous.device is device:
+                    return
+                self.by_device.pop(id(previous.device), None)
+            node = _Node(name, device, probe)
+            self.nodes[name] = node
+            self.by_device[id(device)] = node
+            heapq.heappush(self.schedule, (time.monotonic(), next(self._sequence), node))
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="health-probe")
+                self.thread = threading.Thread(target=self._run, daemon=True, name="health-monitor")
+                self.thread.start()
+            self.condition.notify()
+
+    def unregister(self, name: str):
+        with self.condition:
+            node = self.nodes.pop(name, None)
+            if node is not None:
+                self.by_device.pop(id(node.device), None)
+
+    def _node(self, node) -> _Node:
+        if isinstance(node, str):
+            return self.nodes.get(node)
+        return self.by_device.get(id(node))
+
+    def is_down(self, node) -> bool:
+        """True if the node, given by name or device, failed its last probe. Unknown nodes are not down."""
+        entry = self._node(node)
+        return entry is not None and entry.up is False
+
+    def is_up(self, node) -> bool:
+        entry = self._node(node)
+        return entry is not None and entry.up is True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.schedule or self.schedule[0][0] > time.monotonic():
+                    self.condition.wait(self.schedule[0][0] - time.monotonic() if self.schedule else None)
+                _, _, node = heapq.heappop(self.schedule)
+                # Unregistered or replaced since it was scheduled
+                if self.nodes.get(node.name) is not node or node.probing:
+                    continue
+                node.probing = True
+            self.executor.submit(self._probe, node)
+
+    def _probe(self, node: _Node):
+        start_time = time.perf_counter()
+        try:
+            up = bool(node.probe())
+        except Exception as e:
+            logging.debug(f"Error probing {node.name}: {e}")
+            up = False
+        rtt = time.perf_counter() - start_time
+        with self.condition:
+            node.probing = False
+            node.probes += 1
+            node.last_checked = time.time()
+            if up is not node.up:
+                if node.up is not None or not up:
+                    logging.warning(f"Node {node.name} is {'up' if up else 'down'}")
+                node.last_change = node.last_checked
+            node.up = up
+            if up:
+                node.rtt = rtt
+                node.failures = 0
+                delay = self.interval
+            else:
+                node.failures += 1
+                delay = min(self.interval * 2 ** (node.failures - 1), self.max_backoff)
+            if self.nodes.get(node.name) is node:
+                heapq.heappush(self.schedule, (time.monotonic() + delay, next(self._sequence), node))
+                self.condition.notify()
+
+    def status(self) -> Dict[str, dict]:
+        """Cached reachability, RTT of the last successful probe in seconds and failed probes in a row per node."""
+        current_time = time.time()
+        with self.condition:
+            return {name: node.status(current_time) for name, node in self.nodes.items()}
+
+
+health_monitor = HealthMonitor()
@@ -0,0 +1,129 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 1
+READ_TIMEOUT = 2
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.1
+POOL_SIZE = 4
+
+logging.basicConfig(level=logging.INFO)
+
+
+class _HostSession:
+    def __init__(self, host: str, pool_size: int, retries: int, backoff: float):
+        """
+        Keep-alive session for a single device.
+
+        :param host: The host:port the session talks to.
+        """
+        self.host = host
+        self.session = requests.Session()
+        # Only connection failures are retried, a replayed cue would be audible
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff, raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.requests = 0
+        self.in_flight = 0
+
+    def connections(self) -> int:
+        """Number of TCP connections opened to the host so far."""
+        pools = self.adapter.poolmanager.pools
+        total = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def close(self):
+        self.session.close()
+
+
+class SessionPool:
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 retries: int = MAX_RETRIES, backoff: float = RETRY_BACKOFF, pool_size: int = POOL_SIZE):
+        """Per-host pool of keep-alive sessions shared by all device clients."""
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.configure(connect_timeout, read_timeout, retries, backoff, pool_size)
+
+    def configure(self, connect_timeout: float = None, read_timeout: float = None,
+                  retries: int = None, backoff: float = None, pool_size: int = None):
+        """Change the pool settings. Existing sessions are closed and reopened lazily."""
+        with self.lock:
+            if connect_timeout is not None:
+                self.connect_timeout = connect_timeout
+            if read_timeout is not None:
+                self.read_timeout = read_timeout
+            if retries is not None:
+                self.retries = retries
+            if backoff is not None:
+                self.backoff = backoff
+            if pool_size is not None:
+                self.pool_size = pool_size
+            for host_session in self.sessions.values():
+                host_session.close()
+            self.sessions.clear()
+        logging.debug(f"HTTP session pool configured: timeout=({self.connect_timeout}, {self.read_timeout}), retries={self.retries}, pool_size={self.pool_size}")
+
+    def _get_session(self, url: str) -> _HostSession:
+        host = urlsplit(url).netloc
+        with self.lock:
+            host_session = self.sessions.get(host)
+            if host_session is None:
+                host_session = _HostSession(host, self.pool_size, self.retries, self.backoff)
+                self.sessions[host] = host_session
+            return host_session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request through the keep-alive session of the url's host."""
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (self.connect_timeout, self.read_timeout)
+        host_session = self._get_session(url)
+        with self.lock:
+            host_session.requests += 1
+            host_session.in_flight += 1
+        try:
+            return host_session.session.request(method, url, **kwargs)
+        finally:
+            with self.lock:
+                host_session.in_flight -= 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self) -> dict:
+        """Requests, opened connections, connection reuse rate and in-flight requests per host."""
+        with self.lock:
+            host_sessions = list(self.sessions.values())
+        hosts = {}
+        for host_session in host_sessions:
+            requests_sent = host_session.requests
+            connections = host_session.connections()
+            hosts[host_session.host] = {
+                'requests': requests_sent,
+                'connections': connections,
+                'hit_rate': max(0, 1 - connections / requests_sent) if requests_sent else 0,
+                'in_flight': host_session.in_flight,
+            }
+        total_requests = sum(h['requests'] for h in hosts.values())
+        total_connections = sum(h['connections'] for h in hosts.values())
+        return {
+            'requests': total_requests,
+            'connections': total_connections,
+            'hit_rate': max(0, 1 - total_connections / total_requests) if total_requests else 0,
+            'in_flight': sum(h['in_flight'] for h in hosts.values()),
+            'hosts': hosts,
+        }
+
+
+session_pool = SessionPool()
@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+STATE_TTL = 30
+REFRESH_INTERVAL = 10
+
+logging.basicConfig(level=logging.INFO)
+
+
+class DeviceState:
+    def __init__(self, name: str, fetch: Callable[[], dict] = None, ttl: float = STATE_TTL):
+        """
+        Known state of a single device, used to drop commands that would not change anything.
+
+        Known values expire after ttl seconds so a device that was changed behind our back is
+        corrected by the next command at the latest. While a command is in flight, further
+        changes are merged and sent as one follow-up command carrying only the latest values.
+        A refresh whose fetch overlapped a command is discarded, the device may have answered
+        with the state from before the command.
+
+        :param name: Name of the device in the metrics.
+        :param fetch: Returns the state reported by the device, used for periodic refreshes.
+        :param ttl: Seconds a known value is trusted without a refresh.
+        """
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.known: Dict[str, tuple] = {}
+        self.desired: dict = {}
+        self.extra: dict = {}
+        self.sending = False
+        # Bumped by every command and invalidation, a refresh only applies if it did not change
+        self.generation = 0
+        # Keys that must not be cached before a deadline, e.g. while a timed pulse is running
+        self.volatile: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.refreshes = 0
+        self.stale_refreshes = 0
+
+    def _delta(self, changes: dict) -> dict:
+        current_time = time.monotonic()
+        delta = {}
+        for key, value in changes.items():
+            known = self.known.get(key)
+            if known is None or known[0] != value or current_time - known[1] > self.ttl:
+                delta[key] = value
+        return delta
+
+    def apply(self, changes: dict, send: Callable[[dict], bool], extra: dict = None) -> bool:
+        """
+        Send the part of changes that differs from the known state.
+
+        :param changes: Desired values, compared against the known state.
+        :param send: Sends a dict of changed values (plus extra) to the device, returns success.
+        :param extra: Values sent along with the changes but never compared, e.g. a transition time.
+        :return: False if the caller's own command failed. Commands that were suppressed or merged
+                 into one already in flight return True.
+        """
+        with self.lock:
+            delta = self._delta(changes)
+            if not delta:
+                self.suppressed += 1
+                return True
+            self.desired.update(delta)
+            self.extra = extra or {}
+            if self.sending:
+                self.coalesced += 1
+                return True
+            self.sending = True
+
+        result = None
+        while True:
+            with self.lock:
+                batch = self._delta(self.desired)
+                extra = self.extra
+                self.desired = {}
+                if not batch:
+                    self.sending = False
+                    return True if result is None else result
+                self.generation += 1
+            try:
+                ok = send({**batch, **extra})
+            except Exception as e:
+                logging.error(f"Error sending state to {self.name}: {e}")
+                ok = False
+            if result is None:
+                result = ok
+            with self.lock:
+                if ok:
+                    self.sent += 1
+                    self._remember(batch)
+                    # An explicit command replaces whatever timed change the device was running
+                    for key in batch:
+                        self.volatile.pop(key, None)
+                else:
+                    self.failed += 1
+                    for key in batch:
+                        self.known.pop(key, None)
+
+    def _remember(self, values: dict):
+        current_time = time.monotonic()
+        for key, value in values.items():
+            self.known[key] = (value, current_time)
+
+    def invalidate(self, keys: Iterable[str] = None, duration: float = None):
+        """
+        Forget known values, all of them if keys is omitted, so the next command is sent.
+
+        :param duration: Seconds in which refreshes must not cache the keys either, e.g. while
+                         the device runs a pulse that changes them on its own.
+        """
+        with self.lock:
+            self.generation += 1
+            if keys is None:
+                self.known.clear()
+            for key in keys or ():
+                self.known.pop(key, None)
+                if duration is not None:
+                    self.volatile[key] = max(self.volatile.get(key, 0), time.monotonic() + duration)
+
+    def refresh(self) -> bool:
+        """Replace the known state with the state reported by the device."""
+        if self.fetch is None:
+            return False
+        with self.lock:
+            if self.sending:
+                return False
+            generation = self.generation
+        try:
+            reported = self.fetch()
+        except Exception as e:
+            logging.debug(f"Error refreshing state of {self.name}: {e}")
+            reported = None
+        with self.lock:
+            if self.generation != generation or self.sending:
+                # A command or invalidation happened while fetching, keep what it set
+                self.stale_refreshes += 1
+                return False
+            if reported is None:
+                self.known.clear()
+                return False
+            current_time = time.monotonic()
+            self.volatile = {key: until for key, until in self.volatile.items() if until > current_time}
+            self.known.clear()
+            self._remember({key: value for key, value in reported.items() if key not in self.volatile})
+            self.refreshes += 1
+            return True
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                'sent': self.sent,
+                'suppressed': self.suppressed,
+                'coalesced': self.coalesced,
+                'failed': self.failed,
+                'refreshes': self.refreshes,
+                'stale_refreshes': self.stale_refreshes,
+                'known': {key: value for key, (value, _) in self.known.items()},
+            }
+
+
+class StateCache:
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        """Registry of all device states, refreshed from the devices by a single background thread."""
+        self.devices: Dict[str, DeviceState] = {}
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def configure(self, refresh_interval: float = None):
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    def device(self, name: str, fetch: Callable[[], dict] = None, ttl: float = STATE_TTL) -> DeviceState:
+        """Return the state of a device, created on first use."""
+        with self.lock:
+            if name not in self.devices:
+                self.devices[name] = DeviceState(name, fetch, ttl)
+            elif fetch is not None:
+                # A new object for the same device, e.g. after a show reload, answers the refreshes
+                self.devices[name].fetch = fetch
+            if fetch is not None and self.thread is None:
+                self.thread = threading.Thread(target=self._refresh_loop, daemon=True, name="state-refresh")
+                self.thread.start()
+            return self.devices[name]
+
+    def remove(self, name: str):
+        """Forget a device that is no longer used, it is not refreshed anymore."""
+        with self.lock:
+            self.devices.pop(name, None)
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            with self.lock:
+                devices = list(self.devices.values())
+            for device in devices:
+                device.refresh()
+
+    def metrics(self) -> dict:
+        """Sent, suppressed and coalesced commands, overall and per device."""
+        with self.lock:
+            devices = {name: device.metrics() for name, device in self.devices.items()}
+        totals = {key: sum(d[key] for d in devices.values()) for key in ('sent', 'suppressed', 'coalesced', 'failed')}
+        commands = totals['sent'] + totals['suppressed'] + totals['coalesced']
+        return {
+            **totals,
+            'suppression_rate': (totals['suppressed'] + totals['coalesced']) / commands if commands else 0,
+            'devices': devices,
+        }
+
+
+state_cache = StateCache()
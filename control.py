@@ -1,10 +1,16 @@
-from trigger import TriggerHandler
+from trigger import TriggerHandler, UdpTriggerListener, Show, ShowError
 from audioplayer.api import AudioPlayer, AudioPlayerGroup
-from flask import Flask
+from flask import Flask, jsonify
 import logging
+import os
+import signal
 from wled.api import Wled, WledGroup
 from raspigpio.api import GPIOPin, GPIOGroup 
 from audiostreaming.control import StreamingOutput, StreamingControlServerRoutes
+from common.session import session_pool
+from common.statecache import state_cache
+from common.health import health_monitor
+from common.clock import ClockServer
 
 flask_logger = logging.getLogger('werkzeug')
 flask_logger.setLevel(logging.WARNING)
@@ -12,78 +18,59 @@ root_logger = logging.getLogger('root')
 root_logger.setLevel(logging.WARNING)
 
 app = Flask(__name__)
-trigger_handler = TriggerHandler(app)
+clock_server = ClockServer(app)
+trigger_handler = TriggerHandler(app, async_callbacks=True, clock=clock_server)
+# Signed edge events from the motion sensors, key has to match the sketch
+trigger_key = os.environ.get("TRIGGER_KEY")
+if trigger_key:
+    udp_trigger_listener = UdpTriggerListener(trigger_handler, trigger_key.encode(), port=7001)
+else:
+    udp_trigger_listener = None
+    logging.error("TRIGGER_KEY is not set, not listening for UDP triggers")
 
-# Audio Players
-audio_player_1 = AudioPlayer('192.168.1.93', 5000)
-audio_player_2 = AudioPlayer('192.168.1.90', 5000)
-audio_player_3 = AudioPlayer('192.168.1.89', 5000)
-all_audio_players = AudioPlayerGroup([audio_player_1, audio_player_2, audio_player_3])
+# HTTP connection pool shared by all device clients
+session_pool.configure(connect_timeout=1, read_timeout=2, retries=2, pool_size=4)
 
-# Audio Streaming
-outputs = {"raspi-speaker-1": StreamingOutput('192.168.1.93', 5000)}
-audio_streaming_control_server = StreamingControlServerRoutes(app, outputs)
-
-# WLED
-wled_1 = Wled('192.168.1.78')
-wled_2 = Wled('192.168.1.121')
-wled_3 = Wled('192.168.1.122')
-all_wleds = WledGroup([wled_1, wled_2, wled_3])
-
-# Smoke Modules
-# smoke_module_1 = GPIOPin("192.168.1.88", 5000, "smoke")
-# smoke_module_2 = GPIOPin("192.168.1.90", 5000, "smoke")
-# smoke_module_3 = GPIOPin("192.168.1.89", 5000, "smoke")
-# all_smoke_modules = GPIOGroup([smoke_module_1, smoke_module_2, smoke_module_3])
-
-# Triggers
-trigger_handler.add('motion_sensor_1')
-trigger_handler.add_callback('motion_sensor_1', 'motion_sensor_callback_1', (audio_player_1.play, ("scare",)))
-trigger_handler.add('motion_sensor_2')
-trigger_handler.add_callback('motion_sensor_2', 'motion_sensor_callback_2', (audio_player_2.play, ("scare",)))
-trigger_handler.add('motion_sensor_3')
-trigger_handler.add('doorbell_sensor')
-
-# trigger_handler.add('smoke_module_1', deactivate_cooldown=True)
-# trigger_handler.add_callback('smoke_module_1', 'smoke_module_1_callback', (smoke_module_1.turn_on_for, (5,)))
-
-# trigger_handler.add('smoke_module_2', deactivate_cooldown=True)
-# trigger_handler.add_callback('smoke_module_2', 'smoke_module_2_callback', (smoke_module_2.turn_on_for, (5,)))
-
-# trigger_handler.add('smoke_module_3', deactivate_cooldown=True)
-# trigger_handler.add_callback('smoke_module_3', 'smoke_module_3_callback', (smoke_module_3.turn_on_for, (5,)))
+@app.route('/api/httpclient/metrics')
+def http_client_metrics():
+    return jsonify(session_pool.metrics())
 
-trigger_handler.add('audio_player_1_scare', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_1_scare', 'audio_player_callback_1_scare', (audio_player_1.play, ("scare",)))
+# Known device states, redundant WLED and GPIO commands are not sent
+state_cache.configure(refresh_interval=10)
 
-trigger_handler.add('audio_player_2_scare', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_2_scare', 'audio_player_callback_2_scare', (audio_player_2.play, ("scare",)))
+@app.route('/api/statecache/metrics')
+def state_cache_metrics():
+    return jsonify(state_cache.metrics())
 
-trigger_handler.add('audio_player_3_scare', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_3_scare', 'audio_player_callback_3_scare', (audio_player_3.play, ("scare",)))
+# Reachability of every node, callbacks and group members that are down are skipped
+health_monitor.configure(interval=5, timeout=1, max_backoff=60)
 
-trigger_handler.add('stop_audio_scare', deactivate_cooldown=True)
-trigger_handler.add_callback('stop_audio_scare', 'stop_audio_callback_scare', (all_audio_players.stop, ("scare",)))
-
-trigger_handler.add('play_audio_theme', deactivate_cooldown=True)
-trigger_handler.add_callback('play_audio_theme', 'play_audio_callback_theme', (all_audio_players.play, ("theme", 0.2, -1)))
-
-trigger_handler.add('stop_audio_theme', deactivate_cooldown=True)
-trigger_handler.add_callback('stop_audio_theme', 'stop_audio_callback_theme', (all_audio_players.stop, ("theme",)))
-
-trigger_handler.add('audio_player_1_rickroll', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_1_rickroll', 'audio_player_callback_1_rickroll', (audio_player_1.play, ("rickroll",)))
-
-trigger_handler.add('audio_player_1_stop_rickroll', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_1_stop_rickroll', 'audio_player_callback_1_stop_rickroll', (audio_player_1.stop, ("rickroll",)))
-
-trigger_handler.add('audio_player_2_rickroll', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_2_rickroll', 'audio_player_callback_2_rickroll', (audio_player_2.play, ("rickroll",)))
-
-trigger_handler.add('audio_player_2_stop_rickroll', deactivate_cooldown=True)
-trigger_handler.add_callback('audio_player_2_stop_rickroll', 'audio_player_callback_2_stop_rickroll', (audio_player_2.stop, ("rickroll",)))
-# trigger_handler.add('stop_smoke', deactivate_cooldown=True)
-# trigger_handler.add_callback('stop_smoke', 'stop_smoke_callback', (all_smoke_modules.turn_off, ()))
+# Audio Streaming
+outputs = {"raspi-speaker-1": StreamingOutput('192.168.1.93', 5000)}
+audio_streaming_control_server = StreamingControlServerRoutes(app, outputs, multicast=True)
+for name, output in outputs.items():
+    health_monitor.register(name, output)
+
+# Devices, groups and triggers come from the show file, reloaded on SIGHUP or /trigger/api/show/reload
+show = Show(trigger_handler, os.environ.get("SHOW_FILE", os.path.join(os.path.dirname(__file__), "show.yaml")), {
+    'audioplayer': (AudioPlayer, AudioPlayerGroup),
+    'wled': (Wled, WledGroup),
+    'gpio': (GPIOPin, GPIOGroup),
+})
+show.load()
+
+def reload_show(signum, frame):
+    try:
+        show.load()
+    except ShowError:
+        pass  # Logged by Show, the previous show keeps running
+    except Exception as e:
+        # Raising here would end the main thread and with it the control server
+        logging.error(f"Error reloading show file: {e}")
+
+# Not on Windows, /trigger/api/show/reload works everywhere
+if hasattr(signal, 'SIGHUP'):
+    signal.signal(signal.SIGHUP, reload_show)
 
 
 if __name__ == '__main__':
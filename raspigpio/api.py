@@ -1,74 +1,140 @@
-import requests
 import logging
+import time
+from common.fanout import fan_out
+from common.session import session_pool
+from common.statecache import state_cache
+
+PATTERN_LEAD_TIME = 0.2
 
 logging.basicConfig(level=logging.INFO)
 
 
+def _play_pattern(ip: str, port: int, ids: list, steps: list, at: float = None):
+    """
+    Send a pattern for several pins on one server in a single request.
+
+    :param steps: (offset, state) tuples for all pins or (offset, state, [ids]) for some of them.
+    :param at: Start time on the reference clock, right away if omitted.
+    """
+    payload = {'pins': ids, 'steps': []}
+    for step in steps:
+        entry = {'at': step[0], 'state': bool(step[1])}
+        if len(step) > 2:
+            entry['pins'] = [id for id in step[2] if id in ids]
+        payload['steps'].append(entry)
+    if at is not None:
+        payload['at'] = at
+    try:
+        res = session_pool.post(f"http://{ip}:{port}/api/gpio/pattern", json=payload)
+        if not res.ok:
+            logging.error(f"Error playing pattern on pins {ids}: {res.text}")
+        return res.ok
+    except Exception as e:
+        logging.error(f"Connection error: {e}")
+        return False
+
+
+def _pattern_duration(steps: list, at: float = None) -> float:
+    """Seconds from now until the last step of a pattern has switched."""
+    end = max((step[0] for step in steps), default=0)
+    if at is not None:
+        end += max(0, at - time.time())
+    return end
+
 class GPIOPin:
     def __init__(self, ip: str, port: int, id: int):
         self.ip = ip
         self.port = port
         self.id = id
         self.base_url = f"http://{self.ip}:{self.port}/api/gpio/{self.id}"
+        self.device_state = state_cache.device(f"gpio:{self.ip}:{self.port}/{self.id}", self._fetch_state)
 
-    def check_connection(self):
+    def check_connection(self, timeout: float = None):
         try:
-            res = requests.get(f"{self.base_url}/ping")
+            res = session_pool.get(f"{self.base_url}/ping", timeout=timeout)
             if not res.ok:
                 logging.error(f"Error pinging pin {self.id}")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
     def turn_on(self, duration: int = None):
-        try:
-            res = requests.get(f"{self.base_url}/on")
-            if not res.ok:
-                logging.error(f"Error turning on pin {self.id}")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+        return self.device_state.apply({'on': True}, lambda changes: self._switch("on"))
 
     def turn_on_for(self, duration: int):
-        try:
-            res = requests.get(f"{self.base_url}/on?duration={duration}")
-            if not res.ok:
-                logging.error(f"Error turning on pin {self.id}")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+        # Always sent, a repeated pulse extends the running one
+        ok = self._switch(f"on?duration={duration}")
+        # The pin turns itself off when the pulse ends, the state is not cached until then
+        self.device_state.invalidate(['on'], duration)
+        return ok
 
     def turn_off(self):
+        return self.device_state.apply({'on': False}, lambda changes: self._switch("off"))
+
+    def _switch(self, command: str):
         try:
-            res = requests.get(f"{self.base_url}/off")
+            res = session_pool.get(f"{self.base_url}/{command}")
             if not res.ok:
-                logging.error(f"Error turning off pin {self.id}")
+                logging.error(f"Error switching pin {self.id} {command}")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
+
+    def _fetch_state(self) -> dict:
+        res = session_pool.get(f"{self.base_url}/state")
+        res.raise_for_status()
+        data = res.json()
+        # While a pulse or pattern runs the state is about to change on its own
+        return {} if data.get('scheduled') else {'on': data['on']}
+
+    def play_pattern(self, steps: list, at: float = None):
+        """Switch the pin at (offset, state) steps, timed by the server."""
+        ok = _play_pattern(self.ip, self.port, [self.id], steps, at)
+        self.device_state.invalidate(['on'], _pattern_duration(steps, at))
+        return ok
 
 class GPIOGroup:
     def __init__(self, pins: list):
         self.pins = pins
 
     def check_connection(self):
-        result = []
-        for pin in self.pins:
-            result.append(pin.check_connection())
-        return result
-    
+        return fan_out(self.pins, lambda pin: pin.check_connection()).values()
+
     def turn_on(self):
-        for pin in self.pins:
-            pin.turn_on()
+        return fan_out(self.pins, lambda pin: pin.turn_on())
 
     def turn_on_for(self, duration: int):
-        for pin in self.pins:
-            pin.turn_on_for(duration)
+        return fan_out(self.pins, lambda pin: pin.turn_on_for(duration))
 
     def turn_off(self):
+        return fan_out(self.pins, lambda pin: pin.turn_off())
+
+    def play_pattern(self, steps: list, lead: float = PATTERN_LEAD_TIME, at: float = None):
+        """
+        Play a pattern with one request per server.
+
+        Steps are (offset, state) tuples for all pins or (offset, state, [ids]) for some of
+        them. When the pins are spread over several servers they start at a common time lead
+        seconds from now, unless lead is None.
+        """
+        servers = {}
+        for pin in self.pins:
+            servers.setdefault((pin.ip, pin.port), []).append(pin.id)
+        if at is None and lead is not None and len(servers) > 1:
+            at = time.time() + lead
+        result = fan_out(servers, lambda server: _play_pattern(*server, servers[server], steps, at))
+        duration = _pattern_duration(steps, at)
         for pin in self.pins:
-            pin.turn_off()
+            pin.device_state.invalidate(['on'], duration)
+        return result
 
 if __name__ == "__main__":
     pin = GPIOPin("127.0.0.1", 5001, "test")
     pin2 = GPIOPin("127.0.0.1", 5001, "test2")
     group = GPIOGroup([pin, pin2])
     group.turn_on_for(5)
+    group.play_pattern([(i * 0.1, i % 2 == 0) for i in range(20)] + [(2, False)])
 
     
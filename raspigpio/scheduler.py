@@ -0,0 +1,63 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+logging.basicConfig(level=logging.INFO)
+
+class PinScheduler:
+    def __init__(self):
+        """
+        Deadline heap shared by all pins of a process, served by a single timer thread.
+
+        The thread sleeps until the earliest deadline or until an earlier one is added, so
+        idle pins cost nothing and a pulse never needs a thread of its own. Callbacks run on
+        the timer thread and must be short, they are meant for flipping a GPIO.
+        """
+        self.queue: List[Tuple[float, int]] = []
+        self.pending: Dict[int, Tuple[Callable, Tuple]] = {}
+        self.condition = threading.Condition()
+        self._tokens = itertools.count(1)
+        self.thread = threading.Thread(target=self._run, daemon=True, name="gpio-scheduler")
+        self.thread.start()
+
+    def schedule(self, delay: float, callback: Callable, args: Tuple = ()) -> int:
+        """Run callback after delay seconds, returns a token that can be cancelled."""
+        token = next(self._tokens)
+        with self.condition:
+            self.pending[token] = (callback, args)
+            heapq.heappush(self.queue, (time.monotonic() + delay, token))
+            if self.queue[0][1] == token:
+                self.condition.notify()
+        return token
+
+    def cancel(self, token: int) -> bool:
+        """Cancel a scheduled callback, returns False if it already ran or was cancelled."""
+        with self.condition:
+            return self.pending.pop(token, None) is not None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, token = heapq.heappop(self.queue)
+                entry = self.pending.pop(token, None)
+            if entry is None:
+                continue
+            callback, args = entry
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error(f"Error executing scheduled GPIO callback {callback}: {e}")
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'pending': len(self.pending),
+                'queued': len(self.queue),
+            }
+
+pin_scheduler = PinScheduler()
@@ -1,16 +1,28 @@
 import logging
+import math
 import RPi.GPIO as GPIO
-import time
 import threading
-from flask import Flask, request
+import time
+from typing import List, Tuple
+from flask import Flask, request, jsonify
+from common.clock import Clock
+from raspigpio.scheduler import PinScheduler, pin_scheduler
+
+MAX_PATTERN_STEPS = 1000
+MAX_PATTERN_DELAY = 60
 
 logging.basicConfig(level=logging.INFO)
 
 class GPIOPin:
-    def __init__(self, pin):
-        """Initialize a specified pin"""
+    def __init__(self, pin, scheduler: PinScheduler = None):
+        """Initialize a specified pin, pulses are timed by the shared pin scheduler unless one is given"""
         self.pin = pin
-        self.stop_event = threading.Event()
+        self.scheduler = scheduler or pin_scheduler
+        self.lock = threading.Lock()
+        self.scheduled = []
+        self.pending = 0
+        self.generation = 0
+        self.state = False
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.pin, GPIO.OUT)
         self.turn_off()
@@ -18,56 +30,95 @@ class GPIOPin:
 
     def turn_on(self):
         """Turn on the pin until disabled"""
-        self.stop_thread()
-        GPIO.setmode(GPIO.BCM)
-        GPIO.output(self.pin, True)
+        with self.lock:
+            self._cancel_scheduled()
+            self._output(True)
         logging.debug(f"Turned on pin {self.pin}")
 
     def turn_on_for(self, duration):
-        """Turn on the pin for a specified number of seconds"""
-        self.stop_thread()
-        thread = threading.Thread(target=self._turn_on_for_thread, args=(duration,))
-        thread.start()
-
-    def _turn_on_for_thread(self, duration):
-        logging.debug(f"Started new thread for pin {self.pin} that will stay on for {duration} seconds")
-        self.turn_on()
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            if self.stop_event.is_set():
-                logging.debug(f"Stopping the thread for {self.pin} prematurely after {time.time() - start_time} seconds because a second thread was started")
-                break
-            time.sleep(0.001)
-
-        self.turn_off()
+        """Turn on the pin for a specified number of seconds, replacing a running pulse or pattern"""
+        with self.lock:
+            self._cancel_scheduled()
+            self._output(True)
+            self.scheduled = [self.scheduler.schedule(duration, self._scheduled_output, (self.generation, False))]
+            self.pending = 1
+        logging.debug(f"Turned on pin {self.pin} for {duration} seconds")
+
+    def play_pattern(self, steps: List[Tuple[float, bool]], delay: float = 0):
+        """
+        Switch the pin at the given offsets, replacing a running pulse or pattern.
+
+        :param steps: (offset in seconds, state) tuples.
+        :param delay: Seconds until the pattern starts.
+        """
+        with self.lock:
+            self._cancel_scheduled()
+            self.scheduled = [
+                self.scheduler.schedule(max(0, delay + offset), self._scheduled_output, (self.generation, state))
+                for offset, state in steps
+            ]
+            self.pending = len(self.scheduled)
+        logging.debug(f"Playing pattern of {len(steps)} steps on pin {self.pin} in {delay} seconds")
+
+    def _scheduled_output(self, generation, value: bool):
+        with self.lock:
+            # A newer pulse, pattern or an explicit on/off took over while the callback was due
+            if self.generation != generation:
+                return
+            self._output(value)
+            self.pending -= 1
+            if self.pending == 0:
+                # The pulse or pattern is over
+                self.scheduled = []
+
+    def is_scheduled(self) -> bool:
+        """True while a pulse or pattern is still going to switch the pin."""
+        with self.lock:
+            return self.pending > 0
 
     def turn_off(self):
         """Turn off the pin until enabled"""
-        self.stop_thread()
-        GPIO.setmode(GPIO.BCM)
-        GPIO.output(self.pin, False)
+        with self.lock:
+            self._cancel_scheduled()
+            self._output(False)
         logging.debug(f"Turned off pin {self.pin}")
-    
-    def stop_thread(self):
-        """Stop thread by starting event"""
-        self.stop_event.set()
-        time.sleep(0.002)
-        self.stop_event.clear()
+
+    def _cancel_scheduled(self):
+        self.generation += 1
+        for token in self.scheduled:
+            self.scheduler.cancel(token)
+        self.scheduled = []
+        self.pending = 0
+
+    def _output(self, value: bool):
+        GPIO.setmode(GPIO.BCM)
+        GPIO.output(self.pin, value)
+        self.state = value
 
     def cleanup(self):
         """Clean up GPIO pins used"""
+        with self.lock:
+            self._cancel_scheduled()
         GPIO.cleanup()
         logging.debug(f"Cleaned up GPIOs")
 
 class GPIOPinServer:
-    def __init__(self, app: Flask, pin: int, id: str):
+    def __init__(self, app: Flask, pin: int, id: str, clock: Clock = None):
         self.app = app
         self.id = id
         self.pin = pin
+        self.clock = clock or Clock()
         self.gpio_pin = GPIOPin(pin)
         self._setup_routes()
 
     def _setup_routes(self):
+        # One pattern endpoint per app covers the pins of all servers registered on it
+        servers = self.app.extensions.setdefault('gpio_pin_servers', {})
+        if not servers:
+            self.app.route('/api/gpio/pattern', methods=['POST'], endpoint='play_gpio_pattern')(
+                lambda: _handle_pattern(servers)
+            )
+        servers[self.id] = self
 
         self.app.route(f'/api/gpio/{self.id}/ping', methods=['GET'], endpoint=f'ping_gpio_{self.id}')(
             lambda: ("", 200)
@@ -81,10 +132,14 @@ class GPIOPinServer:
             lambda: self._handle_turn_off()
         )
 
+        self.app.route(f'/api/gpio/{self.id}/state', methods=['GET'], endpoint=f'state_gpio_{self.id}')(
+            lambda: jsonify({'on': self.gpio_pin.state, 'scheduled': self.gpio_pin.is_scheduled()})
+        )
+
     def _handle_turn_on(self):
         duration = request.args.get('duration', None)
         if duration is not None:
-            self.gpio_pin.turn_on_for(int(duration))
+            self.gpio_pin.turn_on_for(float(duration))
         else:
             self.gpio_pin.turn_on()
         return "", 200
@@ -93,6 +148,58 @@ class GPIOPinServer:
         self.gpio_pin.turn_off()
         return "", 200
 
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _is_pin_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(pin, str) for pin in value)
+
+
+def _handle_pattern(servers: dict):
+    """
+    Play timed on/off steps on several pins of this process.
+
+    Expects JSON {"pins": [ids], "steps": [{"at": offset, "state": bool, "pins": [ids]}], "at": start}.
+    A step without pins applies to all pins of the request, the optional start time is on
+    the reference clock, without it the pattern starts right away.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('steps'), list) or not _is_pin_list(data.get('pins')):
+        return "Expected a list of pin ids and a list of steps", 400
+    if not data['pins'] or len(data['steps']) > MAX_PATTERN_STEPS:
+        return f"Expected at least one pin and at most {MAX_PATTERN_STEPS} steps", 400
+    if data.get('at') is not None and not _is_number(data['at']):
+        return "Start time 'at' must be a number", 400
+    unknown = [pin for pin in data['pins'] if pin not in servers]
+    if unknown:
+        return f"Unknown pins {unknown}", 404
+
+    steps = {pin: [] for pin in data['pins']}
+    for step in data['steps']:
+        if not isinstance(step, dict) or not _is_number(step.get('at')) or not isinstance(step.get('state'), (bool, int, float)):
+            return "Steps need a numeric offset 'at' and a 'state'", 400
+        if step['at'] < 0:
+            return "Step offsets must not be negative", 400
+        step_pins = step.get('pins', data['pins'])
+        if not _is_pin_list(step_pins):
+            return "Step pins must be a list of pin ids", 400
+        for pin in step_pins:
+            if pin not in steps:
+                return f"Step pin {pin} not in pins", 400
+            steps[pin].append((float(step['at']), bool(step['state'])))
+
+    delay = 0
+    if data.get('at') is not None:
+        clock = servers[data['pins'][0]].clock
+        delay = clock.to_local(data['at']) - time.time()
+        if delay > MAX_PATTERN_DELAY:
+            return f"Pattern start more than {MAX_PATTERN_DELAY} seconds ahead", 400
+
+    for pin, pin_steps in steps.items():
+        servers[pin].gpio_pin.play_pattern(pin_steps, delay)
+    return "", 200
+
 
         
 if __name__ == "__main__":
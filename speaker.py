@@ -1,13 +1,19 @@
+import os
+import socket
 from flask import Flask
 from audioplayer.server import AudioPlayerServer
 from audiostreaming.output import AudioStreamingOutputServer
+from common.clock import ClockSync
 #from raspigpio.server import GPIOPinServer
 
+# Host and port control.py is running on
+CONTROL_SERVER = (os.environ.get("CONTROL_HOST", "127.0.0.1"), int(os.environ.get("CONTROL_PORT", "7000")))
 
 app = Flask(__name__)
 
-audio_player = AudioPlayerServer(app)
-streaming_output = AudioStreamingOutputServer(app)
-#gpio_pin = GPIOPinServer(app, 2, "smoke")
+clock = ClockSync(CONTROL_SERVER, socket.gethostname())
+audio_player = AudioPlayerServer(app, pinned=["scare"], clock=clock)
+streaming_output = AudioStreamingOutputServer(app, clock=clock)
+#gpio_pin = GPIOPinServer(app, 2, "smoke", clock=clock)
 
 app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
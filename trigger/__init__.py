@@ -1 +1,3 @@
 from .trigger import TriggerHandler
+from .udp import UdpTriggerListener
+from .show import Show, ShowError
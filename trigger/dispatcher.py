@@ -0,0 +1,168 @@
+import heapq
+import logging
+import threading
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from common.health import health_monitor
+
+CALLBACK_WORKERS = 8
+CALLBACK_TIMEOUT = 5
+CALLBACK_QUEUE_LIMIT = 64
+COMPLETION_LOG_SIZE = 200
+
+logging.basicConfig(level=logging.INFO)
+
+class CallbackQueueFullError(Exception):
+    """Exception raised when the callback queue has no room for a trigger's callbacks."""
+    pass
+
+class CallbackDispatcher:
+    def __init__(self, workers: int = CALLBACK_WORKERS, queue_limit: int = CALLBACK_QUEUE_LIMIT,
+                 timeout: float = CALLBACK_TIMEOUT, log_size: int = COMPLETION_LOG_SIZE):
+        """
+        Run trigger callbacks on a bounded worker pool instead of the request thread.
+
+        :param workers: Number of callbacks that can run at the same time.
+        :param queue_limit: Maximum number of queued and running callbacks.
+        :param timeout: Default time in seconds a callback may take. Past it the callback is
+                        recorded as timed out and gives up its queue slot, the worker thread
+                        is only freed once the call returns since threads cannot be interrupted.
+        :param log_size: Number of finished callbacks kept in the completion log.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="trigger-callback")
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.pending = 0
+        self.running: dict = {}
+        self.completion_log = deque(maxlen=log_size)
+        self.lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        # Callbacks that timed out and still hold a worker
+        self.abandoned = 0
+        self.deadlines = []
+        self.deadline_condition = threading.Condition()
+        self.watchdog = threading.Thread(target=self._watchdog, daemon=True, name="trigger-callback-watchdog")
+        self.watchdog.start()
+
+    def dispatch(self, triggerId: str, callbacks: List[Tuple[str, Callable, Tuple, float]], on_done: Callable[[dict], None] = None):
+        """
+        Queue all callbacks of a trigger, or none of them if the queue is full.
+
+        :param triggerId: The ID of the trigger the callbacks belong to.
+        :param callbacks: (callbackId, callback, args, timeout) tuples, timeout may be None.
+        :param on_done: Called with the completion record of every callback once it finished.
+        """
+        queued_at = time.time()
+        with self.lock:
+            if self.pending + len(callbacks) > self.queue_limit:
+                for callbackId, _, _, _ in callbacks:
+                    self.completion_log.append(self._record(triggerId, callbackId, queued_at, None, status='rejected'))
+                raise CallbackQueueFullError(f"Callback queue full ({self.pending}/{self.queue_limit}), dropped callbacks of trigger {triggerId}")
+            self.pending += len(callbacks)
+
+        for index, (callbackId, callback, args, timeout) in enumerate(callbacks):
+            record = self._record(triggerId, callbackId, queued_at, self.timeout if timeout is None else timeout)
+            try:
+                self.executor.submit(self._run, record, callback, args, on_done)
+            except Exception:
+                # Shut down, hand back the slots of this and the remaining callbacks
+                with self.lock:
+                    self.pending -= len(callbacks) - index
+                    for callbackId, _, _, _ in callbacks[index:]:
+                        self.completion_log.append(self._record(triggerId, callbackId, queued_at, None, status='rejected'))
+                raise
+
+    def _record(self, triggerId: str, callbackId: str, queued_at: float, timeout: float, status: str = 'queued') -> dict:
+        return {
+            'id': next(self._job_ids),
+            'trigger': triggerId,
+            'callback': callbackId,
+            'status': status,
+            'error': None,
+            'timeout': timeout,
+            'queued_at': queued_at,
+            'started_at': None,
+            'finished_at': None,
+        }
+
+    def _run(self, record: dict, callback: Callable, args: Tuple, on_done: Callable[[dict], None] = None):
+        record['started_at'] = time.time()
+        record['status'] = 'running'
+        with self.lock:
+            self.running[record['id']] = record
+        with self.deadline_condition:
+            heapq.heappush(self.deadlines, (time.monotonic() + record['timeout'], record['id'], record, on_done))
+            self.deadline_condition.notify()
+        status, error = 'ok', None
+        try:
+            # Calls to a node known to be down would only wait on its timeouts
+            if health_monitor.is_down(getattr(callback, '__self__', None)):
+                status, error = 'skipped', "Node is down"
+                logging.warning(f"Skipped callback {record['callback']} of trigger {record['trigger']}, its node is down")
+            else:
+                callback(*args)
+        except Exception as e:
+            status, error = 'error', str(e)
+            logging.error(f"Error executing callback {record['callback']} of trigger {record['trigger']}: {e}")
+        if not self._finish(record, status, error, on_done):
+            with self.lock:
+                self.abandoned -= 1
+            logging.warning(f"Callback {record['callback']} of trigger {record['trigger']} returned "
+                            f"{time.time() - record['started_at']:.1f} seconds after it started, past its timeout")
+
+    def _finish(self, record: dict, status: str, error: str, on_done: Callable[[dict], None] = None) -> bool:
+        """Complete a running callback, returns False if it was completed already."""
+        with self.lock:
+            if self.running.pop(record['id'], None) is None:
+                return False
+            record['status'] = status
+            record['error'] = error
+            record['finished_at'] = time.time()
+            self.pending -= 1
+            if status == 'timeout':
+                self.abandoned += 1
+            self.completion_log.append(record)
+        if on_done:
+            on_done(record)
+        return True
+
+    def _watchdog(self):
+        while True:
+            with self.deadline_condition:
+                while not self.deadlines or self.deadlines[0][0] > time.monotonic():
+                    self.deadline_condition.wait(self.deadlines[0][0] - time.monotonic() if self.deadlines else None)
+                _, _, record, on_done = heapq.heappop(self.deadlines)
+            # Returns False for callbacks that finished in time
+            if self._finish(record, 'timeout', f"No result after {record['timeout']} seconds", on_done):
+                logging.warning(f"Callback {record['callback']} of trigger {record['trigger']} took longer than {record['timeout']} seconds")
+
+    def get_completion_log(self, triggerId: str = None, limit: int = None) -> List[dict]:
+        """Finished callbacks, oldest first, optionally filtered by trigger and limited to the newest entries."""
+        with self.lock:
+            records = [dict(r) for r in self.completion_log if triggerId is None or r['trigger'] == triggerId]
+        return records[-limit:] if limit else records
+
+    def get_running(self) -> List[dict]:
+        """Callbacks currently executing, flagged as overdue once past their timeout."""
+        current_time = time.time()
+        with self.lock:
+            records = [dict(r) for r in self.running.values()]
+        for r in records:
+            r['overdue'] = current_time - r['started_at'] > r['timeout']
+        return records
+
+    def stats(self) -> dict:
+        """Current queue depth and limits."""
+        with self.lock:
+            return {
+                'pending': self.pending,
+                'running': len(self.running),
+                'abandoned': self.abandoned,
+                'queue_limit': self.queue_limit,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
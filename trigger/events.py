@@ -0,0 +1,129 @@
+import heapq
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+HEARTBEAT_INTERVAL = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_SUBSCRIBERS = 32
+
+logging.basicConfig(level=logging.INFO)
+
+class TooManySubscribersError(Exception):
+    """Exception raised when the maximum number of event stream clients is connected."""
+    pass
+
+class TriggerEvents:
+    def __init__(self, display_time: float, max_subscribers: int = MAX_SUBSCRIBERS):
+        """
+        Pushes trigger state changes to dashboard clients as Server-Sent Events.
+
+        Clients get a snapshot when they connect and afterwards only the triggers that
+        changed: when one fires and when its display window runs out. The expiries are kept
+        in a heap served by a single thread, so nothing is recomputed per client.
+
+        :param display_time: Seconds a fired trigger is shown as active.
+        :param max_subscribers: Maximum number of connected clients.
+        """
+        self.display_time = display_time
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.expiries = []
+        self.last_triggered: Dict[str, float] = {}
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._expire, daemon=True, name="trigger-events")
+        self.thread.start()
+
+    def subscribe(self) -> queue.Queue:
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise TooManySubscribersError(f"{len(self.subscribers)} event stream clients connected")
+            subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: dict):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # The client stopped reading, drop it, it gets a fresh snapshot when it reconnects
+                logging.warning("Dropping event stream client that fell behind")
+                self.unsubscribe(subscriber)
+                self._close(subscriber)
+
+    @staticmethod
+    def _close(subscriber: queue.Queue):
+        """Drop the pending messages and queue the end of stream marker, publishing must never block the trigger path."""
+        while True:
+            try:
+                while True:
+                    subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.put_nowait(None)
+                return
+            except queue.Full:
+                # Another publisher filled it again in between
+                continue
+
+    def triggered(self, triggerId: str, last_triggered: float):
+        """Publish a fired trigger and schedule the end of its display window."""
+        self.publish('delta', {triggerId: {'last_triggered': last_triggered, 'status': 'red'}})
+        with self.condition:
+            self.last_triggered[triggerId] = last_triggered
+            heapq.heappush(self.expiries, (last_triggered + self.display_time, triggerId, last_triggered))
+            self.condition.notify()
+
+    def added(self, triggerId: str):
+        self.publish('delta', {triggerId: {'last_triggered': 0, 'status': 'green'}})
+
+    def removed(self, triggerId: str):
+        with self.condition:
+            self.last_triggered.pop(triggerId, None)
+        self.publish('delta', {triggerId: None})
+
+    def _expire(self):
+        while True:
+            with self.condition:
+                while not self.expiries or self.expiries[0][0] > time.time():
+                    self.condition.wait(self.expiries[0][0] - time.time() if self.expiries else None)
+                _, triggerId, last_triggered = heapq.heappop(self.expiries)
+                # Fired again or removed in the meantime, a later expiry takes care of it
+                if self.last_triggered.get(triggerId) != last_triggered:
+                    continue
+            self.publish('delta', {triggerId: {'last_triggered': last_triggered, 'status': 'green'}})
+
+    def stream(self, snapshot: Callable[[], dict]):
+        """Generator for a text/event-stream response, starting with a snapshot of all triggers."""
+        subscriber = self.subscribe()
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot())}\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    # Comment line, lets the server notice clients that went away
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'subscribers': len(self.subscribers), 'max_subscribers': self.max_subscribers}
@@ -0,0 +1,264 @@
+import math
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Buckets per power of two, the relative error of a recorded value is below 1 / SUB_BUCKETS
+SUB_BUCKETS = 16
+# Smallest distinguishable latency, everything below ends up in the first bucket
+HISTOGRAM_RESOLUTION = 1e-6
+HISTOGRAM_EXPONENTS = 28
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        """
+        HDR style histogram of durations in seconds with log-linear buckets.
+
+        Recording is a frexp and a list increment, so it can stay enabled all the time.
+        Covers 1 us to about 4 minutes with a relative error of a few percent.
+        """
+        self.counts = [0] * (HISTOGRAM_EXPONENTS * SUB_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _index(value: float) -> int:
+        mantissa, exponent = math.frexp(value / HISTOGRAM_RESOLUTION)
+        if exponent <= 0:
+            return 0
+        # mantissa is in [0.5, 1), split each power of two linearly
+        index = (exponent - 1) * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+        return min(index, HISTOGRAM_EXPONENTS * SUB_BUCKETS - 1)
+
+    @staticmethod
+    def _upper_bound(index: int) -> float:
+        exponent, sub_bucket = divmod(index, SUB_BUCKETS)
+        return HISTOGRAM_RESOLUTION * 2 ** exponent * (1 + (sub_bucket + 1) / SUB_BUCKETS)
+
+    def record(self, value: float):
+        index = self._index(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self) -> Tuple[List[int], int, float, float]:
+        with self.lock:
+            return list(self.counts), self.count, self.sum, self.max
+
+    def percentile(self, counts: List[int], count: int, percentile: float) -> float:
+        target = math.ceil(count * percentile / 100)
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= target and bucket:
+                return self._upper_bound(index)
+        return 0.0
+
+    def summary(self) -> dict:
+        """Count, mean, max and percentiles in milliseconds."""
+        counts, count, total, maximum = self.snapshot()
+        result = {'count': count, 'mean_ms': round(total / count * 1000, 3) if count else 0, 'max_ms': round(maximum * 1000, 3)}
+        for percentile in PERCENTILES:
+            value = min(self.percentile(counts, count, percentile), maximum) if count else 0
+            result[f'p{percentile:g}_ms'] = round(value * 1000, 3)
+        return result
+
+    def cumulative(self, bounds: Tuple[float, ...] = PROMETHEUS_BUCKETS) -> List[Tuple[float, int]]:
+        """Counts of values up to each bound, for Prometheus style buckets. A bucket straddling a bound counts towards the next one."""
+        counts, count, _, _ = self.snapshot()
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            while index < len(counts) and self._upper_bound(index) <= bound:
+                seen += counts[index]
+                index += 1
+            result.append((bound, seen))
+        return result
+
+
+class TriggerMetrics:
+    def __init__(self):
+        """Failure counters and latency histograms of all triggers and their callbacks."""
+        self.triggers: Dict[str, dict] = {}
+        self.callbacks: Dict[Tuple[str, str], dict] = {}
+        self.lock = threading.Lock()
+
+    def _trigger(self, triggerId: str) -> dict:
+        entry = self.triggers.get(triggerId)
+        if entry is None:
+            with self.lock:
+                entry = self.triggers.setdefault(triggerId, {'failures': 0, 'end_to_end': LatencyHistogram()})
+        return entry
+
+    def _callback(self, triggerId: str, callbackId: str) -> dict:
+        key = (triggerId, callbackId)
+        entry = self.callbacks.get(key)
+        if entry is None:
+            with self.lock:
+                entry = self.callbacks.setdefault(key, {'failures': 0, 'duration': LatencyHistogram()})
+        return entry
+
+    def firing(self, triggerId: str, received: float, callbacks: int) -> 'Firing':
+        """Start tracking one firing of a trigger, received is the time.monotonic() of its event."""
+        return Firing(self, triggerId, received, callbacks)
+
+    def failed(self, triggerId: str):
+        """A firing that could not run its callbacks at all."""
+        entry = self._trigger(triggerId)
+        with self.lock:
+            entry['failures'] += 1
+
+    def completed(self, triggerId: str, latency: float, failed: bool):
+        entry = self._trigger(triggerId)
+        entry['end_to_end'].record(latency)
+        if failed:
+            with self.lock:
+                entry['failures'] += 1
+
+    def callback(self, triggerId: str, callbackId: str, duration: float, failed: bool):
+        entry = self._callback(triggerId, callbackId)
+        # The histogram's count doubles as the number of calls
+        entry['duration'].record(duration)
+        if failed:
+            with self.lock:
+                entry['failures'] += 1
+
+    def remove(self, triggerId: str):
+        with self.lock:
+            self.triggers.pop(triggerId, None)
+            for key in [key for key in self.callbacks if key[0] == triggerId]:
+                del self.callbacks[key]
+
+    def prune(self, triggerIds):
+        """Drop everything recorded for triggers not in triggerIds, including late completions of removed ones."""
+        keep = set(triggerIds)
+        with self.lock:
+            for triggerId in self.triggers.keys() - keep:
+                del self.triggers[triggerId]
+            for key in [key for key in self.callbacks if key[0] not in keep]:
+                del self.callbacks[key]
+
+    def to_dict(self, stats: Dict[str, dict] = None) -> dict:
+        """
+        Counters and latency summaries per trigger and callback.
+
+        :param stats: Event counters per trigger as returned by Trigger.get_stats, merged in.
+        """
+        stats = stats or {}
+        with self.lock:
+            triggers = {triggerId: dict(entry) for triggerId, entry in self.triggers.items()}
+            callbacks = {key: dict(entry) for key, entry in self.callbacks.items()}
+        result = {}
+        for triggerId in stats.keys() | triggers.keys():
+            entry = triggers.get(triggerId, {'failures': 0, 'end_to_end': LatencyHistogram()})
+            counters = stats.get(triggerId, {})
+            result[triggerId] = {
+                'events': counters.get('events', 0),
+                'fired': counters.get('fired', 0),
+                'failures': entry['failures'],
+                'end_to_end': entry['end_to_end'].summary(),
+                'callbacks': {},
+            }
+        for (triggerId, callbackId), entry in callbacks.items():
+            if triggerId not in result:
+                # Callback of a removed trigger that finished after it was removed
+                continue
+            result[triggerId]['callbacks'][callbackId] = {
+                'calls': entry['duration'].count,
+                'failures': entry['failures'],
+                'duration': entry['duration'].summary(),
+            }
+        return result
+
+    def to_prometheus(self, stats: Dict[str, dict] = None) -> str:
+        """Prometheus text exposition format, stats as in to_dict."""
+        stats = stats or {}
+        with self.lock:
+            triggers = {triggerId: dict(entry) for triggerId, entry in self.triggers.items()}
+            callbacks = {key: dict(entry) for key, entry in self.callbacks.items()}
+        lines = []
+        for name, counter, description in (('trigger_events_total', 'events', 'Events received by a trigger.'),
+                                           ('trigger_fired_total', 'fired', 'Times a trigger fired.'),
+                                           ('trigger_rejected_total', 'rejected', 'Events that were debounced or hit the cooldown.')):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            lines += [f'{name}{{trigger="{_escape(t)}"}} {c.get(counter, 0)}' for t, c in stats.items()]
+        lines += [
+            '# HELP trigger_failures_total Firings with at least one failed or rejected callback.',
+            '# TYPE trigger_failures_total counter',
+        ]
+        lines += [f'trigger_failures_total{{trigger="{_escape(t)}"}} {e["failures"]}' for t, e in triggers.items()]
+        lines += [
+            '# HELP trigger_end_to_end_seconds Time from receiving an event until all callbacks finished.',
+            '# TYPE trigger_end_to_end_seconds histogram',
+        ]
+        for triggerId, entry in triggers.items():
+            lines += _histogram_lines('trigger_end_to_end_seconds', f'trigger="{_escape(triggerId)}"', entry['end_to_end'])
+        lines += [
+            '# HELP trigger_callback_calls_total Callback invocations.',
+            '# TYPE trigger_callback_calls_total counter',
+        ]
+        lines += [f'trigger_callback_calls_total{{{_callback_labels(k)}}} {e["duration"].count}' for k, e in callbacks.items()]
+        lines += [
+            '# HELP trigger_callback_failures_total Callbacks that raised or timed out.',
+            '# TYPE trigger_callback_failures_total counter',
+        ]
+        lines += [f'trigger_callback_failures_total{{{_callback_labels(k)}}} {e["failures"]}' for k, e in callbacks.items()]
+        lines += [
+            '# HELP trigger_callback_duration_seconds Time a callback took to run.',
+            '# TYPE trigger_callback_duration_seconds histogram',
+        ]
+        for key, entry in callbacks.items():
+            lines += _histogram_lines('trigger_callback_duration_seconds', _callback_labels(key), entry['duration'])
+        return '\n'.join(lines) + '\n'
+
+
+class Firing:
+    def __init__(self, metrics: TriggerMetrics, triggerId: str, received: float, callbacks: int):
+        """Collects the callbacks of one firing, the end to end latency is recorded once the last one finished."""
+        self.metrics = metrics
+        self.triggerId = triggerId
+        self.received = received
+        self.remaining = callbacks
+        self.failed = False
+        self.lock = threading.Lock()
+        if callbacks == 0:
+            metrics.completed(triggerId, time.monotonic() - received, False)
+
+    def done(self, callbackId: str, duration: float, failed: bool):
+        self.metrics.callback(self.triggerId, callbackId, duration, failed)
+        with self.lock:
+            self.remaining -= 1
+            self.failed = self.failed or failed
+            last = self.remaining == 0
+        if last:
+            self.metrics.completed(self.triggerId, time.monotonic() - self.received, self.failed)
+
+    def done_record(self, record: dict):
+        """Completion hook for CallbackDispatcher.dispatch."""
+        self.done(record['callback'], record['finished_at'] - record['started_at'], record['status'] != 'ok')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _callback_labels(key: Tuple[str, str]) -> str:
+    return f'trigger="{_escape(key[0])}",callback="{_escape(key[1])}"'
+
+
+def _histogram_lines(name: str, labels: str, histogram: LatencyHistogram) -> List[str]:
+    _, count, total, _ = histogram.snapshot()
+    lines = [f'{name}_bucket{{{labels},le="{bound:g}"}} {seen}' for bound, seen in histogram.cumulative()]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
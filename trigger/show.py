@@ -0,0 +1,327 @@
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import tomllib
+from typing import Callable, Dict, Iterable, List, Tuple
+import yaml
+from flask import jsonify
+from common.session import session_pool
+from common.statecache import state_cache
+from common.health import health_monitor
+from .timeline import Timeline
+from .trigger import DEBOUNCE_EDGES
+
+logging.basicConfig(level=logging.INFO)
+
+# The libyaml based loader parses several times faster, PyYAML falls back to pure Python without it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+NUMBER = (int, float)
+# Allowed keys and their types per section, keys in the second set are required
+SHOW_SCHEMA = ({'devices': dict, 'groups': dict, 'triggers': dict}, {'triggers'})
+DEVICE_SCHEMA = ({'type': str}, {'type'})
+GROUP_SCHEMA = ({'type': str, 'members': list}, {'type', 'members'})
+TRIGGER_SCHEMA = ({'deactivate_cooldown': bool, 'debounce': NUMBER, 'edge': str, 'callbacks': dict, 'timelines': dict}, set())
+CALLBACK_SCHEMA = ({'device': str, 'action': str, 'args': list, 'url': str, 'timeout': NUMBER}, set())
+TIMELINE_SCHEMA = ({'preempt': bool, 'cues': list}, {'cues'})
+CUE_SCHEMA = ({'at': NUMBER, 'device': str, 'action': str, 'args': list, 'url': str}, {'at'})
+
+class ShowError(Exception):
+    """Exception raised when a show file cannot be loaded, it lists every problem found."""
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+def _compile(schema: Tuple[dict, set], extra: bool = False) -> Callable[[str, object, List[str]], bool]:
+    """
+    Turn a schema into a check function once, instead of interpreting it for every entry.
+
+    :param extra: Allow keys that are not in the schema, device parameters are checked against the class.
+    """
+    types, required = schema
+    allowed = frozenset(types)
+
+    def check(path: str, entry, errors: List[str]) -> bool:
+        if not isinstance(entry, dict):
+            errors.append(f"{path}: expected a mapping")
+            return False
+        count = len(errors)
+        for key in required - entry.keys():
+            errors.append(f"{path}: missing '{key}'")
+        for key, value in entry.items():
+            if key not in allowed:
+                if not extra:
+                    errors.append(f"{path}: unknown key '{key}'")
+            elif not isinstance(value, types[key]) or (types[key] is NUMBER and isinstance(value, bool)):
+                errors.append(f"{path}.{key}: invalid value {value!r}")
+        return len(errors) == count
+    return check
+
+_check_show = _compile(SHOW_SCHEMA)
+_check_device = _compile(DEVICE_SCHEMA, extra=True)
+_check_group = _compile(GROUP_SCHEMA)
+_check_trigger = _compile(TRIGGER_SCHEMA)
+_check_callback = _compile(CALLBACK_SCHEMA)
+_check_timeline = _compile(TIMELINE_SCHEMA)
+_check_cue = _compile(CUE_SCHEMA)
+
+def _parse(path: str) -> dict:
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        if extension in ('.yaml', '.yml'):
+            return yaml.load(f, Loader=YAML_LOADER) or {}
+        if extension == '.json':
+            return json.load(f)
+        if extension == '.toml':
+            return tomllib.load(f)
+    raise ShowError([f"{path}: unsupported show file format '{extension}'"])
+
+def _release_states(dropped: Iterable[object], kept: Iterable[object]):
+    """Remove the state cache entries of dropped devices that no kept device shares."""
+    in_use = {id(getattr(device, 'device_state', None)) for device in kept}
+    for device in dropped:
+        state = getattr(device, 'device_state', None)
+        if state is not None and id(state) not in in_use:
+            state_cache.remove(state.name)
+
+class Show:
+    def __init__(self, handler, path: str, device_types: Dict[str, Tuple[type, type]]):
+        """
+        Devices, groups, triggers and their callbacks loaded from a YAML, JSON or TOML show file.
+
+        The whole file is validated and every callback is bound to its device before anything
+        changes, then the handler's trigger table is swapped in one step. A broken file is
+        reported and the running show stays as it is. Devices whose settings did not change are
+        reused on reload, so their connections and cached state survive. The devices are watched
+        by the health monitor.
+
+        Example:
+            devices:
+              audio_player_1: {type: audioplayer, ip: 192.168.1.93, port: 5000}
+            groups:
+              all_audio_players: {type: audioplayer, members: [audio_player_1]}
+            triggers:
+              motion_sensor_1:
+                debounce: 2
+                callbacks:
+                  scare: {device: audio_player_1, action: play, args: [scare]}
+                timelines:
+                  lights: {cues: [{at: 0, device: wled_1, action: "on"}]}
+
+        :param handler: The TriggerHandler the triggers are loaded into.
+        :param path: The show file, its extension selects the format.
+        :param device_types: Maps a device type name to its device and group class.
+        """
+        self.handler = handler
+        self.path = path
+        self.device_types = device_types
+        # Constructor signatures are looked up once, device parameters are bound against them
+        self.signatures = {name: inspect.signature(device_class) for name, (device_class, _) in device_types.items()}
+        self.devices: Dict[str, object] = {}
+        self.device_configs: Dict[str, dict] = {}
+        self.loaded_at = None
+        self.load_time = None
+        self.loads = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self._setup_routes()
+
+    def _setup_routes(self):
+        self.handler.app.route('/trigger/api/show', endpoint='show_status')(lambda: jsonify(self.status()))
+
+        @self.handler.app.route('/trigger/api/show/reload', methods=['POST'], endpoint='show_reload')
+        def reload():
+            try:
+                self.load()
+            except ShowError:
+                return jsonify(self.status()), 400
+            return jsonify(self.status()), 200
+
+    def load(self):
+        """Load or reload the show file, raises ShowError and keeps the current show if it is invalid."""
+        with self.lock:
+            start_time = time.perf_counter()
+            try:
+                try:
+                    config = _parse(self.path)
+                except (OSError, ValueError, yaml.YAMLError) as e:
+                    raise ShowError([f"{self.path}: {e}"])
+                try:
+                    devices, configs, triggers = self._build(config)
+                except (TypeError, ValueError) as e:
+                    # Anything the validation missed still must not take the server down
+                    raise ShowError([f"{self.path}: {e}"])
+            except ShowError as e:
+                self.last_error = e.errors
+                logging.error(f"Show file {self.path} not loaded: {e}")
+                raise
+            self.handler.replace_triggers(triggers)
+            for name in self.device_configs.keys() - configs.keys():
+                health_monitor.unregister(name)
+            for name in configs:
+                health_monitor.register(name, devices[name])
+            _release_states(self.devices.values(), devices.values())
+            self.devices, self.device_configs = devices, configs
+            self.load_time = time.perf_counter() - start_time
+            self.loaded_at = time.time()
+            self.loads += 1
+            self.last_error = None
+            logging.info(f"Show file {self.path} loaded in {self.load_time * 1000:.1f} ms")
+
+    def _build(self, config) -> Tuple[Dict[str, object], Dict[str, dict], dict]:
+        """Validate the whole show, then create its devices and triggers, nothing is registered yet."""
+        errors = []
+        if not _check_show('show', config, errors):
+            raise ShowError(errors)
+        classes = self._validate_devices(config.get('devices', {}), errors)
+        self._validate_groups(config.get('groups', {}), classes, errors)
+        actions = {}
+        for triggerId, entry in config['triggers'].items():
+            self._validate_trigger(f"triggers.{triggerId}", entry or {}, classes, actions, errors)
+        if errors:
+            raise ShowError(errors)
+
+        # Only a valid show creates devices, they register themselves with the state cache
+        devices = {}
+        try:
+            configs = self._build_devices(config.get('devices', {}), devices)
+            for name, entry in config.get('groups', {}).items():
+                devices[name] = self.device_types[entry['type']][1]([devices[member] for member in entry['members']])
+            triggers = {}
+            for triggerId, entry in config['triggers'].items():
+                entry = entry or {}
+                trigger = self.handler.create_trigger(triggerId, entry.get('deactivate_cooldown', False),
+                                                      entry.get('debounce', 0), entry.get('edge', 'leading'))
+                for callbackId, callback in entry.get('callbacks', {}).items():
+                    trigger.add_callback(callbackId, self._bind(callback, devices), callback.get('timeout'))
+                for timelineId, timeline in entry.get('timelines', {}).items():
+                    cues = [(cue['at'], *self._bind(cue, devices)) for cue in timeline['cues']]
+                    trigger.add_timeline(Timeline(timelineId, cues, timeline.get('preempt', True)))
+                triggers[triggerId] = trigger
+        except Exception:
+            # The current show stays, drop the cache entries only the new devices had
+            _release_states(devices.values(), self.devices.values())
+            raise
+        return devices, configs, triggers
+
+    def _validate_devices(self, entries: dict, errors: List[str]) -> Dict[str, type]:
+        """Check the device entries, returns the class of every device and group name that is valid."""
+        classes = {}
+        for name, entry in entries.items():
+            path = f"devices.{name}"
+            if not _check_device(path, entry, errors):
+                continue
+            if entry['type'] not in self.device_types:
+                errors.append(f"{path}.type: unknown device type '{entry['type']}'")
+                continue
+            params = {key: value for key, value in entry.items() if key != 'type'}
+            try:
+                self.signatures[entry['type']].bind(**params)
+            except TypeError as e:
+                errors.append(f"{path}: {e}")
+                continue
+            classes[name] = self.device_types[entry['type']][0]
+        return classes
+
+    def _validate_groups(self, entries: dict, classes: Dict[str, type], errors: List[str]):
+        devices = dict(classes)
+        for name, entry in entries.items():
+            path = f"groups.{name}"
+            if not _check_group(path, entry, errors):
+                continue
+            if name in devices:
+                errors.append(f"{path}: name already used by a device")
+                continue
+            if entry['type'] not in self.device_types:
+                errors.append(f"{path}.type: unknown device type '{entry['type']}'")
+                continue
+            device_class, group_class = self.device_types[entry['type']]
+            for member in entry['members']:
+                if not isinstance(member, str) or devices.get(member) is not device_class:
+                    errors.append(f"{path}.members: {member!r} is not a {entry['type']} device")
+            classes[name] = group_class
+
+    def _validate_trigger(self, path: str, entry, classes: Dict[str, type], actions: dict, errors: List[str]):
+        if not _check_trigger(path, entry, errors):
+            return
+        if entry.get('edge', 'leading') not in DEBOUNCE_EDGES:
+            errors.append(f"{path}.edge: must be one of {DEBOUNCE_EDGES}")
+        if entry.get('debounce', 0) < 0:
+            errors.append(f"{path}.debounce: must not be negative")
+        for callbackId, callback in entry.get('callbacks', {}).items():
+            callback_path = f"{path}.callbacks.{callbackId}"
+            if self._validate_call(callback_path, callback, _check_callback, classes, actions, errors):
+                if callback.get('timeout', 0) < 0:
+                    errors.append(f"{callback_path}.timeout: must not be negative")
+        for timelineId, timeline in entry.get('timelines', {}).items():
+            timeline_path = f"{path}.timelines.{timelineId}"
+            if not _check_timeline(timeline_path, timeline, errors):
+                continue
+            for n, cue in enumerate(timeline['cues']):
+                cue_path = f"{timeline_path}.cues[{n}]"
+                if self._validate_call(cue_path, cue, _check_cue, classes, actions, errors) and cue['at'] < 0:
+                    errors.append(f"{cue_path}.at: must not be negative")
+
+    def _validate_call(self, path: str, entry, check, classes: Dict[str, type], actions: dict, errors: List[str]) -> bool:
+        """Check that a callback or cue names an existing action and that its arguments fit."""
+        if not check(path, entry, errors):
+            return False
+        if 'url' in entry:
+            if 'device' in entry or 'action' in entry:
+                errors.append(f"{path}: use either url or device and action")
+                return False
+            return True
+        if 'device' not in entry or 'action' not in entry:
+            errors.append(f"{path}: needs a url or a device and an action")
+            return False
+        device_class = classes.get(entry['device'])
+        if device_class is None:
+            errors.append(f"{path}.device: unknown device '{entry['device']}'")
+            return False
+        key = (device_class, entry['action'])
+        if key not in actions:
+            # Signatures are looked up once per class and action, not per callback
+            action = getattr(device_class, entry['action'], None) if not entry['action'].startswith('_') else None
+            actions[key] = inspect.signature(action) if inspect.isfunction(action) else None
+        signature = actions[key]
+        if signature is None:
+            errors.append(f"{path}.action: {device_class.__name__} has no action '{entry['action']}'")
+            return False
+        try:
+            signature.bind(None, *entry.get('args', ()))
+        except TypeError as e:
+            errors.append(f"{path}.args: {e}")
+            return False
+        return True
+
+    def _build_devices(self, entries: dict, devices: Dict[str, object]) -> Dict[str, dict]:
+        """Fill devices with the show's devices, objects whose config is unchanged are reused."""
+        configs = {}
+        for name, entry in entries.items():
+            if self.device_configs.get(name) == entry:
+                devices[name] = self.devices[name]
+            else:
+                params = {key: value for key, value in entry.items() if key != 'type'}
+                devices[name] = self.device_types[entry['type']][0](**params)
+            configs[name] = entry
+        return configs
+
+    @staticmethod
+    def _bind(entry: dict, devices: Dict[str, object]) -> Tuple[Callable, tuple]:
+        """Resolve a validated callback or cue to (callable, args) once, so firing does no lookups."""
+        if 'url' in entry:
+            return session_pool.get, (entry['url'],)
+        return getattr(devices[entry['device']], entry['action']), tuple(entry.get('args', ()))
+
+    def status(self) -> dict:
+        return {
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'load_time': self.load_time,
+            'loads': self.loads,
+            'devices': len(self.devices),
+            'triggers': len(self.handler.triggers),
+            'error': self.last_error,
+        }
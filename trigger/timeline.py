@@ -0,0 +1,171 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+TIMELINE_WORKERS = 8
+LATENESS_LOG_SIZE = 1000
+FINISHED_RUNS_SIZE = 50
+
+logging.basicConfig(level=logging.INFO)
+
+class Timeline:
+    def __init__(self, timelineId: str, cues: List[Tuple[float, Callable, Tuple]] = (), preempt: bool = True):
+        """
+        A sequence of callbacks at offsets relative to the moment the timeline is launched.
+
+        :param timelineId: The ID of the timeline.
+        :param cues: (offset in seconds, callable, args) tuples, in any order.
+        :param preempt: Cancel a still running instance when the timeline is launched again.
+        """
+        self.timelineId = timelineId
+        self.preempt = preempt
+        self.cues: List[Tuple[float, Callable, Tuple]] = []
+        for offset, callback, args in cues:
+            self.add_cue(offset, callback, args)
+
+    def add_cue(self, offset: float, callback: Callable, args: Tuple = ()):
+        """Add a callback that runs offset seconds after launch."""
+        if offset < 0:
+            raise ValueError(f"Cue offset must not be negative, got {offset}")
+        self.cues.append((offset, callback, args))
+        self.cues.sort(key=lambda cue: cue[0])
+
+    def duration(self) -> float:
+        return self.cues[-1][0] if self.cues else 0.0
+
+class TimelineScheduler:
+    def __init__(self, workers: int = TIMELINE_WORKERS):
+        """
+        Runs the cues of all launched timelines from one priority queue on a single timer thread.
+
+        The timer thread only waits for the next due cue and hands it to a worker pool, so a
+        slow callback never delays the cues after it. Cancelled runs are skipped lazily when
+        their cues come up.
+
+        :param workers: Number of cue callbacks that can run at the same time.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="timeline-cue")
+        self.queue: List[Tuple[float, int, dict, int, Timeline]] = []
+        self.runs: Dict[int, dict] = {}
+        self.finished = deque(maxlen=FINISHED_RUNS_SIZE)
+        self.lateness = deque(maxlen=LATENESS_LOG_SIZE)
+        self.condition = threading.Condition()
+        self.stopFlag = False
+        self._sequence = itertools.count()
+        self._run_ids = itertools.count(1)
+        self.thread = threading.Thread(target=self._timer, daemon=True, name="timeline-timer")
+        self.thread.start()
+
+    def launch(self, timeline: Timeline, owner: str = None) -> int:
+        """
+        Start a timeline now and return the ID of the run.
+
+        :param owner: ID of the trigger that launched the timeline, used for cancelling.
+        """
+        start = time.monotonic()
+        with self.condition:
+            if timeline.preempt:
+                self._cancel(lambda run: run['timeline'] == timeline.timelineId and run['owner'] == owner, 'preempted')
+            run = {
+                'id': next(self._run_ids),
+                'timeline': timeline.timelineId,
+                'owner': owner,
+                'status': 'running',
+                'started_at': time.time(),
+                'finished_at': None,
+                'cues': len(timeline.cues),
+                'fired': 0,
+            }
+            self.runs[run['id']] = run
+            if not timeline.cues:
+                self._finish(run, 'finished')
+            for index, (offset, _, _) in enumerate(timeline.cues):
+                heapq.heappush(self.queue, (start + offset, next(self._sequence), run, index, timeline))
+            self.condition.notify()
+        logging.debug(f"Timeline {timeline.timelineId} launched as run {run['id']}")
+        return run['id']
+
+    def cancel(self, runId: int) -> bool:
+        """Cancel a run, returns False if it is not running."""
+        with self.condition:
+            return self._cancel(lambda run: run['id'] == runId, 'cancelled') > 0
+
+    def cancel_owner(self, owner: str, timelineId: str = None) -> int:
+        """Cancel the running timelines of a trigger, all of them or only timelineId."""
+        with self.condition:
+            return self._cancel(lambda run: run['owner'] == owner and timelineId in (None, run['timeline']), 'cancelled')
+
+    def _cancel(self, match: Callable, status: str) -> int:
+        cancelled = [run for run in self.runs.values() if match(run)]
+        for run in cancelled:
+            self._finish(run, status)
+            logging.info(f"Timeline {run['timeline']} run {run['id']} {status}")
+        return len(cancelled)
+
+    def _finish(self, run: dict, status: str):
+        run['status'] = status
+        run['finished_at'] = time.time()
+        del self.runs[run['id']]
+        self.finished.append(run)
+
+    def _timer(self):
+        while True:
+            with self.condition:
+                while not self.stopFlag and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.stopFlag:
+                    return
+                # Take every cue that is due in one go, each wake-up costs a GIL handover under load
+                now = time.monotonic()
+                due_cues = []
+                while self.queue and self.queue[0][0] <= now:
+                    due, _, run, index, timeline = heapq.heappop(self.queue)
+                    if run['status'] != 'running':
+                        continue
+                    self.lateness.append(now - due)
+                    run['fired'] += 1
+                    if run['fired'] == run['cues']:
+                        self._finish(run, 'finished')
+                    due_cues.append((run, timeline.cues[index]))
+            for run, (_, callback, args) in due_cues:
+                self.executor.submit(self._run_cue, run, callback, args)
+
+    def _run_cue(self, run: dict, callback: Callable, args: Tuple):
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.error(f"Error executing cue {callback} of timeline {run['timeline']}: {e}")
+
+    def get_runs(self) -> dict:
+        """Running and recently finished runs."""
+        with self.condition:
+            return {
+                'running': [dict(run) for run in self.runs.values()],
+                'finished': [dict(run) for run in self.finished],
+            }
+
+    def stats(self) -> dict:
+        """Cue lateness in milliseconds over the most recent cues."""
+        with self.condition:
+            lateness = sorted(self.lateness)
+            queued = len(self.queue)
+        if not lateness:
+            return {'cues': 0, 'queued': queued}
+        return {
+            'cues': len(lateness),
+            'queued': queued,
+            'mean_ms': sum(lateness) / len(lateness) * 1000,
+            'p99_ms': lateness[int(0.99 * (len(lateness) - 1))] * 1000,
+            'max_ms': lateness[-1] * 1000,
+        }
+
+    def shutdown(self):
+        with self.condition:
+            self.stopFlag = True
+            self.condition.notify()
+        self.executor.shutdown(wait=False)
@@ -1,13 +1,22 @@
+import itertools
 import logging
-from typing import Callable, Dict, Tuple
+import threading
+from typing import Callable, Dict, List, Tuple
 import time
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
 import os
-import requests
+from common.session import session_pool
+from common.clock import ClockServer
+from common.health import health_monitor
+from .dispatcher import CallbackDispatcher, CallbackQueueFullError
+from .timeline import Timeline, TimelineScheduler
+from .events import TriggerEvents, TooManySubscribersError
+from .metrics import TriggerMetrics
 
 logging.basicConfig(level=logging.INFO)
 LAST_TRIGGERED_DISPLAY_TIME = 20
 TRIGGER_COOLDOWN_TIME = 20
+DEBOUNCE_EDGES = ('leading', 'trailing', 'both')
 
 class CallbackNotFoundError(Exception):
     """Exception raised when a callback is not found in a Trigger."""
@@ -17,39 +26,72 @@ class TriggerNotFoundError(Exception):
     """Exception raised when a Trigger is not found in the TriggerHandler."""
     pass
 
+class TimelineNotFoundError(Exception):
+    """Exception raised when a timeline is not found in a Trigger."""
+    pass
+
 class Trigger:
-    def __init__(self, triggerId: str, deactivate_cooldown: bool = False):
+    def __init__(self, triggerId: str, deactivate_cooldown: bool = False, dispatcher: CallbackDispatcher = None,
+                 scheduler: TimelineScheduler = None, events: TriggerEvents = None, debounce: float = 0, edge: str = 'leading',
+                 metrics: TriggerMetrics = None):
         """
         Initialize a Trigger with a unique ID.
 
         :param triggerId: The ID of the trigger.
+        :param dispatcher: Run callbacks on this dispatcher instead of inline.
+        :param scheduler: Scheduler the trigger's timelines are launched on.
+        :param events: Notified whenever the trigger fires.
+        :param debounce: Seconds after an event in which further events are coalesced, 0 to disable.
+        :param edge: Fire on the first event of a window ('leading'), once at its end ('trailing') or on both.
+        :param metrics: Records failures and latencies of the trigger and its callbacks.
         """
+        if edge not in DEBOUNCE_EDGES:
+            raise ValueError(f"edge must be one of {DEBOUNCE_EDGES}, got '{edge}'")
+        if edge != 'leading' and debounce > 0 and scheduler is None:
+            raise ValueError(f"Trigger {triggerId} needs a scheduler for trailing edge debouncing")
         self.triggerId = triggerId
         self.callbacks: Dict[str, Tuple[Callable, Tuple]] = {}
+        self.callback_timeouts: Dict[str, float] = {}
+        self.timelines: Dict[str, Timeline] = {}
+        self.scheduler = scheduler
+        self.events = events
         self.last_triggered = 0
         self.deactivate_cooldown = deactivate_cooldown
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.debounce = debounce
+        self.edge = edge
+        self.window_end = 0.0
+        self.trailing_pending = False
+        # Owner of the trailing edge timer, apart from the trigger's own timelines so cancelling those leaves it alone
+        self.debounce_owner = f"{triggerId}:debounce"
+        self.debounce_lock = threading.Lock()
+        self.counters = dict.fromkeys(('events', 'fired', 'debounced', 'coalesced', 'cooldown'), 0)
 
     def callback_exists(self, callbackId: str) -> bool:
         """Check if a callback exists in the trigger."""
         return callbackId in self.callbacks
     
-    def add_callback(self, callbackId: str, callback: Tuple[Callable, Tuple]):
-        """Add a callback to the trigger."""
+    def add_callback(self, callbackId: str, callback: Tuple[Callable, Tuple], timeout: float = None):
+        """Add a callback to the trigger, timeout overrides the dispatcher's default callback timeout."""
         if not self.callback_exists(callbackId):
             self.callbacks[callbackId] = callback
+            if timeout is not None:
+                self.callback_timeouts[callbackId] = timeout
             logging.debug(f"Callback {callbackId} added to trigger {self.triggerId}")
         else:
             logging.debug(f"Callback {callbackId} already exists in trigger {self.triggerId}")
 
     def add_http_callback(self, callbackId: str, address: str):
         """Add an HTTP callback to the trigger."""
-        self.add_callback(callbackId, (requests.get, (address,)))
+        self.add_callback(callbackId, (session_pool.get, (address,)))
 
 
     def remove_callback(self, callbackId: str):
         """Remove a callback from the trigger."""
         if self.callback_exists(callbackId):
             del self.callbacks[callbackId]
+            self.callback_timeouts.pop(callbackId, None)
             logging.debug(f"Callback {callbackId} removed from trigger {self.triggerId}")
         else:
             logging.error(f"Callback {callbackId} not found in trigger {self.triggerId}")
@@ -58,25 +100,155 @@ class Trigger:
     def clear_callbacks(self):
         """Clear all callbacks from the trigger."""
         self.callbacks.clear()
+        self.callback_timeouts.clear()
+
+    def add_timeline(self, timeline: Timeline):
+        """Add a timeline that is launched every time the trigger fires."""
+        if self.scheduler is None:
+            raise ValueError(f"Trigger {self.triggerId} has no timeline scheduler")
+        self.timelines[timeline.timelineId] = timeline
+        logging.debug(f"Timeline {timeline.timelineId} added to trigger {self.triggerId}")
+
+    def remove_timeline(self, timelineId: str):
+        """Remove a timeline from the trigger, running instances keep running."""
+        if timelineId not in self.timelines:
+            logging.error(f"Timeline {timelineId} not found in trigger {self.triggerId}")
+            raise TimelineNotFoundError(f"Timeline {timelineId} not found in trigger {self.triggerId}")
+        del self.timelines[timelineId]
+        logging.debug(f"Timeline {timelineId} removed from trigger {self.triggerId}")
+
+    def launch_timeline(self, timelineId: str) -> int:
+        """Launch one of the trigger's timelines, preempting a running instance if the timeline preempts."""
+        if timelineId not in self.timelines:
+            raise TimelineNotFoundError(f"Timeline {timelineId} not found in trigger {self.triggerId}")
+        return self.scheduler.launch(self.timelines[timelineId], self.triggerId)
+
+    def cancel_timelines(self, timelineId: str = None) -> int:
+        """Cancel all running timelines of the trigger, or only timelineId."""
+        if self.scheduler is None:
+            return 0
+        return self.scheduler.cancel_owner(self.triggerId, timelineId)
 
     def trigger(self):
-        """Trigger all callbacks associated with this trigger."""
+        """
+        Handle an event, firing the trigger unless it is debounced or cooling down.
+
+        Events are bucketed into debounce windows with a single comparison, so a noisy sensor
+        costs almost nothing before any callback work.
+        """
+        current_time = time.monotonic()
+        with self.debounce_lock:
+            self.counters['events'] += 1
+            if current_time < self.window_end:
+                if self.edge == 'leading':
+                    self.counters['debounced'] += 1
+                    return
+                self.counters['coalesced'] += 1
+                if not self.trailing_pending:
+                    self._schedule_trailing(self.window_end - current_time)
+                return
+            self.window_end = current_time + self.debounce
+            if self.edge == 'trailing' and self.debounce > 0:
+                self._schedule_trailing(self.debounce)
+                return
+        self._fire(current_time)
+
+    def _schedule_trailing(self, delay: float):
+        self.trailing_pending = True
+        self.scheduler.launch(Timeline(f"{self.triggerId}:trailing", [(delay, self._fire_trailing, ())], preempt=False), self.debounce_owner)
+
+    def _cancel_trailing(self) -> bool:
+        """Drop a pending trailing fire, called with debounce_lock held. Returns whether one was pending."""
+        if not self.trailing_pending:
+            return False
+        self.trailing_pending = False
+        self.scheduler.cancel_owner(self.debounce_owner)
+        return True
+
+    def _fire_trailing(self):
+        with self.debounce_lock:
+            if not self.trailing_pending:
+                # Cancelled while the cue was already on its way
+                return
+            self.trailing_pending = False
+            # Events after this one are coalesced again, a stuck sensor fires once per window
+            self.window_end = time.monotonic() + self.debounce
+        self._fire()
+
+    def _fire(self, received: float = None):
+        """
+        Trigger all callbacks associated with this trigger.
+
+        :param received: time.monotonic() of the event, the start of the end to end latency.
+        """
         if (time.time() - self.last_triggered > TRIGGER_COOLDOWN_TIME) or self.deactivate_cooldown:
+            self.counters['fired'] += 1
+            for timelineId in self.timelines:
+                self.launch_timeline(timelineId)
+
+            callbacks = list(self.callbacks.items())
+            firing = self.metrics.firing(self.triggerId, received or time.monotonic(), len(callbacks)) if self.metrics else None
+            if self.dispatcher:
+                logging.info(f"Trigger {self.triggerId} dispatching callbacks")
+                try:
+                    self.dispatcher.dispatch(self.triggerId, [
+                        (callbackId, callback, args, self.callback_timeouts.get(callbackId))
+                        for callbackId, (callback, args) in callbacks
+                    ], firing.done_record if firing else None)
+                except CallbackQueueFullError:
+                    if self.metrics:
+                        self.metrics.failed(self.triggerId)
+                    raise
+                self._mark_triggered()
+                return
+
             logging.info(f"Trigger {self.triggerId} executing callbacks")
-            for callback, args in self.callbacks.values():
+            for callbackId, (callback, args) in callbacks:
                 logging.debug(f"Trigger {self.triggerId} calling callback {callback} with args {args}")
+                started = time.monotonic()
+                failed = False
                 try:
                     callback(*args)
                 except Exception as e:
+                    failed = True
                     logging.error(f"Error executing callback {callback} with args {args}: {e}")
+                if firing:
+                    firing.done(callbackId, time.monotonic() - started, failed)
 
-            self.last_triggered = time.time()
+            self._mark_triggered()
+        else:
+            self.counters['cooldown'] += 1
+
+    def get_stats(self) -> dict:
+        """Received events, how often the trigger fired and why the other events were rejected."""
+        with self.debounce_lock:
+            counters = dict(self.counters)
+        counters['rejected'] = counters['debounced'] + counters['cooldown']
+        return {**counters, 'debounce': self.debounce, 'edge': self.edge}
+
+    def _mark_triggered(self):
+        self.last_triggered = time.time()
+        if self.events:
+            self.events.triggered(self.triggerId, self.last_triggered)
 
 class TriggerHandler:
-    def __init__(self, app: Flask):
-        """Initialize the TriggerHandler with an empty dictionary of triggers."""
+    def __init__(self, app: Flask, async_callbacks: bool = False, dispatcher: CallbackDispatcher = None, clock: ClockServer = None):
+        """
+        Initialize the TriggerHandler with an empty dictionary of triggers.
+
+        :param async_callbacks: Acknowledge trigger requests immediately and run callbacks on a worker pool.
+        :param dispatcher: Worker pool to use in async mode, a default one is created if omitted.
+        :param clock: Clock server whose node offsets are shown on the dashboard.
+        """
         self.triggers: Dict[str, Trigger] = {}
+        # Serialises changes to the trigger table, lookups go without it
+        self.triggers_lock = threading.Lock()
         self.app = app
+        self.clock = clock
+        self.dispatcher = (dispatcher or CallbackDispatcher()) if async_callbacks else None
+        self.scheduler = TimelineScheduler()
+        self.events = TriggerEvents(LAST_TRIGGERED_DISPLAY_TIME)
+        self.metrics = TriggerMetrics()
         self._setup_routes()
 
     def _setup_routes(self):
@@ -88,21 +260,67 @@ class TriggerHandler:
 
         @self.app.route('/trigger/api/get_triggers')
         def get_triggers():
+            return jsonify(self.get_trigger_states())
+
+        @self.app.route('/trigger/api/events')
+        def trigger_events():
+            try:
+                stream = self.events.stream(self.get_trigger_states)
+                # Subscribe now so a full server is reported with a status code
+                first = next(stream)
+            except TooManySubscribersError as e:
+                logging.warning(f"Refusing event stream client: {e}")
+                return "", 503
+            return Response(itertools.chain([first], stream), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        @self.app.route('/trigger/api/clock')
+        def get_clock():
             current_time = time.time()
-            trigger_data = {}
-            for trigger_id in self.triggers.keys():
-                last_triggered = self.triggers[trigger_id].last_triggered
-                if last_triggered:
-                    time_since_trigger = current_time - last_triggered
-                    status = 'red' if time_since_trigger <= LAST_TRIGGERED_DISPLAY_TIME else 'green'
-                else:
-                    status = 'green'
-                trigger_data[trigger_id] = {
-                    'last_triggered': last_triggered,
-                    'status': status
-                }
-            return jsonify(trigger_data)
+            nodes = self.clock.get_nodes() if self.clock else {}
+            return jsonify({node: {**status, 'age': current_time - status['last_seen']} for node, status in nodes.items()})
+
+        @self.app.route('/trigger/api/health')
+        def get_health():
+            return jsonify(health_monitor.status())
+
+        @self.app.route('/trigger/api/completion_log')
+        def completion_log():
+            triggerId = request.args.get('trigger')
+            limit = request.args.get('limit', type=int)
+            return jsonify({
+                'completed': self.get_completion_log(triggerId, limit),
+                'running': self.dispatcher.get_running() if self.dispatcher else [],
+                'queue': self.dispatcher.stats() if self.dispatcher else None,
+            })
         
+        @self.app.route('/trigger/api/trigger_stats')
+        def trigger_stats():
+            return jsonify(self.get_trigger_stats())
+
+        @self.app.route('/trigger/api/metrics')
+        def metrics():
+            # Prometheus asks for text/plain with a version parameter, everyone else gets JSON unless they pass format
+            output = request.args.get('format')
+            if output is None:
+                prometheus = any(value.split(';')[0].strip() == 'text/plain' for value, _ in request.accept_mimetypes)
+                output = 'prometheus' if prometheus else 'json'
+            if output == 'prometheus':
+                return Response(self.metrics.to_prometheus(self.get_trigger_stats()), content_type='text/plain; version=0.0.4; charset=utf-8')
+            return jsonify(self.metrics.to_dict(self.get_trigger_stats()))
+
+        @self.app.route('/trigger/api/timelines')
+        def timelines():
+            return jsonify({**self.scheduler.get_runs(), 'lateness': self.scheduler.stats()})
+
+        @self.app.route('/trigger/api/timelines/cancel')
+        def cancel_timelines():
+            triggerId = request.args.get('trigger')
+            if not triggerId or not self.trigger_exists(triggerId):
+                return "", 404
+            cancelled = self.cancel_timelines(triggerId, request.args.get('timeline'))
+            return jsonify({'cancelled': cancelled}), 200
+
         self.app.route("/trigger/<triggerId>")(self.trigger)
         
     def trigger_exists(self, triggerId: str) -> bool:
@@ -111,25 +329,90 @@ class TriggerHandler:
     
     def get_trigger(self, triggerId: str) -> Trigger:
         """Retrieve a trigger by its ID."""
-        if not self.trigger_exists(triggerId):
+        trigger = self.triggers.get(triggerId)
+        if trigger is None:
             logging.error(f"Trigger with ID '{triggerId}' not found")
             raise TriggerNotFoundError(f"Trigger with ID '{triggerId}' not found")
-        return self.triggers[triggerId]
-
-    def add(self, triggerId: str, deactivate_cooldown: bool = False):
-        """Create a new trigger with the specified ID."""
-        if self.trigger_exists(triggerId):  
-            logging.warning(f"Trigger with ID {triggerId} already exists")
-            return
-        self.triggers[triggerId] = Trigger(triggerId, deactivate_cooldown)
+        return trigger
+
+    def create_trigger(self, triggerId: str, deactivate_cooldown: bool = False, debounce: float = 0, edge: str = 'leading') -> Trigger:
+        """Create a trigger wired to the handler's dispatcher, scheduler, events and metrics without adding it."""
+        return Trigger(triggerId, deactivate_cooldown, self.dispatcher, self.scheduler, self.events, debounce, edge, self.metrics)
+
+    def add(self, triggerId: str, deactivate_cooldown: bool = False, debounce: float = 0, edge: str = 'leading'):
+        """
+        Create a new trigger with the specified ID.
+
+        :param debounce: Seconds after an event in which further events are coalesced, 0 to disable.
+        :param edge: 'leading', 'trailing' or 'both', see Trigger.
+        """
+        with self.triggers_lock:
+            if self.trigger_exists(triggerId):
+                logging.warning(f"Trigger with ID {triggerId} already exists")
+                return
+            self.triggers[triggerId] = self.create_trigger(triggerId, deactivate_cooldown, debounce, edge)
+        self.events.added(triggerId)
         logging.info(f"Trigger {triggerId} created")
 
     def remove(self, triggerId: str):
         """Delete a trigger by its ID."""
-        trigger = self.get_trigger(triggerId)  # This will raise TriggerNotFoundError if not found
-        del self.triggers[triggerId]
+        with self.triggers_lock:
+            trigger = self.get_trigger(triggerId)  # This will raise TriggerNotFoundError if not found
+            del self.triggers[triggerId]
+        self.events.removed(triggerId)
+        self.metrics.remove(triggerId)
         logging.info(f"Trigger {triggerId} deleted")
+
+    def replace_triggers(self, triggers: Dict[str, Trigger]):
+        """
+        Swap the whole trigger table in one step.
+
+        Triggers that keep their ID carry over their cooldown, debounce window and counters.
+        A pending trailing fire moves to the new trigger, so a burst fires once. Callbacks and
+        timelines already running on replaced triggers finish undisturbed.
+        """
+        with self.triggers_lock:
+            old = self.triggers
+            for triggerId, trigger in triggers.items():
+                if triggerId in old:
+                    previous = old[triggerId]
+                    with previous.debounce_lock:
+                        trigger.last_triggered = previous.last_triggered
+                        trigger.window_end = previous.window_end
+                        trigger.counters = dict(previous.counters)
+                        pending = previous._cancel_trailing()
+                    if pending and trigger.edge != 'leading' and trigger.scheduler is not None:
+                        with trigger.debounce_lock:
+                            trigger._schedule_trailing(max(0.0, trigger.window_end - time.monotonic()))
+            self.triggers = triggers
+        for triggerId in old.keys() - triggers.keys():
+            self.events.removed(triggerId)
+        self.metrics.prune(triggers.keys())
+        for triggerId in triggers.keys() - old.keys():
+            self.events.added(triggerId)
+        logging.info(f"Trigger table replaced, {len(triggers)} triggers")
         
+    def get_trigger_states(self) -> Dict[str, dict]:
+        """Last trigger time and dashboard status of every trigger."""
+        current_time = time.time()
+        trigger_data = {}
+        for trigger_id, trigger in list(self.triggers.items()):
+            last_triggered = trigger.last_triggered
+            if last_triggered:
+                time_since_trigger = current_time - last_triggered
+                status = 'red' if time_since_trigger <= LAST_TRIGGERED_DISPLAY_TIME else 'green'
+            else:
+                status = 'green'
+            trigger_data[trigger_id] = {
+                'last_triggered': last_triggered,
+                'status': status
+            }
+        return trigger_data
+
+    def get_trigger_stats(self) -> Dict[str, dict]:
+        """Event, fire and rejection counters of every trigger."""
+        return {triggerId: trigger.get_stats() for triggerId, trigger in list(self.triggers.items())}
+
     def get_callbacks(self, triggerId: str) -> Dict[str, Tuple[Callable, Tuple]]:
         """Get all callbacks associated with a trigger."""
         return self.get_trigger(triggerId).callbacks
@@ -139,9 +422,9 @@ class TriggerHandler:
         self.get_trigger(triggerId).clear_callbacks()
         logging.info(f"Callbacks cleared for trigger {triggerId}")
         
-    def add_callback(self, triggerId: str, callbackId: str, callback: Tuple[Callable, Tuple]):
+    def add_callback(self, triggerId: str, callbackId: str, callback: Tuple[Callable, Tuple], timeout: float = None):
         """Add a callback to a specific trigger."""
-        self.get_trigger(triggerId).add_callback(callbackId, callback)
+        self.get_trigger(triggerId).add_callback(callbackId, callback, timeout)
         logging.debug(f"Callback {callbackId} added to trigger {triggerId}")
 
     def add_http_callback(self, triggerId: str, callbackId: str, address: str):
@@ -154,15 +437,43 @@ class TriggerHandler:
         self.get_trigger(triggerId).remove_callback(callbackId)
         logging.debug(f"Callback {callbackId} removed from trigger {triggerId}")
         
+    def add_timeline(self, triggerId: str, timelineId: str, cues: List[Tuple[float, Callable, Tuple]], preempt: bool = True):
+        """
+        Add a timeline to a specific trigger.
+
+        :param cues: (offset in seconds, callable, args) tuples.
+        :param preempt: Cancel a still running instance when the trigger fires again.
+        """
+        self.get_trigger(triggerId).add_timeline(Timeline(timelineId, cues, preempt))
+        logging.debug(f"Timeline {timelineId} added to trigger {triggerId}")
+
+    def remove_timeline(self, triggerId: str, timelineId: str):
+        """Remove a timeline from a specific trigger."""
+        self.get_trigger(triggerId).remove_timeline(timelineId)
+        logging.debug(f"Timeline {timelineId} removed from trigger {triggerId}")
+
+    def cancel_timelines(self, triggerId: str, timelineId: str = None) -> int:
+        """Cancel the running timelines of a specific trigger, returns how many were cancelled."""
+        return self.get_trigger(triggerId).cancel_timelines(timelineId)
+
     def trigger(self, triggerId: str):
         """Execute all callbacks associated with a specific trigger."""
         try:
             self.get_trigger(triggerId).trigger()
             return "", 200
+        except CallbackQueueFullError as e:
+            logging.error(f"Error dispatching callbacks for trigger {triggerId}: {e}")
+            return "", 503
         except Exception as e:
             logging.error(f"Error executing callbacks for trigger {triggerId}: {e}")
             return "", 500
 
+    def get_completion_log(self, triggerId: str = None, limit: int = None) -> list:
+        """Get the finished callbacks of all triggers or a specific one, only available in async mode."""
+        if not self.dispatcher:
+            return []
+        return self.dispatcher.get_completion_log(triggerId, limit)
+
 if __name__ == '__main__':
     app = Flask(__name__)
     handler = TriggerHandler(app)
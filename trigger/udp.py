@@ -0,0 +1,156 @@
+import hashlib
+import hmac
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Tuple
+from flask import jsonify
+from .dispatcher import CallbackQueueFullError
+
+UDP_TRIGGER_PORT = 7001
+MAGIC = b"HT"
+PROTOCOL_VERSION = 1
+# magic, version, trigger id length, boot id, sequence number
+HEADER = struct.Struct("!2sBBII")
+SIGNATURE_SIZE = 16
+MAX_DATAGRAM_SIZE = HEADER.size + 255 + SIGNATURE_SIZE
+RATE_LIMIT = 5
+RATE_BURST = 10
+
+logging.basicConfig(level=logging.INFO)
+
+
+def sign(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def encode_trigger(key: bytes, triggerId: str, boot: int, sequence: int) -> bytes:
+    """Build a signed trigger datagram, the same layout the sensor sketch sends."""
+    encoded = triggerId.encode()
+    body = HEADER.pack(MAGIC, PROTOCOL_VERSION, len(encoded), boot, sequence) + encoded
+    return body + sign(key, body)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        current_time = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (current_time - self.updated) * self.rate)
+        self.updated = current_time
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UdpTriggerListener:
+    def __init__(self, handler, key: bytes, port: int = UDP_TRIGGER_PORT, host: str = "0.0.0.0",
+                 rate: float = RATE_LIMIT, burst: int = RATE_BURST):
+        """
+        Receives signed trigger datagrams from sensors and fires the matching triggers.
+
+        A datagram carries the trigger id, the sensor's boot id and a sequence number that
+        grows with every event, signed with a truncated HMAC-SHA256 over a shared key. The boot
+        id is a counter the sensor keeps in flash and raises on every start. Only the newest
+        (boot id, sequence number) per trigger is remembered, anything not above it is dropped,
+        so repeats and replays of earlier boots are rejected alike.
+        Accepted events go through Trigger.trigger like HTTP requests, at most rate per second
+        per trigger with bursts of up to burst.
+
+        Callbacks run on the listener thread unless the handler was created with async_callbacks.
+
+        :param handler: The TriggerHandler whose triggers are fired.
+        :param key: Shared secret the sensors sign with, must not be empty.
+        """
+        if not key:
+            raise ValueError("A key is required for UDP triggers")
+        self.handler = handler
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.sequences: Dict[str, Tuple[int, int]] = {}
+        self.buckets: Dict[str, _TokenBucket] = {}
+        self.counters = dict.fromkeys(('received', 'accepted', 'duplicate', 'bad_signature', 'malformed',
+                                       'unknown_trigger', 'rate_limited', 'rejected'), 0)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.5)
+        self.port = self.sock.getsockname()[1]
+        self.stopFlag = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="udp-trigger")
+        self.thread.start()
+        self._setup_routes()
+        logging.info(f"Listening for UDP triggers on port {self.port}")
+
+    def _setup_routes(self):
+        self.handler.app.route('/trigger/api/udp', endpoint='udp_trigger_stats')(lambda: jsonify(self.stats()))
+
+    def _run(self):
+        buffer = bytearray(MAX_DATAGRAM_SIZE)
+        view = memoryview(buffer)
+        while not self.stopFlag.is_set():
+            try:
+                size = self.sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self.stopFlag.is_set():
+                    logging.error(f"Error receiving UDP trigger: {e}")
+                continue
+            self.counters['received'] += 1
+            self.counters[self._handle(view[:size])] += 1
+
+    def _handle(self, datagram: memoryview) -> str:
+        """Process one datagram and return the counter it falls under."""
+        if len(datagram) < HEADER.size + SIGNATURE_SIZE:
+            return 'malformed'
+        magic, version, id_length, boot, sequence = HEADER.unpack_from(datagram)
+        if magic != MAGIC or version != PROTOCOL_VERSION or len(datagram) != HEADER.size + id_length + SIGNATURE_SIZE:
+            return 'malformed'
+        body = datagram[:-SIGNATURE_SIZE]
+        if not hmac.compare_digest(sign(self.key, body), datagram[-SIGNATURE_SIZE:]):
+            return 'bad_signature'
+        try:
+            triggerId = bytes(body[HEADER.size:]).decode()
+        except UnicodeDecodeError:
+            return 'malformed'
+        if not self.handler.trigger_exists(triggerId):
+            return 'unknown_trigger'
+        if not self._is_new(triggerId, boot, sequence):
+            return 'duplicate'
+        bucket = self.buckets.setdefault(triggerId, _TokenBucket(self.rate, self.burst))
+        if not bucket.take():
+            return 'rate_limited'
+        try:
+            self.handler.get_trigger(triggerId).trigger()
+        except CallbackQueueFullError as e:
+            logging.error(f"Error dispatching callbacks for trigger {triggerId}: {e}")
+            return 'rejected'
+        except Exception as e:
+            logging.error(f"Error executing callbacks for trigger {triggerId}: {e}")
+            return 'rejected'
+        return 'accepted'
+
+    def _is_new(self, triggerId: str, boot: int, sequence: int) -> bool:
+        last = self.sequences.get(triggerId)
+        if last is not None and (boot, sequence) <= last:
+            if boot < last[0]:
+                logging.warning(f"Dropping trigger {triggerId} from boot {boot}, boot {last[0]} was seen already")
+            return False
+        self.sequences[triggerId] = (boot, sequence)
+        return True
+
+    def stats(self) -> dict:
+        return {'port': self.port, 'rate_limit': self.rate, **self.counters}
+
+    def stop(self):
+        self.stopFlag.set()
+        self.thread.join()
+        self.sock.close()
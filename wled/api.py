@@ -1,96 +1,136 @@
 import logging
-import requests
+from common.fanout import fan_out
+from common.session import session_pool
+from common.statecache import state_cache
+from wled.realtime import RealtimeOutput
+
+
+def _state_changes(on: bool = None, brightness: int = None, color: tuple = None, preset: int = None):
+    """Collect the given attributes under their /json/state keys, None if one of them is invalid."""
+    changes = {}
+    if on is not None:
+        changes['on'] = bool(on)
+    if brightness is not None:
+        if brightness not in range(0, 256):
+            logging.error(f"Invalid brightness value: {brightness}")
+            return None
+        changes['bri'] = brightness
+    if color is not None:
+        changes['col'] = tuple(color[:3])
+    if preset is not None:
+        changes['ps'] = preset
+    return changes
+
+def _state_payload(changes: dict) -> dict:
+    payload = {key: value for key, value in changes.items() if key != 'col'}
+    if 'col' in changes:
+        payload['seg'] = [{'col': [list(changes['col'])]}]
+    return payload
 
 class Wled:
     def __init__(self, ip):
         self.ip = ip
-        self.base_url = f'http://{self.ip}/win'
+        self.base_url = f'http://{self.ip}/json/state'
+        self.device_state = state_cache.device(f'wled:{self.ip}', self._fetch_state)
 
-    def check_connection(self):
+    def check_connection(self, timeout: float = None):
         try:
-            res = requests.get(f'http://{self.ip}:80')
+            res = session_pool.get(f'http://{self.ip}:80', timeout=timeout)
             return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
 
-    def on(self):
-        url = f'{self.base_url}&T=1'
+    def state(self, on: bool = None, brightness: int = None, color: tuple = None, preset: int = None, transition: float = None):
+        """
+        Change several attributes with a single request to the JSON API.
+
+        Attributes the device already has are left out, nothing is sent if none are left.
+
+        :param transition: Crossfade duration in seconds for this change only.
+        """
+        changes = _state_changes(on, brightness, color, preset)
+        if changes is None:
+            return False
+        # WLED counts transitions in tenths of a second
+        extra = {'tt': round(transition * 10)} if transition is not None else None
+        ok = self.device_state.apply(changes, self._send_state, extra)
+        if preset is not None:
+            # A preset changes the other attributes in ways we cannot predict
+            self.device_state.invalidate(['on', 'bri', 'col'])
+        elif changes:
+            # Any other change leaves the preset, selecting it again has to be sent
+            self.device_state.invalidate(['ps'])
+        return ok
+
+    def _send_state(self, changes: dict):
+        payload = _state_payload(changes)
         try:
-            res = requests.get(url)
+            res = session_pool.post(self.base_url, json=payload)
             if not res.ok:
-                logging.error(f"Error turning on")
+                logging.error(f"Error setting state {payload}")
+            return res.ok
         except Exception as e:
             logging.error(f"Connection error: {e}")
+            return False
+
+    def _fetch_state(self) -> dict:
+        res = session_pool.get(self.base_url)
+        res.raise_for_status()
+        data = res.json()
+        state = {'on': data['on'], 'bri': data['bri'], 'ps': data.get('ps')}
+        segments = data.get('seg') or []
+        if segments and segments[0].get('col'):
+            state['col'] = tuple(segments[0]['col'][0][:3])
+        return state
+
+    def on(self):
+        return self.state(on=True)
 
     def off(self):
-        url = f'{self.base_url}&T=0' 
-        try:
-            res = requests.get(url)
-            if not res.ok:
-                logging.error(f"Error turning off")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
-        
-    def brightness(self, brightness: int):
+        return self.state(on=False)
 
-        if brightness not in range(0, 255):
-            logging.error(f"Invalid brightness value: {brightness}")
-        
-        url = f'{self.base_url}&A={brightness}'
-        try:
-            res = requests.get(url)
-            if not res.ok:
-                logging.error(f"Error setting brightness")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+    def brightness(self, brightness: int):
+        return self.state(brightness=brightness)
 
     def preset(self, preset: int):
-        url = f'{self.base_url}&PL={preset}'
-        try:
-            res = requests.get(url)
-            if not res.ok:
-                logging.error(f"Error setting preset")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+        return self.state(preset=preset)
 
     def color(self, color: tuple):
-        url = f'{self.base_url}&R={color[0]}&G={color[1]}&B={color[2]}'
-        try:
-            res = requests.get(url)
-            if not res.ok:
-                logging.error(f"Error setting color")
-        except Exception as e:
-            logging.error(f"Connection error: {e}")
+        return self.state(color=color)
+
+    def realtime(self, led_count: int, protocol: str = 'ddp') -> RealtimeOutput:
+        """Open a UDP realtime stream to this device, see RealtimeOutput."""
+        return RealtimeOutput([self.ip], led_count, protocol)
 
 class WledGroup:
     def __init__(self, wleds: list[Wled]):
         self.wleds = wleds
 
     def check_connection(self):
-        results = []
-        for w in self.wleds:
-            results.append(w.check_connection())
-        return results
+        return fan_out(self.wleds, lambda w: w.check_connection()).values()
 
     def on(self):
-        for w in self.wleds:
-            w.on()
+        return fan_out(self.wleds, lambda w: w.on())
 
     def off(self):
-        for w in self.wleds:
-            w.off()
+        return fan_out(self.wleds, lambda w: w.off())
 
     def brightness(self, brightness: int):
-        for w in self.wleds:
-            w.brightness(brightness)
+        return fan_out(self.wleds, lambda w: w.brightness(brightness))
 
     def preset(self, preset: int):
-        for w in self.wleds:
-            w.preset(preset)
+        return fan_out(self.wleds, lambda w: w.preset(preset))
 
     def color(self, color: tuple):
-        for w in self.wleds:
-            w.color(color)
+        return fan_out(self.wleds, lambda w: w.color(color))
+
+    def state(self, on: bool = None, brightness: int = None, color: tuple = None, preset: int = None, transition: float = None):
+        return fan_out(self.wleds, lambda w: w.state(on, brightness, color, preset, transition))
+
+    def realtime(self, led_count: int, protocol: str = 'ddp') -> RealtimeOutput:
+        """Open one UDP realtime stream that sends every frame to all devices of the group."""
+        return RealtimeOutput([w.ip for w in self.wleds], led_count, protocol)
 
 if __name__ == "__main__":
     w = Wled("<ip>")
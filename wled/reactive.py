@@ -0,0 +1,53 @@
+import numpy as np
+from wled.realtime import RealtimeOutput
+
+# Deep red for the bass up to violet for the highs
+DEFAULT_PALETTE = [(255, 0, 0), (255, 60, 0), (255, 140, 0), (200, 255, 0), (0, 255, 60), (0, 200, 255), (0, 60, 255), (160, 0, 255)]
+LEVEL_DECAY = 0.8
+FLASH_DECAY = 0.6
+MIN_BRIGHTNESS = 0.05
+
+
+class AudioReactive:
+    def __init__(self, output: RealtimeOutput, palette: list = DEFAULT_PALETTE, decay: float = LEVEL_DECAY):
+        """
+        Turn audio features into LED frames.
+
+        The strip is split into one section per frequency band in the palette's colour, each
+        lit by its band's level. The overall brightness follows the loudness and every onset
+        flashes the strip towards white. Levels rise instantly and fall off with decay.
+
+        Usage with a streaming input:
+            reactive = AudioReactive(wled_group.realtime(led_count))
+            input.add_tap(FeatureTap(input.rate, input.chunk, input.channels, reactive.update, len(reactive.palette)))
+
+        :param output: Where the frames are sent to.
+        :param palette: One RGB colour per band.
+        :param decay: Fraction of the previous level kept per chunk when the level drops.
+        """
+        self.output = output
+        self.palette = np.asarray(palette, dtype=np.float32)
+        self.decay = decay
+        bands = len(self.palette)
+        self.led_band = (np.arange(output.led_count) * bands // output.led_count).astype(np.intp)
+        self.led_colors = self.palette[self.led_band]
+        self.levels = np.zeros(bands, dtype=np.float32)
+        self.flash = 0.0
+        self.frame = np.empty((output.led_count, 3), dtype=np.uint8)
+
+    def render(self, features: dict) -> np.ndarray:
+        """Frame for the features of one chunk."""
+        np.maximum(features['bands'], self.levels * self.decay, out=self.levels)
+        self.flash = 1.0 if features['onset'] else self.flash * FLASH_DECAY
+        brightness = MIN_BRIGHTNESS + (1 - MIN_BRIGHTNESS) * min(1.0, features['level'])
+
+        pixels = self.led_colors * (self.levels[self.led_band, None] * brightness)
+        if self.flash > 0.01:
+            pixels += (255 - pixels) * self.flash
+        np.clip(pixels, 0, 255, out=pixels)
+        self.frame[:] = pixels
+        return self.frame
+
+    def update(self, features: dict):
+        """Render and send a frame, meant as the consumer of a FeatureTap."""
+        self.output.send(self.render(features))
@@ -0,0 +1,157 @@
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Callable, List
+import numpy as np
+
+DDP_PORT = 4048
+DRGB_PORT = 21324
+DDP_HEADER = struct.Struct("!BBBBIH")
+DDP_VERSION = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_DESTINATION_DISPLAY = 0x01
+DDP_MAX_LEDS = 480
+DRGB_PROTOCOL = 2
+DRGB_MAX_LEDS = 490
+# Seconds WLED keeps showing realtime data after the last packet before returning to its own effect
+REALTIME_TIMEOUT = 2
+DEFAULT_FPS = 40
+
+logging.basicConfig(level=logging.INFO)
+
+class RealtimeOutput:
+    def __init__(self, ips: List[str], led_count: int, protocol: str = 'ddp', timeout: int = REALTIME_TIMEOUT):
+        """
+        Stream per-LED frames to one or more WLED devices over UDP.
+
+        Packets are built once per frame into preallocated buffers and sent to every device
+        from a single socket, so broadcasting to a group costs one sendto per device and packet.
+
+        :param ips: Addresses of the WLED devices, all showing the same frame.
+        :param led_count: Number of LEDs per device.
+        :param protocol: 'ddp' (any length, split into packets of 480 LEDs) or 'drgb' (up to 490 LEDs).
+        :param timeout: DRGB only, seconds until the device falls back to its own effect.
+        """
+        if protocol not in ('ddp', 'drgb'):
+            raise ValueError(f"Unknown realtime protocol '{protocol}'")
+        if protocol == 'drgb' and led_count > DRGB_MAX_LEDS:
+            raise ValueError(f"DRGB supports at most {DRGB_MAX_LEDS} LEDs, use DDP for {led_count}")
+        self.protocol = protocol
+        self.led_count = led_count
+        port = DDP_PORT if protocol == 'ddp' else DRGB_PORT
+        self.targets = [(ip, port) for ip in ips]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sequence = 0
+        self.frames = 0
+        self.bytes = 0
+
+        if protocol == 'ddp':
+            self.chunks = [(start, min(led_count, start + DDP_MAX_LEDS)) for start in range(0, led_count, DDP_MAX_LEDS)]
+            header_size = DDP_HEADER.size
+        else:
+            self.chunks = [(0, led_count)]
+            header_size = 2
+        self.packets = [bytearray(header_size + (end - start) * 3) for start, end in self.chunks]
+        self.views = [memoryview(packet) for packet in self.packets]
+        self.header_size = header_size
+        if protocol == 'drgb':
+            self.packets[0][0] = DRGB_PROTOCOL
+            self.packets[0][1] = timeout
+
+    def send(self, frame: np.ndarray):
+        """
+        Send a frame to all devices.
+
+        :param frame: (led_count, 3) array of RGB values, converted to uint8 if needed.
+        """
+        pixels = memoryview(np.ascontiguousarray(frame, dtype=np.uint8).reshape(-1))
+        if len(pixels) != self.led_count * 3:
+            raise ValueError(f"Expected a frame of {self.led_count} LEDs, got {len(pixels) // 3}")
+
+        if self.protocol == 'ddp':
+            # DDP sequence numbers run from 1 to 15, 0 means not used
+            self.sequence = self.sequence % 15 + 1
+        last = len(self.chunks) - 1
+        for i, (start, end) in enumerate(self.chunks):
+            if self.protocol == 'ddp':
+                flags = DDP_VERSION | (DDP_PUSH if i == last else 0)
+                DDP_HEADER.pack_into(self.packets[i], 0, flags, self.sequence, DDP_TYPE_RGB24,
+                                     DDP_DESTINATION_DISPLAY, start * 3, (end - start) * 3)
+            self.views[i][self.header_size:] = pixels[start * 3:end * 3]
+
+        for target in self.targets:
+            for packet in self.packets:
+                try:
+                    self.sock.sendto(packet, target)
+                    self.bytes += len(packet)
+                except OSError as e:
+                    logging.error(f"Error sending realtime frame to {target[0]}: {e}")
+        self.frames += 1
+
+    def blank(self):
+        """Turn all LEDs off."""
+        self.send(np.zeros((self.led_count, 3), dtype=np.uint8))
+
+    def stats(self) -> dict:
+        return {
+            'protocol': self.protocol,
+            'targets': [ip for ip, _ in self.targets],
+            'frames': self.frames,
+            'bytes': self.bytes,
+        }
+
+    def close(self):
+        self.sock.close()
+
+class Animation:
+    def __init__(self, output: RealtimeOutput, render: Callable[[float], np.ndarray], fps: float = DEFAULT_FPS, duration: float = None):
+        """
+        Render and send frames at a fixed rate on a background thread.
+
+        Frames are paced against absolute deadlines so the rate does not drift with render
+        time. If rendering falls behind, frames are skipped rather than sent in a burst.
+
+        :param output: Where frames are sent to.
+        :param render: Returns the frame for a time in seconds since the start of the animation.
+        :param fps: Frames per second, WLED handles 30 to 60 well.
+        :param duration: Stop after this many seconds, run until stop() if omitted.
+        """
+        self.output = output
+        self.render = render
+        self.interval = 1 / fps
+        self.duration = duration
+        self.stopFlag = threading.Event()
+        self.thread = None
+        self.skipped = 0
+
+    def start(self):
+        self.stopFlag.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="wled-animation")
+        self.thread.start()
+
+    def _run(self):
+        start = time.monotonic()
+        frame_index = 0
+        while not self.stopFlag.is_set():
+            elapsed = frame_index * self.interval
+            if self.duration is not None and elapsed >= self.duration:
+                break
+            try:
+                self.output.send(self.render(elapsed))
+            except Exception as e:
+                logging.error(f"Error rendering animation frame: {e}")
+                break
+            frame_index += 1
+            behind = int((time.monotonic() - start) / self.interval) - frame_index
+            if behind > 0:
+                self.skipped += behind
+                frame_index += behind
+            self.stopFlag.wait(max(0, start + frame_index * self.interval - time.monotonic()))
+
+    def stop(self):
+        self.stopFlag.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()